@@ -0,0 +1,141 @@
+from pritunl.constants import *
+from pritunl import settings
+from pritunl import mongo
+from pritunl import logger
+from pritunl import utils
+
+import os
+import json
+import threading
+import collections
+import pymongo
+from bson import json_util
+
+# Audit events are queued in memory and written in bulk by the audit
+# runner. Batches that fail to write are appended to the spill file and
+# replayed once the database is available. Events are given an id when
+# queued so replays of partially written batches are not duplicated.
+_lock = threading.Lock()
+_queue = collections.deque()
+_stats = collections.Counter()
+
+def add_event(doc):
+    doc['_id'] = utils.ObjectId()
+
+    _lock.acquire()
+    try:
+        if len(_queue) >= AUDIT_QUEUE_MAX:
+            _queue.popleft()
+            _stats['dropped'] += 1
+        _queue.append(doc)
+        _stats['queued'] += 1
+    finally:
+        _lock.release()
+
+def _pop_events(count=None):
+    docs = []
+
+    _lock.acquire()
+    try:
+        while _queue and (count is None or len(docs) < count):
+            docs.append(_queue.popleft())
+    finally:
+        _lock.release()
+
+    return docs
+
+def _insert(docs):
+    try:
+        mongo.get_collection('users_audit').insert_many(docs, ordered=False)
+    except pymongo.errors.BulkWriteError as error:
+        for write_error in error.details.get('writeErrors', []):
+            if write_error.get('code') != 11000:
+                raise
+
+    _stats['written'] += len(docs)
+
+def _spill(docs):
+    if not docs:
+        return
+
+    spill_path = settings.conf.audit_spill_path
+    try:
+        if os.path.exists(spill_path) and \
+                os.path.getsize(spill_path) > AUDIT_SPILL_MAX:
+            raise ValueError('Audit spill file is full')
+
+        with open(spill_path, 'a') as spill_file:
+            for doc in docs:
+                spill_file.write(json.dumps(
+                    doc, default=json_util.default) + '\n')
+        _stats['spilled'] += len(docs)
+    except:
+        _stats['dropped'] += len(docs)
+        logger.exception('Failed to spill audit events', 'audit',
+            spill_path=spill_path,
+            count=len(docs),
+        )
+
+def _replay_spill():
+    spill_path = settings.conf.audit_spill_path
+    if not os.path.exists(spill_path):
+        return
+
+    docs = []
+    with open(spill_path, 'r') as spill_file:
+        for line in spill_file:
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                docs.append(json.loads(line,
+                    object_hook=json_util.object_hook))
+            except ValueError:
+                logger.warning('Skipping invalid audit spill line', 'audit')
+                continue
+
+            if len(docs) >= AUDIT_BATCH_SIZE:
+                _insert(docs)
+                docs = []
+
+    if docs:
+        _insert(docs)
+
+    os.remove(spill_path)
+    logger.info('Replayed spilled audit events', 'audit')
+
+def flush_audit():
+    try:
+        _replay_spill()
+    except:
+        logger.exception('Failed to replay audit spill file', 'audit')
+        _spill(_pop_events())
+        return
+
+    while True:
+        docs = _pop_events(AUDIT_BATCH_SIZE)
+        if not docs:
+            break
+
+        try:
+            _insert(docs)
+        except:
+            logger.exception('Failed to write audit events', 'audit')
+            _spill(docs + _pop_events())
+            break
+
+def get_stats():
+    _lock.acquire()
+    try:
+        stats = {
+            'pending': len(_queue),
+            'queued': _stats['queued'],
+            'written': _stats['written'],
+            'spilled': _stats['spilled'],
+            'dropped': _stats['dropped'],
+        }
+    finally:
+        _lock.release()
+
+    return stats
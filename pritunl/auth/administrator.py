@@ -6,6 +6,8 @@ from pritunl import settings
 from pritunl import utils
 from pritunl import mongo
 from pritunl import logger
+from pritunl import messenger
+from pritunl import audit
 from pritunl import sso
 
 import base64
@@ -17,6 +19,22 @@ import hmac
 import pymongo
 import uuid
 import struct
+import threading
+import time
+import copy
+import collections
+
+# Administrator docs are cached by id with a token index for api auth,
+# commits on any host publish an invalidation on the administrators
+# channel. Api nonces are checked against a local window which is
+# persisted in bulk and refreshed with nonces used on other hosts.
+_admins_lock = threading.Lock()
+_admins = collections.OrderedDict()
+_admin_tokens = {}
+_nonces_lock = threading.Lock()
+_nonces = {}
+_nonces_queue = []
+_nonces_sync = None
 
 class Administrator(mongo.MongoObject):
     fields = {
@@ -230,6 +248,7 @@ class Administrator(mongo.MongoObject):
                 '$slice': -settings.app.session_limit,
             },
         }})
+        invalidate_admin(self.id)
         return session_id
 
     def commit(self, *args, **kwargs):
@@ -252,12 +271,17 @@ class Administrator(mongo.MongoObject):
             self.generate_secret()
 
         mongo.MongoObject.commit(self, *args, **kwargs)
+        invalidate_admin(self.id)
+
+    def remove(self):
+        mongo.MongoObject.remove(self)
+        invalidate_admin(self.id)
 
     def audit_event(self, event_type, event_msg, remote_addr=None):
         if settings.app.auditing != ALL:
             return
 
-        self.audit_collection.insert_one({
+        audit.add_event({
             'user_id': self.id,
             'timestamp': utils.now(),
             'type': event_type,
@@ -282,21 +306,231 @@ class Administrator(mongo.MongoObject):
 
         return events
 
+def _cache_remove(admin_id):
+    cached = _admins.pop(admin_id, None)
+    if not cached:
+        return
+    token = cached[1].get('token')
+    if token and _admin_tokens.get(token) == admin_id:
+        _admin_tokens.pop(token, None)
+
+def _cache_get(admin_id):
+    _admins_lock.acquire()
+    try:
+        cached = _admins.get(admin_id)
+        if not cached:
+            return
+        if time.time() - cached[0] > ADMIN_CACHE_TTL:
+            _cache_remove(admin_id)
+            return
+        _admins[admin_id] = _admins.pop(admin_id)
+        return cached[1]
+    finally:
+        _admins_lock.release()
+
+def _cache_load(spec):
+    doc = Administrator.collection.find_one(spec)
+    if not doc:
+        return
+
+    _admins_lock.acquire()
+    try:
+        _cache_remove(doc['_id'])
+        _admins[doc['_id']] = (time.time(), doc)
+        if doc.get('token'):
+            _admin_tokens[doc['token']] = doc['_id']
+        while len(_admins) > ADMIN_CACHE_SIZE:
+            _cache_remove(next(iter(_admins)))
+    finally:
+        _admins_lock.release()
+
+    return doc
+
+def _clear_admin(admin_id):
+    _admins_lock.acquire()
+    try:
+        if admin_id is None:
+            _admins.clear()
+            _admin_tokens.clear()
+        else:
+            _cache_remove(admin_id)
+    finally:
+        _admins_lock.release()
+
+def invalidate_admin(admin_id):
+    _clear_admin(admin_id)
+    messenger.publish('administrators', admin_id)
+
+def on_admin_msg(msg):
+    _clear_admin(msg['message'])
+
+def _get_admin(doc):
+    # Each request gets a copy to prevent changes leaking into the cache
+    return Administrator(doc=copy.deepcopy(doc))
+
 def clear_session(id, session_id):
     Administrator.collection.update({
         '_id': id,
     }, {'$pull': {
         'sessions': session_id,
     }})
+    invalidate_admin(id)
 
 def get_user(id, session_id):
     if not session_id:
         return
-    user =  Administrator(spec={
-        '_id': id,
-        'sessions': session_id,
+
+    # Session may have been created on another host before the
+    # invalidation was received, reload once before rejecting
+    doc = _cache_get(id)
+    if not doc or session_id not in (doc.get('sessions') or []):
+        doc = _cache_load({'_id': id})
+        if not doc or session_id not in (doc.get('sessions') or []):
+            return
+
+    return _get_admin(doc)
+
+def get_by_token(token):
+    if not token:
+        return
+
+    _admins_lock.acquire()
+    try:
+        admin_id = _admin_tokens.get(token)
+    finally:
+        _admins_lock.release()
+
+    doc = None
+    if admin_id:
+        doc = _cache_get(admin_id)
+    if not doc or doc.get('token') != token:
+        doc = _cache_load({'token': token})
+        if not doc:
+            return
+
+    return _get_admin(doc)
+
+def check_nonce(token, nonce):
+    # Nonces seen on this host are rejected locally. New nonces are
+    # inserted before the request is accepted unless auth_nonce_async is
+    # set, in which case they are inserted by the auth runner and a
+    # replay on another host is only rejected after the next nonce sync
+    doc = {
+        'token': token,
+        'nonce': nonce,
+        'timestamp': utils.now(),
+    }
+
+    _nonces_lock.acquire()
+    try:
+        key = (token, nonce)
+        if key in _nonces:
+            return False
+        _nonces[key] = time.time()
+        if settings.app.auth_nonce_async:
+            _nonces_queue.append(doc)
+            return True
+    finally:
+        _nonces_lock.release()
+
+    try:
+        Administrator.nonces_collection.insert(doc)
+    except pymongo.errors.DuplicateKeyError:
+        return False
+
+    return True
+
+def _sync_nonces():
+    global _nonces_sync
+
+    sync_time = utils.now()
+    if _nonces_sync:
+        sync_start = _nonces_sync - datetime.timedelta(
+            seconds=AUTH_NONCE_SYNC_OVERLAP)
+    else:
+        sync_start = sync_time - datetime.timedelta(
+            seconds=settings.app.auth_time_window * 2)
+    spec = {'timestamp': {'$gte': sync_start}}
+
+    cur_time = time.time()
+    docs = Administrator.nonces_collection.find(spec, {
+        '_id': False,
+        'token': True,
+        'nonce': True,
     })
-    return user
+    keys = [(doc.get('token'), doc.get('nonce')) for doc in docs]
+    _nonces_sync = sync_time
+
+    expire_time = cur_time - settings.app.auth_time_window * 2
+
+    _nonces_lock.acquire()
+    try:
+        for key in keys:
+            if key not in _nonces:
+                _nonces[key] = cur_time
+        for key, timestamp in _nonces.items():
+            if timestamp < expire_time:
+                _nonces.pop(key, None)
+    finally:
+        _nonces_lock.release()
+
+def _requeue_nonces(docs):
+    global _nonces_queue
+
+    _nonces_lock.acquire()
+    try:
+        _nonces_queue = docs + _nonces_queue
+    finally:
+        _nonces_lock.release()
+
+def flush_nonces():
+    global _nonces_queue
+
+    _nonces_lock.acquire()
+    try:
+        docs = _nonces_queue
+        _nonces_queue = []
+    finally:
+        _nonces_lock.release()
+
+    if docs:
+        collection = Administrator.nonces_collection
+        try:
+            if mongo.has_bulk:
+                bulk = collection.initialize_unordered_bulk_op()
+                for doc in docs:
+                    bulk.insert(doc)
+                bulk.execute()
+            else:
+                for doc in docs:
+                    try:
+                        collection.insert(doc)
+                    except pymongo.errors.DuplicateKeyError:
+                        logger.warning('Auth nonce replayed on other host',
+                            'auth',
+                            token=doc['token'],
+                        )
+        except pymongo.errors.BulkWriteError as error:
+            # Only the failed inserts are requeued, the rest were written
+            failed = []
+            for write_error in error.details.get('writeErrors', []):
+                if write_error.get('code') == 11000:
+                    logger.warning('Auth nonce replayed on other host',
+                        'auth',
+                        nonce=write_error.get('op', {}).get('nonce'),
+                    )
+                    continue
+                failed.append(docs[write_error['index']])
+
+            if failed:
+                _requeue_nonces(failed)
+                raise
+        except:
+            _requeue_nonces(docs)
+            raise
+
+    if settings.app.auth_nonce_async:
+        _sync_nonces()
 
 def find_user(username=None, token=None):
     spec = {}
@@ -326,7 +560,7 @@ def check_session():
         except ValueError:
             return False
 
-        administrator = find_user(token=auth_token)
+        administrator = get_by_token(auth_token)
         if not administrator:
             return False
 
@@ -350,13 +584,7 @@ def check_session():
         if auth_signature != auth_test_signature:
             return False
 
-        try:
-            Administrator.nonces_collection.insert({
-                'token': auth_token,
-                'nonce': auth_nonce,
-                'timestamp': utils.now(),
-            })
-        except pymongo.errors.DuplicateKeyError:
+        if not check_nonce(auth_token, auth_nonce):
             return False
     else:
         if not flask.session:
@@ -433,6 +661,7 @@ def reset_password():
         password=DEFAULT_PASSWORD,
         default=True,
     ).commit()
+    invalidate_admin(None)
 
     return DEFAULT_USERNAME, DEFAULT_PASSWORD
 
@@ -1 +1,2 @@
-from pritunl.authorizer.authorizer import Authorizer
+from pritunl.authorizer.authorizer import Authorizer, add_stat, \
+    add_rejected, get_stats
@@ -5,6 +5,52 @@ from pritunl import settings
 from pritunl import sso
 
 import threading
+import time
+
+_stats_lock = threading.Lock()
+_stats = {}
+_rejected = 0
+
+def add_stat(stage, duration):
+    _stats_lock.acquire()
+    try:
+        stat = _stats.get(stage)
+        if not stat:
+            stat = [0, 0.0, 0.0]
+            _stats[stage] = stat
+        stat[0] += 1
+        stat[1] += duration
+        stat[2] = max(stat[2], duration)
+    finally:
+        _stats_lock.release()
+
+def add_rejected():
+    global _rejected
+    _stats_lock.acquire()
+    try:
+        _rejected += 1
+    finally:
+        _stats_lock.release()
+
+def get_stats():
+    stages = {}
+
+    _stats_lock.acquire()
+    try:
+        for stage, (count, total, max_duration) in _stats.items():
+            stages[stage] = {
+                'count': count,
+                'avg': round(total / count, 4),
+                'max': round(max_duration, 4),
+            }
+        rejected = _rejected
+    finally:
+        _stats_lock.release()
+
+    return {
+        'stages': stages,
+        'rejected': rejected,
+    }
 
 class Authorizer(object):
     __slots__ = (
@@ -17,10 +63,11 @@ class Authorizer(object):
         'reauth',
         'callback',
         'push_type',
+        'push_queue',
     )
 
     def __init__(self, svr, usr, remote_ip, plaform, device_name,
-            password, reauth, callback):
+            password, reauth, callback, push_queue=None):
         self.server = svr
         self.user = usr
         self.remote_ip = remote_ip
@@ -30,6 +77,7 @@ class Authorizer(object):
         self.reauth = reauth
         self.callback = callback
         self.push_type = None
+        self.push_queue = push_queue
 
     def _set_push_type(self):
         if settings.app.sso and DUO_AUTH in self.user.auth_type and \
@@ -42,19 +90,22 @@ class Authorizer(object):
 
     def authenticate(self):
         try:
-            self._check_call(self._check_primary)
-            self._check_call(self._check_password)
-            self._check_call(self._check_sso)
+            self._check_call('primary', self._check_primary)
+            self._check_call('password', self._check_password)
+            self._check_call('sso', self._check_sso)
             if not self.reauth:
-                self._check_call(self._check_push)
+                self._check_call('push', self._check_push)
             self.callback(True)
         except:
             pass
 
-    def _check_call(self, func):
+    def _check_call(self, stage, func):
+        start = time.time()
         try:
             func()
+            add_stat(stage, time.time() - start)
         except AuthError, err:
+            add_stat(stage, time.time() - start)
             self.callback(False, str(err))
             raise
         except AuthForked:
@@ -131,14 +182,19 @@ class Authorizer(object):
 
         def thread_func():
             try:
-                self._check_call(self._auth_push_thread)
+                self._check_call('push', self._auth_push_thread)
             except:
                 return
             self.callback(True)
 
-        thread = threading.Thread(target=thread_func)
-        thread.daemon = True
-        thread.start()
+        if self.push_queue:
+            if not self.push_queue.put_nowait(thread_func):
+                add_rejected()
+                raise AuthError('Too many pending push authentications')
+        else:
+            thread = threading.Thread(target=thread_func)
+            thread.daemon = True
+            thread.start()
 
         raise AuthForked()
 
@@ -1,3 +1,4 @@
+from pritunl.cache.timer_wheel import *
 from pritunl.cache.tunldb import *
 cache_db = TunlDB()
 
@@ -0,0 +1,180 @@
+from pritunl import logger
+
+import time
+import threading
+
+TIMER_WHEEL_TICK = 0.1
+TIMER_WHEEL_SLOTS = 64
+TIMER_WHEEL_LEVELS = 4
+
+class TimerWheelTimer(object):
+    __slots__ = ('wheel', 'expire_tick', 'callback', 'args', 'slot')
+
+    def __init__(self, wheel, expire_tick, callback, args):
+        self.wheel = wheel
+        self.expire_tick = expire_tick
+        self.callback = callback
+        self.args = args
+        self.slot = None
+
+    def cancel(self):
+        self.wheel.cancel(self)
+
+class TimerWheel(object):
+    # Hierarchical timer wheel, timers are placed on the lowest level that
+    # contains their expire tick and cascade down as the wheel turns. All
+    # timers share a single thread, schedule and cancel are constant time.
+    def __init__(self, tick=TIMER_WHEEL_TICK, slots=TIMER_WHEEL_SLOTS,
+            levels=TIMER_WHEEL_LEVELS):
+        self._tick = tick
+        self._slots = slots
+        self._levels = levels
+        self._spans = [slots ** x for x in xrange(levels + 1)]
+        self._wheels = [[set() for _ in xrange(slots)]
+            for _ in xrange(levels)]
+        self._overflow = set()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._cur_tick = None
+        self._thread = None
+        self._live = 0
+        self._expired = 0
+        self._rate_time = time.time()
+        self._rate_count = 0
+        self._rate = 0.0
+
+    def _now_tick(self):
+        return int(time.time() / self._tick)
+
+    def _place(self, timer, fire):
+        expire_tick = timer.expire_tick
+        cur_tick = self._cur_tick
+
+        if expire_tick <= cur_tick:
+            timer.slot = None
+            fire.append(timer)
+            return
+
+        for level in xrange(self._levels):
+            span = self._spans[level + 1]
+            if expire_tick // span == cur_tick // span:
+                index = (expire_tick // self._spans[level]) % self._slots
+                slot = self._wheels[level][index]
+                break
+        else:
+            slot = self._overflow
+
+        slot.add(timer)
+        timer.slot = slot
+
+    def _cascade(self, slot, fire):
+        timers = list(slot)
+        slot.clear()
+        for timer in timers:
+            self._place(timer, fire)
+
+    def _advance(self):
+        fire = []
+        now_tick = self._now_tick()
+
+        while self._cur_tick < now_tick:
+            self._cur_tick += 1
+            cur_tick = self._cur_tick
+
+            if cur_tick % self._spans[self._levels] == 0:
+                self._cascade(self._overflow, fire)
+
+            for level in xrange(self._levels - 1, 0, -1):
+                span = self._spans[level]
+                if cur_tick % span == 0:
+                    index = (cur_tick // span) % self._slots
+                    self._cascade(self._wheels[level][index], fire)
+
+            slot = self._wheels[0][cur_tick % self._slots]
+            fire.extend(slot)
+            slot.clear()
+
+        for timer in fire:
+            timer.slot = None
+        self._live -= len(fire)
+        self._expired += len(fire)
+        self._rate_count += len(fire)
+
+        return fire
+
+    def _update_rate(self):
+        cur_time = time.time()
+        elapsed = cur_time - self._rate_time
+        if elapsed >= 1:
+            self._rate = self._rate_count / elapsed
+            self._rate_count = 0
+            self._rate_time = cur_time
+
+    def _run_thread(self):
+        while True:
+            self._cond.acquire()
+            try:
+                while not self._live:
+                    self._update_rate()
+                    self._cond.wait(1)
+                fire = self._advance()
+                self._update_rate()
+            finally:
+                self._cond.release()
+
+            for timer in fire:
+                try:
+                    timer.callback(*timer.args)
+                except:
+                    logger.exception('Error in timer wheel callback', 'cache')
+
+            time.sleep(self._tick)
+
+    def schedule(self, delay, callback, *args):
+        self._cond.acquire()
+        try:
+            # Wheel is empty when there are no live timers, skip the
+            # idle ticks instead of turning the wheel through them
+            if self._cur_tick is None or not self._live:
+                self._cur_tick = self._now_tick()
+
+            expire_tick = int((time.time() + max(delay, 0)) /
+                self._tick) + 1
+            timer = TimerWheelTimer(self, expire_tick, callback, args)
+            self._place(timer, None)
+            self._live += 1
+
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run_thread)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+        return timer
+
+    def cancel(self, timer):
+        self._cond.acquire()
+        try:
+            if timer.slot is None:
+                return False
+            timer.slot.discard(timer)
+            timer.slot = None
+            self._live -= 1
+        finally:
+            self._cond.release()
+        return True
+
+    def stats(self):
+        self._cond.acquire()
+        try:
+            return {
+                'live': self._live,
+                'expired': self._expired,
+                'expire_rate': self._rate,
+            }
+        finally:
+            self._cond.release()
+
+timer_wheel = TimerWheel()
@@ -1,3 +1,5 @@
+from pritunl.cache.timer_wheel import timer_wheel
+
 import Queue
 import time
 import collections
@@ -29,10 +31,40 @@ TRANSACTION_METHODS = {
 }
 CHANNEL_TTL = 120
 CHANNEL_BUFFER = 128
+COMPACT_OPS = 10000
+COMPACT_INTERVAL = 600
+
+def _persist(method):
+    # Record mutating calls in the operation log when persistence is
+    # enabled, nested calls are covered by the outer call
+    name = method.__name__
+
+    def _wrapped(self, *args, **kwargs):
+        if not self._path or self._replaying:
+            return method(self, *args, **kwargs)
+
+        self._persist_lock.acquire()
+        try:
+            self._persist_depth += 1
+            try:
+                value = method(self, *args, **kwargs)
+            finally:
+                self._persist_depth -= 1
+
+            if not self._persist_depth:
+                self._log_op(name, args, kwargs, value)
+
+            return value
+        finally:
+            self._persist_lock.release()
+
+    _wrapped.__name__ = name
+    return _wrapped
 
 class TunlDB(object):
-    def __init__(self):
+    def __init__(self, wheel=None):
         self._path = None
+        self._wheel = wheel or timer_wheel
         self._set_queue = Queue.Queue()
         self._data = collections.defaultdict(
             lambda: {'ttl': None, 'val': None})
@@ -42,6 +74,18 @@ class TunlDB(object):
                 maxlen=CHANNEL_BUFFER), 'timer': None})
         self._commit_log = []
         self._locks = collections.defaultdict(threading.Lock)
+        self._persist_lock = threading.RLock()
+        self._persist_depth = 0
+        self._export_lock = threading.Lock()
+        self._replaying = False
+        self._log_id = None
+        self._log_pending = []
+        self._log_count = 0
+        self._compact_time = time.time()
+
+    @property
+    def _log_path(self):
+        return self._path + '.log'
 
     def _put_queue(self):
         if self._path:
@@ -59,63 +103,93 @@ class TunlDB(object):
                     self._set_queue.get(timeout=0.01)
                 except Queue.Empty:
                     pass
-            self.export_data()
+
+            if self._log_count >= COMPACT_OPS or \
+                    time.time() - self._compact_time >= COMPACT_INTERVAL:
+                self.export_data()
+            else:
+                self.flush_log()
+
+    def _get_data(self, key):
+        data = self._data.get(key)
+        if data:
+            ttl = data['ttl']
+            if ttl and ttl <= int(time.time() * 1000):
+                self.remove(key)
+                return None
+        return data
 
     def _validate(self, value):
         if value is not None and not isinstance(value, basestring):
             raise TypeError('Value must be string')
 
+    def _log_op(self, name, args, kwargs, value):
+        if name == 'set_pop':
+            if value is None:
+                return
+            name = 'set_remove'
+            args = (args[0], value)
+
+        self._log_pending.append(json.dumps(
+            (time.time(), name, args, kwargs)))
+
     def persist(self, path, auto_export=True):
         if self._path:
             raise ValueError('Persist is already set')
         self._path = path
         self.import_data()
+        self.export_data()
         if auto_export:
             export_thread = threading.Thread(target=self._export_thread)
             export_thread.daemon = True
             export_thread.start()
 
+    @_persist
     def set(self, key, value):
         self._validate(value)
         self._data[key]['val'] = value
         self._put_queue()
 
     def get(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             return data['val']
 
     def exists(self, key):
-        return key in self._data
+        return self._get_data(key) is not None
 
+    @_persist
     def rename(self, key, new_key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             self._data[new_key]['val'] = data['val']
             self.remove(key)
             self._put_queue()
 
+    @_persist
     def remove(self, key):
+        cur_timer = self._timers.pop(key, None)
+        if cur_timer:
+            cur_timer.cancel()
         self._data.pop(key, None)
         self._put_queue()
 
+    @_persist
     def expire(self, key, ttl):
         ttl_time = int(time.time() * 1000) + (ttl * 1000)
 
         cur_timer = self._timers.pop(key, None)
         if cur_timer:
             cur_timer.cancel()
-        timer = threading.Timer(ttl, self.remove, (key,))
-        timer.daemon = True
-        self._timers[key] = timer
-        timer.start()
+        self._timers[key] = self._wheel.schedule(ttl, self.remove, key)
 
         self._data[key]['ttl'] = ttl_time
         self._put_queue()
 
+    @_persist
     def increment(self, key):
         value = '1'
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 value = str(int(data['val']) + 1)
@@ -127,9 +201,10 @@ class TunlDB(object):
         self._put_queue()
         return value
 
+    @_persist
     def decrement(self, key):
         value = '-1'
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 value = str(int(data['val']) - 1)
@@ -144,9 +219,16 @@ class TunlDB(object):
     def keys(self):
         return set(self._data)
 
+    def stats(self):
+        stats = self._wheel.stats()
+        stats['keys'] = len(self._data)
+        stats['expire_keys'] = len(self._timers)
+        return stats
+
+    @_persist
     def set_add(self, key, element):
         self._validate(element)
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 data['val'].add(element)
@@ -156,8 +238,9 @@ class TunlDB(object):
             self._data[key]['val'] = {element}
         self._put_queue()
 
+    @_persist
     def set_remove(self, key, element):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 data['val'].remove(element)
@@ -165,9 +248,10 @@ class TunlDB(object):
             except (KeyError, AttributeError):
                 pass
 
+    @_persist
     def set_pop(self, key):
         value = None
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 value = data['val'].pop()
@@ -177,7 +261,7 @@ class TunlDB(object):
         return value
 
     def set_exists(self, key, element):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return element in data['val']
@@ -186,7 +270,7 @@ class TunlDB(object):
         return False
 
     def set_elements(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return data['val'].copy()
@@ -195,7 +279,7 @@ class TunlDB(object):
         return set()
 
     def set_iter(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 for value in data['val'].copy():
@@ -204,7 +288,7 @@ class TunlDB(object):
                 pass
 
     def set_length(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return len(data['val'])
@@ -212,9 +296,10 @@ class TunlDB(object):
                 pass
         return 0
 
+    @_persist
     def list_lpush(self, key, value):
         self._validate(value)
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 data['val'].appendleft(value)
@@ -224,9 +309,10 @@ class TunlDB(object):
             self._data[key]['val'] = collections.deque([value])
         self._put_queue()
 
+    @_persist
     def list_rpush(self, key, value):
         self._validate(value)
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 data['val'].append(value)
@@ -236,9 +322,10 @@ class TunlDB(object):
             self._data[key]['val'] = collections.deque([value])
         self._put_queue()
 
+    @_persist
     def list_lpop(self, key):
         value = None
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 value = data['val'].popleft()
@@ -247,9 +334,10 @@ class TunlDB(object):
                 pass
         return value
 
+    @_persist
     def list_rpop(self, key):
         value = None
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 value = data['val'].pop()
@@ -259,7 +347,7 @@ class TunlDB(object):
         return value
 
     def list_index(self, key, index):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return data['val'][index]
@@ -267,7 +355,7 @@ class TunlDB(object):
                 pass
 
     def list_elements(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return list(data['val'])
@@ -276,7 +364,7 @@ class TunlDB(object):
         return []
 
     def list_iter(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 for value in copy.copy(data['val']):
@@ -285,7 +373,7 @@ class TunlDB(object):
                 pass
 
     def list_iter_range(self, key, start, stop=None):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 for value in itertools.islice(
@@ -294,9 +382,10 @@ class TunlDB(object):
             except TypeError:
                 pass
 
+    @_persist
     def list_remove(self, key, value, count=1):
         self._validate(value)
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             if count:
                 try:
@@ -312,7 +401,7 @@ class TunlDB(object):
             self._put_queue()
 
     def list_length(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return len(data['val'])
@@ -320,9 +409,10 @@ class TunlDB(object):
                 pass
         return 0
 
+    @_persist
     def dict_set(self, key, field, value):
         self._validate(value)
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 data['val'][field] = value
@@ -333,15 +423,16 @@ class TunlDB(object):
         self._put_queue()
 
     def dict_get(self, key, field):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return data['val'].get(field)
             except TypeError:
                 pass
 
+    @_persist
     def dict_remove(self, key, field):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 data['val'].pop(field, None)
@@ -350,7 +441,7 @@ class TunlDB(object):
             self._put_queue()
 
     def dict_keys(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return set(data['val'])
@@ -359,7 +450,7 @@ class TunlDB(object):
         return set()
 
     def dict_values(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return set(data['val'].values())
@@ -368,7 +459,7 @@ class TunlDB(object):
         return set()
 
     def dict_iter(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             data_copy = data['val'].copy()
             try:
@@ -378,7 +469,7 @@ class TunlDB(object):
                 pass
 
     def dict_get_all(self, key):
-        data = self._data.get(key)
+        data = self._get_data(key)
         if data:
             try:
                 return data['val'].copy()
@@ -433,10 +524,8 @@ class TunlDB(object):
         cur_timer = self._channels[channel]['timer']
         if cur_timer:
             cur_timer.cancel()
-        timer = threading.Timer(CHANNEL_TTL, self._clear_channel, (channel,))
-        timer.daemon = True
-        self._channels[channel]['timer'] = timer
-        timer.start()
+        self._channels[channel]['timer'] = self._wheel.schedule(
+            CHANNEL_TTL, self._clear_channel, channel)
 
         self._channels[channel]['msgs'].append((uuid.uuid4().hex, message))
         for subscriber in self._channels[channel]['subs'].copy():
@@ -445,6 +534,7 @@ class TunlDB(object):
     def transaction(self):
         return TunlDBTransaction(self)
 
+    @_persist
     def _apply_trans(self, trans):
         for call in trans[1]:
             getattr(self, call[0])(*call[1], **call[2])
@@ -468,46 +558,116 @@ class TunlDB(object):
         self._locks.pop(key, None)
         return TunlDBTransaction(self)
 
+    def flush_log(self):
+        if not self._path:
+            return
+
+        self._export_lock.acquire()
+        try:
+            self._persist_lock.acquire()
+            try:
+                ops = self._log_pending
+                self._log_pending = []
+            finally:
+                self._persist_lock.release()
+
+            if not ops:
+                return
+
+            with open(self._log_path, 'a') as log_file:
+                log_file.write('\n'.join(ops) + '\n')
+            self._log_count += len(ops)
+        finally:
+            self._export_lock.release()
+
     def export_data(self):
         if not self._path:
             return
+
+        self._export_lock.acquire()
+        try:
+            self._compact()
+        finally:
+            self._export_lock.release()
+
+    def _compact(self):
+        # Write snapshot of data and start a new operation log, the log id
+        # links the snapshot to the log that must be replayed after it
+        log_id = uuid.uuid4().hex
         temp_path = self._path + '_%s.tmp' % uuid.uuid4().hex
+        temp_log_path = self._log_path + '_%s.tmp' % uuid.uuid4().hex
+
+        self._persist_lock.acquire()
         try:
-            data = self._data.copy()
+            export_data = []
+            for key, data in self._data.items():
+                key_ttl = data['ttl']
+                key_val = data['val']
+                key_type = type(key_val).__name__
+                if key_type == 'set' or key_type == 'deque':
+                    key_val = list(key_val)
+                elif key_type == 'dict':
+                    key_val = key_val.copy()
+                export_data.append((key, key_type, key_ttl, key_val))
             timers = self._timers.keys()
             commit_log = copy.copy(self._commit_log)
+            self._log_pending = []
+        finally:
+            self._persist_lock.release()
 
+        try:
             with open(temp_path, 'w') as db_file:
                 os.chmod(temp_path, 0600)
-                export_data = []
-
-                for key in data:
-                    key_ttl = data[key]['ttl']
-                    key_val = data[key]['val']
-                    key_type = type(key_val).__name__
-                    if key_type == 'set' or key_type == 'deque':
-                        key_val = list(key_val)
-                    export_data.append((key, key_type, key_ttl, key_val))
-
                 db_file.write(json.dumps({
-                    'ver': 1,
+                    'ver': 2,
+                    'log_id': log_id,
                     'data': export_data,
                     'timers': timers,
                     'commit_log': commit_log,
                 }))
+
+            with open(temp_log_path, 'w') as log_file:
+                os.chmod(temp_log_path, 0600)
+                log_file.write(json.dumps({
+                    'log_id': log_id,
+                }) + '\n')
+
             os.rename(temp_path, self._path)
+            os.rename(temp_log_path, self._log_path)
         except:
-            try:
-                os.remove(temp_path)
-            except OSError:
-                pass
+            for path in (temp_path, temp_log_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
             raise
 
+        self._log_id = log_id
+        self._log_count = 0
+        self._compact_time = time.time()
+
+    def _replay_op(self, op_time, name, args, kwargs):
+        if name not in TRANSACTION_METHODS and name != '_apply_trans':
+            return
+
+        if name == 'expire':
+            key, ttl = args
+            ttl -= time.time() - op_time
+            if ttl <= 0:
+                self.remove(key)
+                return
+            args = (key, ttl)
+
+        getattr(self, name)(*args, **kwargs)
+
     def import_data(self):
+        log_id = None
+
         if os.path.isfile(self._path):
             with open(self._path, 'r') as db_file:
                 import_data = json.loads(db_file.read())
                 data = import_data['data']
+                log_id = import_data.get('log_id')
 
                 for key_data in data:
                     key = key_data[0]
@@ -535,10 +695,8 @@ class TunlDB(object):
                         ttl -= int(time.time() * 1000)
                         ttl /= 1000.0
                         if ttl >= 0:
-                            timer = threading.Timer(ttl, self.remove, (key,))
-                            timer.daemon = True
-                            self._timers[key] = timer
-                            timer.start()
+                            self._timers[key] = self._wheel.schedule(
+                                ttl, self.remove, key)
                         else:
                             self.remove(key)
 
@@ -546,6 +704,28 @@ class TunlDB(object):
                     for tran in import_data['commit_log']:
                         self._apply_trans(tran)
 
+        if log_id and os.path.isfile(self._log_path):
+            self._replaying = True
+            try:
+                with open(self._log_path, 'r') as log_file:
+                    header = None
+                    for line in log_file:
+                        try:
+                            line = json.loads(line)
+                        except ValueError:
+                            # Partial write from unclean shutdown
+                            break
+
+                        if header is None:
+                            header = line
+                            if header.get('log_id') != log_id:
+                                break
+                            continue
+
+                        self._replay_op(*line)
+            finally:
+                self._replaying = False
+
 class TunlDBTransaction(object):
     def __init__(self, cache):
         self._cache = cache
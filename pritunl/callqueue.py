@@ -1,25 +1,51 @@
+from pritunl.constants import *
 from pritunl import logger
 
 import threading
+import time
 import Queue
 
 class CallQueue(object):
     def __init__(self, checker, maxsize=0):
         self._check = checker
         self._queue = Queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._lazy = False
+        self._max_threads = 0
+        self._threads = 0
+        self._idle = 0
 
     def put(self, func, *args, **kwargs):
         self._queue.put((func, args, kwargs))
+        self._spawn()
 
-    def call(self, timeout=0):
+    def put_nowait(self, func, *args, **kwargs):
+        try:
+            self._queue.put_nowait((func, args, kwargs))
+        except Queue.Full:
+            return False
+        self._spawn()
+        return True
+
+    def full(self):
+        return self._queue.full()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def _call(self, func, args, kwargs):
         try:
-            func, args, kwargs = self._queue.get(timeout=timeout)
             func(*args, **kwargs)
-        except Queue.Empty:
-            pass
         except:
             logger.exception('Error in queued called', 'callqueue')
 
+    def call(self, timeout=0):
+        try:
+            func, args, kwargs = self._queue.get(timeout=timeout)
+        except Queue.Empty:
+            return
+        self._call(func, args, kwargs)
+
     def _thread(self):
         while True:
             self.call(timeout=0.5)
@@ -27,7 +53,67 @@ class CallQueue(object):
             if self._check():
                 return
 
-    def start(self, threads=1):
+    def _spawn(self):
+        # Lazy queues add a worker when queued calls exceed idle workers
+        if not self._lazy:
+            return
+
+        self._lock.acquire()
+        try:
+            if self._threads >= self._max_threads or \
+                    self._queue.qsize() <= self._idle:
+                return
+            self._threads += 1
+        finally:
+            self._lock.release()
+
+        thread = threading.Thread(target=self._lazy_thread)
+        thread.daemon = True
+        thread.start()
+
+    def _lazy_thread(self):
+        # Workers exit after being idle for the idle timeout
+        idle_start = time.time()
+
+        while True:
+            self._lock.acquire()
+            self._idle += 1
+            self._lock.release()
+
+            try:
+                item = self._queue.get(timeout=0.5)
+            except Queue.Empty:
+                item = None
+
+            self._lock.acquire()
+            self._idle -= 1
+            self._lock.release()
+
+            if item:
+                self._call(*item)
+                idle_start = time.time()
+
+            if self._check() or (not item and
+                    time.time() - idle_start > CALL_QUEUE_IDLE_TIMEOUT):
+                self._lock.acquire()
+                try:
+                    if self._check() or self._queue.empty():
+                        self._threads -= 1
+                        return
+                finally:
+                    self._lock.release()
+
+    def start(self, threads=1, lazy=False):
+        if lazy:
+            self._lock.acquire()
+            try:
+                self._lazy = True
+                self._max_threads = threads
+            finally:
+                self._lock.release()
+            self._spawn()
+            return
+
         for _ in xrange(threads):
             thread = threading.Thread(target=self._thread)
             thread.daemon = True
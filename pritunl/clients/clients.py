@@ -13,6 +13,7 @@ from pritunl import objcache
 from pritunl import host
 from pritunl import authorizer
 from pritunl import messenger
+from pritunl import statuscache
 
 import time
 import collections
@@ -40,13 +41,23 @@ class Clients(object):
             self.instance.is_sock_interrupt, 512)
         self.clients_call_queue = callqueue.CallQueue(
             self.instance.is_sock_interrupt)
+        self.auth_queue = callqueue.CallQueue(
+            self.instance.is_sock_interrupt, settings.vpn.auth_queue_size)
+        self.auth_push_queue = callqueue.CallQueue(
+            self.instance.is_sock_interrupt, settings.vpn.auth_queue_size)
+        self.reauth_queue = callqueue.CallQueue(
+            self.instance.is_sock_interrupt)
         self.obj_cache = objcache.ObjCache()
+        self.client_conf_cache = {}
+        self.client_conf_lock = threading.Lock()
         self.client_routes = set()
 
         self.clients = docdb.DocDb(
             'user_id',
             'mac_addr',
             'virt_address',
+            ('user_id', 'mac_addr'),
+            frozen=True,
         )
         self.clients_queue = collections.deque()
 
@@ -73,46 +84,116 @@ class Clients(object):
                 self.obj_cache.set(org_id, org)
         return org
 
-    def generate_client_conf(self, platform, client_id, virt_address,
-            user, reauth):
-        client_conf = ''
-
-        if user.link_server_id:
-            link_usr_svr = self.server.get_link_server(user.link_server_id,
-                fields=('_id', 'network', 'network_start', 'network_end',
-                    'local_networks', 'organizations', 'routes', 'links'))
+    def clear_client_conf(self):
+        self.client_conf_lock.acquire()
+        try:
+            self.client_conf_cache = {}
+        finally:
+            self.client_conf_lock.release()
 
-            for route in link_usr_svr.get_routes(
-                    include_default=False):
-                network = route['network']
+    def _get_route_conf(self, svr, iroute):
+        conf = ''
+        for route in svr.get_routes(include_default=False):
+            network = route['network']
 
-                if ':' in network:
-                    client_conf += 'iroute-ipv6 %s\n' % network
+            if ':' in network:
+                if iroute:
+                    conf += 'iroute-ipv6 %s\n' % network
                 else:
-                    client_conf += 'iroute %s %s\n' % utils.parse_network(
-                        network)
-        else:
-            if self.server.is_route_all():
-                if platform == 'ios':
-                    client_conf += 'push "route 0.0.0.0 128.0.0.0"\n'
-                    client_conf += 'push "route 128.0.0.0 128.0.0.0"\n'
+                    conf += 'push "route-ipv6 %s"\n' % network
+            else:
+                if iroute:
+                    conf += 'iroute %s %s\n' % utils.parse_network(network)
                 else:
-                    client_conf += 'push "redirect-gateway def1"\n'
+                    conf += 'push "route %s %s"\n' % (
+                        utils.parse_network(network))
+        return conf
+
+    def _generate_link_conf(self, link_server_id):
+        link_usr_svr = self.server.get_link_server(link_server_id,
+            fields=('_id', 'network', 'network_start', 'network_end',
+                'local_networks', 'organizations', 'routes', 'links'))
+        return self._get_route_conf(link_usr_svr, True)
+
+    def _generate_static_conf(self, platform):
+        conf_head = ''
+        conf_tail = ''
+
+        if self.server.is_route_all():
+            if platform == 'ios':
+                conf_head += 'push "route 0.0.0.0 128.0.0.0"\n'
+                conf_head += 'push "route 128.0.0.0 128.0.0.0"\n'
+            else:
+                conf_head += 'push "redirect-gateway def1"\n'
 
-                if self.server.ipv6:
-                    if platform != 'ios':
-                        client_conf += 'push "redirect-gateway-ipv6 def1"\n'
-                    client_conf += 'push "route-ipv6 2000::/3"\n'
+            if self.server.ipv6:
+                if platform != 'ios':
+                    conf_head += 'push "redirect-gateway-ipv6 def1"\n'
+                conf_head += 'push "route-ipv6 2000::/3"\n'
+
+        if self.server.dns_mapping:
+            conf_head += 'push "dhcp-option DNS %s"\n' % (
+                utils.get_network_gateway(self.server.network))
+
+        for dns_server in self.server.dns_servers:
+            conf_head += 'push "dhcp-option DNS %s"\n' % dns_server
+        if self.server.search_domain:
+            conf_head += 'push "dhcp-option DOMAIN %s"\n' % (
+                self.server.search_domain)
+
+        for network_link in self.server.network_links:
+            if ':' in network_link:
+                conf_tail += 'push "route-ipv6 %s"\n' % network_link
+            else:
+                conf_tail += 'push "route %s %s"\n' % (
+                    utils.parse_network(network_link))
+
+        for link_svr in self.server.iter_links(fields=(
+                '_id', 'network', 'local_networks', 'network_start',
+                'network_end', 'organizations', 'routes', 'links')):
+            conf_tail += self._get_route_conf(link_svr, False)
+
+        return conf_head, conf_tail
+
+    def _get_client_conf(self, key, func, *args):
+        # Static parts of the client conf are cached until the routes of
+        # the server or a linked server are updated
+        self.client_conf_lock.acquire()
+        try:
+            conf_cache = self.client_conf_cache
+            conf = conf_cache.get(key)
+        finally:
+            self.client_conf_lock.release()
+
+        if conf is None:
+            conf = func(*args)
+            self.client_conf_lock.acquire()
+            try:
+                if conf_cache is self.client_conf_cache:
+                    conf_cache[key] = conf
+            finally:
+                self.client_conf_lock.release()
 
-            if self.server.dns_mapping:
-                client_conf += 'push "dhcp-option DNS %s"\n' % (
-                    utils.get_network_gateway(self.server.network))
+        return conf
 
-            for dns_server in self.server.dns_servers:
-                client_conf += 'push "dhcp-option DNS %s"\n' % dns_server
-            if self.server.search_domain:
-                client_conf += 'push "dhcp-option DOMAIN %s"\n' % (
-                    self.server.search_domain)
+    def generate_client_conf(self, platform, client_id, virt_address,
+            user, reauth):
+        client_conf = ''
+
+        if user.link_server_id:
+            client_conf += self._get_client_conf(
+                ('link', user.link_server_id),
+                self._generate_link_conf,
+                user.link_server_id,
+            )
+        else:
+            platform = 'ios' if platform == 'ios' else None
+            conf_head, conf_tail = self._get_client_conf(
+                ('static', platform),
+                self._generate_static_conf,
+                platform,
+            )
+            client_conf += conf_head
 
             network_links = user.get_network_links()
             for network_link in network_links:
@@ -129,25 +210,7 @@ class Clients(object):
                 thread.daemon = True
                 thread.start()
 
-            for network_link in self.server.network_links:
-                if ':' in network_link:
-                    client_conf += 'push "route-ipv6 %s"\n' % network_link
-                else:
-                    client_conf += 'push "route %s %s"\n' % (
-                        utils.parse_network(network_link))
-
-            for link_svr in self.server.iter_links(fields=(
-                    '_id', 'network', 'local_networks', 'network_start',
-                    'network_end', 'organizations', 'routes', 'links')):
-                for route in link_svr.get_routes(
-                        include_default=False):
-                    network = route['network']
-
-                    if ':' in network:
-                        client_conf += 'push "route-ipv6 %s"\n' % (network)
-                    else:
-                        client_conf += 'push "route %s %s"\n' % (
-                            utils.parse_network(network))
+            client_conf += conf_tail
 
         return client_conf
 
@@ -365,7 +428,9 @@ class Clients(object):
 
         self.instance_com.send_client_auth(client_id, key_id, client_conf)
 
-    def _connect(self, client_data, reauth):
+    def _connect(self, client_data, reauth, queue_time):
+        authorizer.add_stat('queue', time.time() - queue_time)
+
         client_id = client_data['client_id']
         key_id = client_data['key_id']
         org_id = client_data['org_id']
@@ -422,6 +487,7 @@ class Clients(object):
                 password,
                 reauth,
                 callback,
+                self.auth_push_queue,
             ).authenticate()
         except:
             logger.exception('Error parsing client connect', 'server',
@@ -431,7 +497,21 @@ class Clients(object):
                 'Error parsing client connect')
 
     def connect(self, client_data, reauth=False):
-        self.call_queue.put(self._connect, client_data, reauth)
+        if settings.vpn.stress_test:
+            self.auth_queue.put(self._connect, client_data, reauth,
+                time.time())
+        elif self.auth_queue.put_nowait(self._connect, client_data,
+                reauth, time.time()):
+            pass
+        elif reauth:
+            # Reauths are for connected clients and are never denied for
+            # capacity, queue on the unbounded reauth queue
+            self.reauth_queue.put(self._connect, client_data, reauth,
+                time.time())
+        else:
+            authorizer.add_rejected()
+            self.instance_com.send_client_deny(client_data['client_id'],
+                client_data['key_id'], 'Server is busy')
 
     def on_port_forwarding(self, org_id, user_id):
         client = self.clients.find({'user_id': user_id})
@@ -646,6 +726,8 @@ class Clients(object):
             'doc_id': doc_id,
             'timestamp': time.time(),
         })
+        statuscache.client_connected(doc_id, client['user_id'],
+            client['user_type'])
 
         self.clients_queue.append(client_id)
 
@@ -721,6 +803,7 @@ class Clients(object):
                 logger.exception('Error removing client', 'server',
                     server_id=self.server.id,
                 )
+            statuscache.client_disconnected(doc_id)
 
         self.call_queue.put(self._disconnected, client)
 
@@ -730,9 +813,11 @@ class Clients(object):
 
     def send_event(self):
         for org_id in self.server.organizations:
-            event.Event(type=USERS_UPDATED, resource_id=org_id)
-        event.Event(type=HOSTS_UPDATED, resource_id=settings.local.host_id)
-        event.Event(type=SERVERS_UPDATED)
+            event.Event(type=USERS_UPDATED, resource_id=org_id,
+                buffered=True)
+        event.Event(type=HOSTS_UPDATED, resource_id=settings.local.host_id,
+            buffered=True)
+        event.Event(type=SERVERS_UPDATED, buffered=True)
 
     def interrupter_sleep(self, length):
         if check_global_interrupt() or self.instance.sock_interrupt:
@@ -806,29 +891,60 @@ class Clients(object):
                     if self.instance.sock_interrupt:
                         return
 
+                    # Queue is ordered by timestamp, refresh every client
+                    # due within the batch window with the same write
+                    batch = [client]
+                    batch_time = time.time() - settings.vpn.client_ttl + \
+                        150 + settings.vpn.client_ping_batch
+                    while self.clients_queue:
+                        client = self.clients.find_id(self.clients_queue[0])
+                        if client and client['timestamp'] > batch_time:
+                            break
+                        self.clients_queue.popleft()
+                        if client:
+                            batch.append(client)
+
+                    client_ids = []
+                    doc_ids = {}
                     try:
-                        updated = self.clients.update_id(client_id, {
-                            'timestamp': time.time(),
-                        })
-                        if not updated:
+                        for client in batch:
+                            updated = self.clients.update_id(client['id'], {
+                                'timestamp': time.time(),
+                            })
+                            if updated:
+                                client_ids.append(client['id'])
+                                doc_ids[client['doc_id']] = client['id']
+
+                        if not client_ids:
                             continue
 
                         response = self.collection.update({
-                            '_id': client['doc_id'],
+                            '_id': {'$in': doc_ids.keys()},
                         }, {
                             '$set': {
                                 'timestamp': utils.now(),
                             },
-                        })
-                        if not response['updatedExisting']:
-                            logger.error('Client lost unexpectedly', 'server',
-                                server_id=self.server.id,
-                                instance_id=self.instance.id,
-                            )
-                            self.instance_com.client_kill(client_id)
-                            continue
+                        }, multi=True)
+
+                        if response['n'] < len(doc_ids):
+                            cursor = self.collection.find({
+                                '_id': {'$in': doc_ids.keys()},
+                            }, {
+                                '_id': True,
+                            })
+                            for doc in cursor:
+                                doc_ids.pop(doc['_id'], None)
+
+                            for lost_id in doc_ids.values():
+                                logger.error('Client lost unexpectedly',
+                                    'server',
+                                    server_id=self.server.id,
+                                    instance_id=self.instance.id,
+                                )
+                                client_ids.remove(lost_id)
+                                self.instance_com.client_kill(lost_id)
                     except:
-                        self.clients_queue.append(client_id)
+                        self.clients_queue.extend([x['id'] for x in batch])
                         logger.exception('Failed to update client', 'server',
                             server_id=self.server.id,
                             instance_id=self.instance.id,
@@ -836,7 +952,7 @@ class Clients(object):
                         yield interrupter_sleep(1)
                         continue
 
-                    self.clients_queue.append(client_id)
+                    self.clients_queue.extend(client_ids)
 
                     yield
                     if self.instance.sock_interrupt:
@@ -867,6 +983,9 @@ class Clients(object):
                     server_id=self.server.id,
                 )
 
+            for doc_id in doc_ids:
+                statuscache.client_disconnected(doc_id)
+
     def on_client(self, state, virt_address, virt_address6,
             host_address, host_address6):
         if state:
@@ -995,6 +1114,9 @@ class Clients(object):
         if self.server.dns_mapping:
             host.dns_mapping_servers.add(self.instance.id)
         self.call_queue.start(10)
+        self.auth_queue.start(settings.vpn.auth_workers, lazy=True)
+        self.auth_push_queue.start(settings.vpn.auth_push_workers, lazy=True)
+        self.reauth_queue.start(settings.vpn.auth_workers, lazy=True)
 
         if self.route_clients:
             thread = threading.Thread(target=self.init_routes)
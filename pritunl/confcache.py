@@ -0,0 +1,24 @@
+from pritunl.constants import *
+from pritunl import objcache
+
+import threading
+
+# Rendered client confs by user, server and a hash of the user and server
+# fields the conf is built from. Commits change the hash on every host so
+# stale confs are never returned without any invalidation messages.
+_cache = objcache.ObjCache(ttl=CONF_CACHE_TTL)
+_lock = threading.Lock()
+
+def get_conf(user_id, server_id, conf_hash, include_user_cert):
+    _lock.acquire()
+    try:
+        return _cache.get((user_id, server_id, conf_hash, include_user_cert))
+    finally:
+        _lock.release()
+
+def set_conf(user_id, server_id, conf_hash, include_user_cert, conf):
+    _lock.acquire()
+    try:
+        _cache.set((user_id, server_id, conf_hash, include_user_cert), conf)
+    finally:
+        _lock.release()
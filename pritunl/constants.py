@@ -25,6 +25,9 @@ UPDATE = 'update'
 ONLINE = 'online'
 OFFLINE = 'offline'
 
+NEXT = 'next'
+PREVIOUS = 'previous'
+
 TUNNEL = 'tunnel'
 BRIDGE = 'bridge'
 
@@ -251,10 +254,24 @@ SUB_RESPONSE_TIMEOUT = 10
 CLIENT_CONF_VER = 1
 MONGO_MESSAGES_SIZE = 100000
 MONGO_MESSAGES_MAX = 2048
+MESSENGER_QUEUE_SIZE = 1024
 MONGO_CONNECT_TIMEOUT = 15000
 AUTH_SIG_STRING_MAX_LEN = 10240
 SOCKET_BUFFER = 1024
+MANAGEMENT_BUFFER = 65536
+MANAGEMENT_QUEUE_SIZE = 2048
+CALL_QUEUE_IDLE_TIMEOUT = 30
+IP_BITMAP_WORD = 32
+IP_BITMAP_MASK = 0xFFFFFFFF
+IP_BITMAP_TTL = 30
 OUTPUT_DELAY = 0.25
+OUTPUT_FLUSH_RATE = 0.5
+OUTPUT_PRUNE_RATE = 10
+BANDWIDTH_FLUSH_RATE = 5
+BANDWIDTH_FLUSH_MAX = 60
+QUEUE_PRIORITY_AGE = 30
+TASK_SLEEP_MAX = 30
+TASK_LEASE_TTL = 86400
 RANDOM_ERROR_RATE = 0
 IP_REGEX = r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}'
 VALID_DH_PARAM_BITS = (1024, 1536, 2048, 3072, 4096)
@@ -291,10 +308,29 @@ USERS_DIR = 'users'
 DH_POOL_DIR = 'dh_param_pool'
 TEMP_DIR = 'temp'
 EMPTY_TEMP_DIR = 'empty_temp'
-OPENSSL_NAME = 'openssl.conf'
-INDEX_NAME = 'index'
-INDEX_ATTR_NAME = 'index.attr'
-SERIAL_NAME = 'serial'
+CERT_DAYS = 3652
+USER_POOL_RESERVE_COUNT = 2
+CONF_CACHE_TTL = 60
+USER_SEARCH_TTL = 300
+PAGE_COUNT_TTL = 30
+STATUS_UPDATE_RATE = 3
+STATUS_RECONCILE_RATE = 60
+ADMIN_CACHE_SIZE = 256
+ADMIN_CACHE_TTL = 60
+AUTH_NONCE_SYNC_OVERLAP = 5
+LIMITER_SHARDS = 16
+LIMITER_PEERS_MAX = 65536
+AUDIT_FLUSH_RATE = 1
+AUDIT_BATCH_SIZE = 500
+AUDIT_QUEUE_MAX = 50000
+AUDIT_SPILL_MAX = 67108864
+OTP_REPLAY_TTL = 120
+OTP_CACHE_LOCAL_TTL = 900
+OTP_FLUSH_RATE = 1
+EVENT_STREAM_DELAY = 0.1
+EVENT_STREAM_HEARTBEAT = 15
+EVENT_STREAM_RETRY = 3
+EVENT_STREAM_WRITE_TIMEOUT = 2
 OVPN_CONF_NAME = 'openvpn.conf'
 OVPN_CA_NAME = 'ca.crt'
 DH_PARAM_NAME = 'dh_param.pem'
@@ -415,79 +451,6 @@ OPENSSL_HEARTBLEED = {
 }
 OPENSSL_HEARTBLEED_BUILD_DATE = datetime.date(2014, 4, 7)
 
-CERT_CONF = """\
-[ default ]
-[ req ]
-default_bits = %s
-default_md = %s
-encrypt_key = no
-utf8 = yes
-string_mask = utf8only
-prompt = no
-distinguished_name = req_dn
-
-[ req_dn ]
-organizationName = %s
-commonName = %s
-
-[ ca_req_ext ]
-keyUsage = critical,keyCertSign,cRLSign
-basicConstraints = critical,CA:true
-subjectKeyIdentifier = hash
-
-[ server_req_ext ]
-keyUsage = critical,digitalSignature,keyEncipherment
-extendedKeyUsage = serverAuth,clientAuth
-subjectKeyIdentifier = hash
-
-[ client_req_ext ]
-keyUsage = critical,digitalSignature,keyEncipherment
-extendedKeyUsage = clientAuth
-subjectKeyIdentifier = hash
-
-[ ca ]
-default_ca = root_ca
-
-[ root_ca ]
-database = %s
-serial = %s
-new_certs_dir = %s
-certificate = %s
-private_key = %s
-default_days = 3652
-default_crl_days = 365
-default_md = %s
-policy = ca_policy
-crl_extensions = crl_ext
-
-[ ca_policy ]
-organizationName = match
-commonName = supplied
-
-[ ca_ext ]
-keyUsage = critical,keyCertSign,cRLSign
-basicConstraints = critical,CA:true
-subjectKeyIdentifier = hash
-authorityKeyIdentifier = keyid:always
-
-[ crl_ext ]
-authorityKeyIdentifier = keyid:always
-
-[ server_ext ]
-keyUsage = critical,digitalSignature,keyEncipherment
-basicConstraints = CA:false
-extendedKeyUsage = serverAuth,clientAuth
-subjectKeyIdentifier = hash
-authorityKeyIdentifier = keyid:always
-
-[ client_ext ]
-keyUsage = critical,digitalSignature,keyEncipherment
-basicConstraints = CA:false
-extendedKeyUsage = clientAuth
-subjectKeyIdentifier = hash
-authorityKeyIdentifier = keyid:always
-"""
-
 MISSING_PARAMS = 'missing_params'
 MISSING_PARAMS_MSG = 'Missing required parameters.'
 
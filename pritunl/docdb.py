@@ -3,17 +3,70 @@ import collections
 import bson
 import copy
 
+class FrozenDoc(dict):
+    # Read only doc returned by frozen DocDb, updates to the db replace
+    # the stored doc so previously returned docs are never modified
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('Frozen doc is read only')
+
+    __setitem__ = _readonly
+    __delitem__ = _readonly
+    clear = _readonly
+    pop = _readonly
+    popitem = _readonly
+    setdefault = _readonly
+    update = _readonly
+
+    def copy(self):
+        return dict(self)
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self), memo)
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
 class DocDb(object):
-    def __init__(self, *indexes):
+    def __init__(self, *indexes, **kwargs):
+        self._frozen = kwargs.get('frozen', False)
         self._indexes = set()
         self._index = {}
         self._lock = threading.RLock()
         self._docs = {}
 
         for ind in indexes:
+            if isinstance(ind, (list, tuple)):
+                ind = tuple(ind)
             self._indexes.add(ind)
             self._index[ind] = collections.defaultdict(set)
 
+        # Check compound indexes with the most keys first
+        self._compound_indexes = sorted(
+            [x for x in self._indexes if isinstance(x, tuple)],
+            key=lambda x: len(x),
+            reverse=True,
+        )
+        self._single_indexes = [
+            x for x in self._indexes if not isinstance(x, tuple)]
+
+    def _index_val(self, doc, index_key):
+        if isinstance(index_key, tuple):
+            vals = tuple(doc.get(key) for key in index_key)
+            if None in vals:
+                return None
+            return vals
+        return doc.get(index_key)
+
+    def _export(self, doc_id, doc):
+        if self._frozen:
+            return doc
+        doc = copy.deepcopy(doc)
+        doc['id'] = doc_id
+        return doc
+
     def _find(self, query, slow=False, only_id=False):
         if 'id' in query:
             doc_id = query['id']
@@ -31,80 +84,78 @@ class DocDb(object):
                     return [doc]
                 return []
 
-        need = len(query)
-        possible = {}
         found = []
+        matched_keys = set()
+        doc_ids = None
 
         self._lock.acquire()
         try:
-            index_count = 0
-            for index_key in self._index.keys():
-                val = query.get(index_key, None)
-
-                if val is not None:
-                    query.pop(index_key, None)
-                    index_count += 1
-                    index = self._index[index_key]
-                    if val in index:
-                        for doc_id in index[val]:
-                            matched = possible.get(doc_id, 0) + 1
-                            possible[doc_id] = matched
-                            if matched == need:
-                                if only_id:
-                                    found.append(doc_id)
-                                else:
-                                    doc = copy.deepcopy(self._docs[doc_id])
-                                    doc['id'] = doc_id
-                                    found.append(doc)
-
-            if not index_count:
+            for index_key in self._compound_indexes:
+                vals = []
+                for key in index_key:
+                    val = query.get(key)
+                    if val is None:
+                        break
+                    vals.append(val)
+                else:
+                    doc_ids = self._index[index_key].get(tuple(vals), set())
+                    matched_keys.update(index_key)
+                    break
+
+            for index_key in self._single_indexes:
+                if index_key in matched_keys:
+                    continue
+
+                val = query.get(index_key)
+                if val is None:
+                    continue
+
+                index_ids = self._index[index_key].get(val, set())
+                if doc_ids is None:
+                    doc_ids = index_ids
+                else:
+                    doc_ids = doc_ids & index_ids
+                matched_keys.add(index_key)
+
+            if doc_ids is None:
                 if not slow:
                     raise IndexError('Non indexed query')
+                doc_ids = self._docs.keys()
+
+            remaining = [(key, val) for key, val in query.items()
+                if key not in matched_keys]
+
+            for doc_id in doc_ids:
+                doc = self._docs[doc_id]
 
-                for doc_id, doc in self._docs.items():
-                    match = True
-                    for key, val in query.items():
-                        if doc[key] != val:
-                            match = False
-                            break
-                    if match:
-                        if only_id:
-                            found.append(doc_id)
-                        else:
-                            doc = copy.deepcopy(doc)
-                            doc['id'] = doc_id
-                            found.append(doc)
-            elif index_count != need:
-                for doc_id, matched in possible.items():
-                    if matched != index_count:
-                        continue
-                    doc = self._docs[doc_id]
-                    match = True
-                    for key, val in query.items():
-                        if doc[key] != val:
-                            match = False
-                            break
-                    if match:
-                        if only_id:
-                            found.append(doc_id)
-                        else:
-                            doc = copy.deepcopy(doc)
-                            doc['id'] = doc_id
-                            found.append(doc)
+                match = True
+                for key, val in remaining:
+                    if doc.get(key) != val:
+                        match = False
+                        break
+
+                if match:
+                    if only_id:
+                        found.append(doc_id)
+                    else:
+                        found.append(self._export(doc_id, doc))
         finally:
             self._lock.release()
 
         return found
 
     def find_all(self):
-        found = []
-
-        for doc_id, doc in self._docs.items():
-            doc = copy.deepcopy(doc)
-            doc['id'] = doc_id
-            found.append(doc)
+        self._lock.acquire()
+        try:
+            if self._frozen:
+                return self._docs.values()
 
-        return found
+            found = []
+            for doc_id, doc in self._docs.items():
+                found.append(self._export(doc_id, doc))
+            return found
+        finally:
+            self._lock.release()
 
     def find(self, query, slow=False):
         return self._find(query, slow)
@@ -114,9 +165,7 @@ class DocDb(object):
         try:
             doc = self._docs.get(doc_id)
             if doc:
-                doc = copy.deepcopy(doc)
-                doc['id'] = doc_id
-                return doc
+                return self._export(doc_id, doc)
         finally:
             self._lock.release()
 
@@ -126,6 +175,10 @@ class DocDb(object):
         doc_id = doc.pop('id', bson.ObjectId())
         orig_doc['id'] = doc_id
 
+        if self._frozen:
+            doc['id'] = doc_id
+            doc = FrozenDoc(doc)
+
         self._lock.acquire()
         try:
             if upsert:
@@ -134,7 +187,7 @@ class DocDb(object):
                 raise KeyError('Doc id already exists')
 
             for index_key, index in self._index.items():
-                val = doc.get(index_key)
+                val = self._index_val(doc, index_key)
                 if val is not None:
                     index[val].add(doc_id)
 
@@ -145,24 +198,42 @@ class DocDb(object):
         return orig_doc
 
     def _update(self, doc_ids, update):
+        index_keys = []
+        for index_key in self._indexes:
+            if isinstance(index_key, tuple):
+                if any(key in update for key in index_key):
+                    index_keys.append(index_key)
+            elif index_key in update:
+                index_keys.append(index_key)
+
         for doc_id in doc_ids:
             doc = self._docs[doc_id]
 
-            for key, val in update.items():
-                if key in self._indexes:
-                    index = self._index[key]
+            cur_vals = {}
+            for index_key in index_keys:
+                cur_vals[index_key] = self._index_val(doc, index_key)
 
-                    cur_val = doc.get(key)
-                    if cur_val is not None:
-                        val_index = index[cur_val]
-                        val_index.remove(doc_id)
-                        if len(val_index) == 0:
-                            index.pop(cur_val)
+            if self._frozen:
+                doc = dict(doc)
+                doc.update(update)
+                doc = FrozenDoc(doc)
+                self._docs[doc_id] = doc
+            else:
+                doc.update(update)
 
-                    if val is not None:
-                        index[val].add(doc_id)
+            for index_key in index_keys:
+                index = self._index[index_key]
 
-                doc[key] = val
+                cur_val = cur_vals[index_key]
+                if cur_val is not None:
+                    val_index = index[cur_val]
+                    val_index.discard(doc_id)
+                    if len(val_index) == 0:
+                        index.pop(cur_val)
+
+                val = self._index_val(doc, index_key)
+                if val is not None:
+                    index[val].add(doc_id)
 
     def count(self, query, slow=False):
         self._lock.acquire()
@@ -211,10 +282,10 @@ class DocDb(object):
             doc = self._docs.pop(doc_id)
 
             for index_key, index in self._index.items():
-                val = doc.get(index_key)
+                val = self._index_val(doc, index_key)
                 if val is not None:
                     val_index = index[val]
-                    val_index.remove(doc_id)
+                    val_index.discard(doc_id)
                     if len(val_index) == 0:
                         index.pop(val)
 
@@ -1,20 +1,50 @@
+from pritunl.constants import *
 from pritunl.helpers import *
 from pritunl import messenger
 from pritunl import utils
+from pritunl import logger
 
 import time
+import json
+import threading
 
 event_queue = utils.NoneQueue()
+_streams_lock = threading.Lock()
+_streams = set()
+_stream_thread = None
 
 class Event(object):
-    def __init__(self, type, resource_id=None, delay=None):
+    def __init__(self, type, resource_id=None, delay=None, buffered=False):
         if delay:
             # Delay event to reduce duplicate events in short period
             event_queue.put((time.time() + delay, type, resource_id))
             return
 
+        if buffered:
+            messenger.publish_buffered('events', (type, resource_id))
+            return
+
         messenger.publish('events', (type, resource_id))
 
+def _add_event(events, events_dict, event):
+    # Merge duplicate events into the first event with the newest id
+    event_type, resource_id = event.pop('message')
+    if (event_type, resource_id) in events_dict:
+        old_event = events_dict[(event_type, resource_id)]
+        old_event['id'] = event['_id']
+        old_event['timestamp'] = time.mktime(
+            event['timestamp'].timetuple())
+        return
+
+    events_dict[(event_type, resource_id)] = event
+    event['id'] = event.pop('_id')
+    event['type'] = event_type
+    event['resource_id'] = resource_id
+    event['timestamp'] = time.mktime(event['timestamp'].timetuple())
+    event.pop('channel')
+
+    events.append(event)
+
 def get_events(cursor=None, yield_app_server=False):
     events = []
     events_dict = {}
@@ -24,21 +54,136 @@ def get_events(cursor=None, yield_app_server=False):
 
     for event in messenger.subscribe('events', cursor_id=cursor,
             timeout=10, yield_delay=0.02, yield_app_server=yield_app_server):
-        event_type, resource_id = event.pop('message')
-        if (event_type, resource_id) in events_dict:
-            old_event = events_dict[(event_type, resource_id)]
-            old_event['id'] = event['_id']
-            old_event['timestamp'] = time.mktime(
-                event['timestamp'].timetuple())
-            continue
-
-        events_dict[(event_type, resource_id)] = event
-        event['id'] = event.pop('_id')
-        event['type'] = event_type
-        event['resource_id'] = resource_id
-        event['timestamp'] = time.mktime(event['timestamp'].timetuple())
-        event.pop('channel')
-
-        events.append(event)
+        _add_event(events, events_dict, event)
 
     return events
+
+def _format_events(events):
+    return 'id: %s\ndata: %s\n\n' % (
+        events[-1]['id'],
+        json.dumps(events, default=lambda x: str(x)),
+    )
+
+class _Stream(object):
+    def __init__(self, request, cursor_id):
+        self.request = request
+        self.cursor_id = cursor_id
+        self.resume = bool(cursor_id)
+        self.events = []
+        self.events_dict = {}
+        self.batch_time = None
+        self.send_time = time.time()
+
+    def add_event(self, event):
+        if self.cursor_id and event['_id'] <= self.cursor_id:
+            return
+        self.cursor_id = event['_id']
+
+        _add_event(self.events, self.events_dict, event.copy())
+        if self.batch_time is None:
+            self.batch_time = time.time()
+
+    def send(self, cur_time):
+        # Events received within the stream delay are merged and sent as
+        # one frame with the id of the newest event
+        if self.events and cur_time - self.batch_time >= EVENT_STREAM_DELAY:
+            frame = _format_events(self.events)
+            self.events = []
+            self.events_dict = {}
+            self.batch_time = None
+        elif cur_time - self.send_time >= EVENT_STREAM_HEARTBEAT:
+            frame = ': heartbeat\n\n'
+        else:
+            return
+
+        self.request.write(frame)
+        self.send_time = cur_time
+
+    def close(self):
+        try:
+            self.request.conn.close()
+        except:
+            pass
+
+def _close_stream(stream):
+    _streams_lock.acquire()
+    try:
+        _streams.discard(stream)
+    finally:
+        _streams_lock.release()
+    stream.close()
+
+def _stream_runner():
+    # All event streams in the process are served from this thread with a
+    # single subscription, the streams hold a parked socket and no web
+    # server thread
+    while not check_global_interrupt():
+        try:
+            for event in messenger.subscribe('events'):
+                if check_global_interrupt():
+                    break
+
+                _streams_lock.acquire()
+                try:
+                    streams = list(_streams)
+                finally:
+                    _streams_lock.release()
+
+                cur_time = time.time()
+                for stream in streams:
+                    try:
+                        if stream.resume:
+                            stream.resume = False
+                            for doc in messenger.get_messages('events',
+                                    stream.cursor_id):
+                                stream.add_event(doc)
+
+                        if event is not None:
+                            stream.add_event(event)
+
+                        stream.send(cur_time)
+                    except:
+                        _close_stream(stream)
+        except:
+            logger.exception('Error in event stream thread', 'event')
+            time.sleep(0.5)
+
+    _streams_lock.acquire()
+    try:
+        streams = list(_streams)
+    finally:
+        _streams_lock.release()
+
+    for stream in streams:
+        _close_stream(stream)
+
+def _start_stream_thread():
+    global _stream_thread
+
+    if _stream_thread and _stream_thread.is_alive():
+        return
+
+    _stream_thread = threading.Thread(target=_stream_runner)
+    _stream_thread.daemon = True
+    _stream_thread.start()
+
+def _add_stream(request, cursor_id):
+    _streams_lock.acquire()
+    try:
+        _streams.add(_Stream(request, cursor_id))
+        _start_stream_thread()
+    finally:
+        _streams_lock.release()
+
+def stream_events(park, cursor=None):
+    # Server sent events stream, the connection is parked once the retry
+    # frame is sent and events are then written by the stream thread
+    request = park(EVENT_STREAM_WRITE_TIMEOUT)
+
+    try:
+        yield 'retry: %d\n\n' % (EVENT_STREAM_RETRY * 1000)
+    except:
+        request.conn.close()
+        raise
+
+    _add_stream(request, cursor)
@@ -5,6 +5,7 @@ from pritunl import app
 from pritunl import auth
 
 import flask
+import bson
 
 @app.app.route('/event', methods=['GET'])
 @app.app.route('/event/<cursor>', methods=['GET'])
@@ -18,3 +19,26 @@ def event_get(cursor=None):
 
     return utils.jsonify(event.get_events(
         cursor=cursor, yield_app_server=True))
+
+@app.app.route('/event/stream', methods=['GET'])
+@auth.session_auth
+def event_stream_get():
+    if check_global_interrupt():
+        raise flask.abort(500)
+
+    cursor = flask.request.headers.get('Last-Event-ID') or \
+        flask.request.args.get('cursor')
+    if cursor and bson.ObjectId.is_valid(cursor):
+        cursor = bson.ObjectId(cursor)
+    else:
+        cursor = None
+
+    park = flask.request.environ.get('wsgiserver.park')
+    if not park:
+        raise flask.abort(500)
+
+    response = flask.Response(event.stream_events(park, cursor),
+        mimetype='text/event-stream')
+    response.headers.add('Cache-Control', 'no-cache')
+    response.headers.add('X-Accel-Buffering', 'no')
+    return response
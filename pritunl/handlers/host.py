@@ -22,11 +22,24 @@ def host_get(hst=None):
     hosts = []
     page = flask.request.args.get('page', None)
     page = int(page) if page else page
+    cursor = flask.request.args.get('cursor', None)
+    keyset = None
+    if cursor is not None:
+        page = None
+        keyset = utils.KeysetPage(cursor, settings.app.host_page_count)
 
-    for hst in host.iter_hosts_dict(page=page):
+    for hst in host.iter_hosts_dict(page=page, keyset=keyset):
         hosts.append(hst)
 
-    if page is not None:
+    if keyset:
+        return utils.jsonify({
+            'cursor': cursor,
+            'next_cursor': keyset.next_cursor,
+            'prev_cursor': keyset.prev_cursor,
+            'page_total': host.get_host_page_total(),
+            'hosts': hosts,
+        })
+    elif page is not None:
         return utils.jsonify({
             'page': page,
             'page_total': host.get_host_page_total(),
@@ -102,11 +102,24 @@ def server_get(server_id=None):
     servers = []
     page = flask.request.args.get('page', None)
     page = int(page) if page else page
+    cursor = flask.request.args.get('cursor', None)
+    keyset = None
+    if cursor is not None:
+        page = None
+        keyset = utils.KeysetPage(cursor, settings.app.server_page_count)
 
-    for svr in server.iter_servers_dict(page=page):
+    for svr in server.iter_servers_dict(page=page, keyset=keyset):
         servers.append(svr)
 
-    if page is not None:
+    if keyset:
+        return utils.jsonify({
+            'cursor': cursor,
+            'next_cursor': keyset.next_cursor,
+            'prev_cursor': keyset.prev_cursor,
+            'page_total': server.get_server_page_total(),
+            'servers': servers,
+        })
+    elif page is not None:
         return utils.jsonify({
             'page': page,
             'page_total': server.get_server_page_total(),
@@ -723,6 +736,7 @@ def server_route_post(server_id):
     for svr_link in svr.links:
         event.Event(type=SERVER_ROUTES_UPDATED,
             resource_id=svr_link['server_id'])
+    server.routes_updated([svr.id] + [x['server_id'] for x in svr.links])
 
     return utils.jsonify(route)
 
@@ -767,6 +781,7 @@ def server_route_put(server_id, route_network):
     for svr_link in svr.links:
         event.Event(type=SERVER_ROUTES_UPDATED,
             resource_id=svr_link['server_id'])
+    server.routes_updated([svr.id] + [x['server_id'] for x in svr.links])
 
     return utils.jsonify(route)
 
@@ -794,6 +809,7 @@ def server_route_delete(server_id, route_network):
     for svr_link in svr.links:
         event.Event(type=SERVER_ROUTES_UPDATED,
             resource_id=svr_link['server_id'])
+    server.routes_updated([svr.id] + [x['server_id'] for x in svr.links])
 
     return utils.jsonify(route)
 
@@ -40,6 +40,11 @@ def user_get(org_id, user_id=None, page=None):
     page = flask.request.args.get('page', page)
     page = int(page) if page else page
     search = flask.request.args.get('search', None)
+    cursor = flask.request.args.get('cursor', None)
+    keyset = None
+    if cursor is not None and search is None:
+        page = None
+        keyset = utils.KeysetPage(cursor, settings.user.page_count)
     limit = int(flask.request.args.get('limit', settings.user.page_count))
     otp_auth = False
     dns_mapping = False
@@ -74,7 +79,7 @@ def user_get(org_id, user_id=None, page=None):
         'port_forwarding',
     )
     for usr in org.iter_users(page=page, search=search,
-            search_limit=limit, fields=fields):
+            search_limit=limit, fields=fields, keyset=keyset):
         users_id.append(usr.id)
 
         user_dict = usr.dict()
@@ -166,7 +171,16 @@ def user_get(org_id, user_id=None, page=None):
             if not server_data['virt_address6']:
                 server_data['virt_address6'] = addr6
 
-    if page is not None:
+    if keyset:
+        return utils.jsonify({
+            'cursor': cursor,
+            'next_cursor': keyset.next_cursor,
+            'prev_cursor': keyset.prev_cursor,
+            'page_total': org.page_total,
+            'server_count': server_count,
+            'users': users,
+        })
+    elif page is not None:
         return utils.jsonify({
             'page': page,
             'page_total': org.page_total,
@@ -7,6 +7,8 @@ from pritunl import docdb
 global_clients = docdb.DocDb(
     'instance_id',
     'client_id',
+    ('instance_id', 'client_id'),
+    frozen=True,
 )
 
 global_servers = set()
@@ -145,6 +145,10 @@ class Host(mongo.MongoObject):
         raise ValueError('No orgs exists in link server')
 
     def remove_link_user(self):
+        from pritunl.user import search
+        search.remove_users({
+            'resource_id': self.id,
+        })
         self.user_collection.remove({
             'resource_id': self.id,
         })
@@ -163,6 +167,10 @@ class Host(mongo.MongoObject):
         if send_event:
             event.Event(type=SERVERS_UPDATED)
 
+        from pritunl.user import search
+        search.remove_users({
+            'resource_id': self.id,
+        })
         self.user_collection.remove({
             'resource_id': self.id,
         })
@@ -17,7 +17,7 @@ import math
 def get_by_id(id, fields=None):
     return Host(id=id, fields=fields)
 
-def iter_hosts(spec=None, fields=None, page=None):
+def iter_hosts(spec=None, fields=None, page=None, keyset=None):
     limit = None
     skip = None
     page_count = settings.app.host_page_count
@@ -28,6 +28,11 @@ def iter_hosts(spec=None, fields=None, page=None):
     if fields:
         fields = {key: True for key in fields}
 
+    if keyset:
+        for doc in keyset.find(Host.collection, spec, fields):
+            yield Host(doc=doc, fields=fields)
+        return
+
     if page is not None:
         limit = page_count
         skip = page * page_count if page else 0
@@ -43,16 +48,12 @@ def iter_hosts(spec=None, fields=None, page=None):
         yield Host(doc=doc, fields=fields)
 
 def get_host_page_total():
-    org_collection = mongo.get_collection('hosts')
-
-    count = org_collection.find({}, {
-        '_id': True,
-    }).count()
+    count = utils.get_count('hosts', Host.collection, {})
 
     return int(math.floor(max(0, float(count - 1)) /
         settings.app.host_page_count))
 
-def iter_hosts_dict(page=None):
+def iter_hosts_dict(page=None, keyset=None):
     clients_collection = mongo.get_collection('clients')
     server_collection = mongo.get_collection('servers')
 
@@ -77,7 +78,7 @@ def iter_hosts_dict(page=None):
 
     org_user_count = organization.get_user_count(orgs)
 
-    for hst in iter_hosts(page=page):
+    for hst in iter_hosts(page=page, keyset=keyset):
         users_online = len(clients_collection.distinct("user_id", {
             'host_id': hst.id,
             'type': CERT_CLIENT,
@@ -0,0 +1,230 @@
+from pritunl import logger
+from pritunl import utils
+
+import subprocess
+import collections
+import shlex
+import time
+
+_option_names = {
+    '--source': '-s',
+    '--src': '-s',
+    '--destination': '-d',
+    '--dst': '-d',
+    '--in-interface': '-i',
+    '--out-interface': '-o',
+    '--protocol': '-p',
+    '--jump': '-j',
+    '--match': '-m',
+    '--state': '--ctstate',
+}
+_option_values = {
+    ('-p', 'icmpv6'): 'ipv6-icmp',
+    ('-m', 'state'): 'conntrack',
+}
+
+def _cmd(name, ipv6):
+    if ipv6:
+        return 'ip6' + name
+    return 'ip' + name
+
+def parse_rule(rule):
+    # Split rule args into table, chain and rule spec without the table
+    # and wait options
+    table = 'filter'
+    chain = rule[0]
+    spec = []
+
+    args = iter(rule[1:])
+    for arg in args:
+        if arg in ('-t', '--table'):
+            table = next(args)
+        elif arg in ('-w', '--wait'):
+            continue
+        else:
+            spec.append(arg)
+
+    return table, chain, spec
+
+def _normalize_spec(table, chain, spec, ipv6):
+    groups = []
+    group = None
+    negate = False
+
+    for arg in spec:
+        if arg == '!':
+            negate = True
+        elif arg.startswith('-'):
+            option = _option_names.get(arg, arg)
+            group = ['!', option] if negate else [option]
+            negate = False
+            groups.append(group)
+        elif group is not None:
+            values = group[2:] if group[0] == '!' else group[1:]
+            option = None if values else group[-1]
+            if option in ('-s', '-d') and '/' not in arg:
+                arg += '/128' if ipv6 else '/32'
+            elif option == '--ctstate':
+                arg = ','.join(sorted(arg.split(',')))
+            elif option:
+                arg = _option_values.get((option, arg), arg)
+            group.append(arg)
+
+    return table, chain, tuple(sorted(tuple(x) for x in groups))
+
+def normalize_rule(rule, ipv6=False):
+    table, chain, spec = parse_rule(rule)
+    return _normalize_spec(table, chain, spec, ipv6)
+
+def load_rules(ipv6=False):
+    output = utils.check_output_logged([_cmd('tables-save', ipv6)])
+
+    rules = set()
+    table = None
+    for line in output.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        elif line.startswith('*'):
+            table = line[1:]
+        elif line.startswith('-A ') and table:
+            args = shlex.split(line)
+            rules.add(_normalize_spec(table, args[1], args[2:], ipv6))
+
+    return rules
+
+def exists_rule(rule, ipv6=False):
+    process = subprocess.Popen(
+        [_cmd('tables', ipv6), '-C'] + rule,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+    if process.wait():
+        return False
+    return True
+
+def missing_rules(rules, ipv6=False, current=None):
+    # Rules are checked against a single save snapshot, rules that do not
+    # match the snapshot are checked with the binary before being reported
+    # to prevent duplicate rules if the save output is formatted
+    # differently than expected
+    if not rules:
+        return []
+
+    if current is None:
+        try:
+            current = load_rules(ipv6)
+        except (OSError, subprocess.CalledProcessError):
+            logger.exception('Failed to load iptables rules', 'iptables')
+            current = set()
+
+    missing = []
+    for rule in rules:
+        if normalize_rule(rule, ipv6) in current:
+            continue
+        if not exists_rule(rule, ipv6):
+            missing.append(rule)
+
+    return missing
+
+def _quote(arg):
+    if not arg or any(x in arg for x in ' \t"\''):
+        return '"%s"' % arg.replace('"', '\\"')
+    return arg
+
+def _restore(lines, ipv6):
+    tables = collections.OrderedDict()
+    for table, line in lines:
+        tables.setdefault(table, []).append(line)
+
+    data = ''
+    for table, table_lines in tables.items():
+        data += '*%s\n' % table
+        data += '\n'.join(table_lines) + '\n'
+        data += 'COMMIT\n'
+
+    process = subprocess.Popen(
+        [_cmd('tables-restore', ipv6), '--noflush'],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    stdoutdata, stderrdata = process.communicate(data)
+    return_code = process.poll()
+
+    if return_code:
+        logger.error('Failed to restore iptables rules', 'iptables',
+            ipv6=ipv6,
+            return_code=return_code,
+            stdout=stdoutdata,
+            stderr=stderrdata,
+        )
+        return False
+    return True
+
+def _rule_lines(action, rules):
+    lines = []
+    for rule in rules:
+        table, chain, spec = parse_rule(rule)
+        lines.append((table, ' '.join(
+            [action, _quote(chain)] + [_quote(x) for x in spec])))
+    return lines
+
+def insert_rules(rules, ipv6=False):
+    # Insert all rules with one atomic restore, fall back to inserting
+    # each rule if the restore fails
+    if not rules:
+        return
+
+    if _restore(_rule_lines('-I', rules), ipv6):
+        return
+
+    for rule in rules:
+        for i in xrange(3):
+            try:
+                if not exists_rule(rule, ipv6):
+                    utils.check_output_logged(
+                        [_cmd('tables', ipv6), '-I'] + rule)
+                break
+            except:
+                if i == 2:
+                    raise
+                logger.error(
+                    'Failed to insert %s rule, retrying...' % _cmd(
+                        'tables', ipv6),
+                    'iptables',
+                    rule=rule,
+                )
+            time.sleep(1)
+
+def delete_rules(rules, ipv6=False, current=None):
+    if not rules:
+        return
+
+    if current is None:
+        try:
+            current = load_rules(ipv6)
+        except (OSError, subprocess.CalledProcessError):
+            logger.exception('Failed to load iptables rules', 'iptables')
+            current = set()
+
+    bulk_rules = []
+    single_rules = []
+    bulk_keys = set()
+    for rule in rules:
+        key = normalize_rule(rule, ipv6)
+        if key in current and key not in bulk_keys:
+            bulk_keys.add(key)
+            bulk_rules.append(rule)
+        else:
+            single_rules.append(rule)
+
+    if bulk_rules and not _restore(_rule_lines('-D', bulk_rules), ipv6):
+        single_rules = rules
+
+    for rule in single_rules:
+        try:
+            utils.check_call_silent([_cmd('tables', ipv6), '-D'] + rule)
+        except subprocess.CalledProcessError:
+            pass
@@ -1,19 +1,37 @@
+from pritunl.constants import *
 from pritunl import settings
 from pritunl import wsgiserver
 from pritunl import logger
 
 import time
+import threading
+import collections
 
 _get_time = time.time
 limiters = []
 
+class _LimiterShard(object):
+    def __init__(self, max_peers):
+        self.lock = threading.Lock()
+        self.peers = collections.OrderedDict()
+        self.max_peers = max_peers
+        self.stats = collections.Counter()
+
 class Limiter(object):
+    # Sliding window estimated from the count of the current and previous
+    # fixed windows. Peers are split across shards with separate locks and
+    # the least recently seen peer is evicted when a shard is full.
     def __init__(self, group_name, limit_name, limit_timeout_name):
         limiters.append(self)
-        self.peers_expire_count = {}
         self.group_name = group_name
         self.limit_name = limit_name
         self.limit_timeout_name = limit_timeout_name
+        max_peers = max(1, LIMITER_PEERS_MAX // LIMITER_SHARDS)
+        self.shards = [_LimiterShard(max_peers)
+            for _ in xrange(LIMITER_SHARDS)]
+
+    def _get_shard(self, peer):
+        return self.shards[hash(peer) % len(self.shards)]
 
     def validate(self, peer):
         settings_group = getattr(settings, self.group_name)
@@ -21,14 +39,84 @@ class Limiter(object):
         limit_timeout = getattr(settings_group, self.limit_timeout_name)
 
         cur_time = _get_time()
-        expire, count = self.peers_expire_count.get(peer, (None, None))
-        if expire and cur_time <= expire:
-            if count > limit:
-                return False
-            self.peers_expire_count[peer] = (expire, count + 1)
-        else:
-            self.peers_expire_count[peer] = (cur_time + limit_timeout, 1)
-        return True
+        shard = self._get_shard(peer)
+
+        shard.lock.acquire()
+        try:
+            window = shard.peers.pop(peer, None)
+            if window:
+                start, prev_count, count = window
+                elapsed = cur_time - start
+                if elapsed >= limit_timeout * 2:
+                    window = None
+                elif elapsed >= limit_timeout:
+                    start += limit_timeout
+                    prev_count = count
+                    count = 0
+                    elapsed -= limit_timeout
+
+            if not window:
+                start = cur_time
+                prev_count = 0
+                count = 0
+                elapsed = 0
+
+            weight = 1 - float(elapsed) / limit_timeout if limit_timeout else 0
+            valid = prev_count * weight + count <= limit
+            if valid:
+                count += 1
+
+            shard.peers[peer] = (start, prev_count, count)
+            while len(shard.peers) > shard.max_peers:
+                shard.peers.popitem(last=False)
+                shard.stats['evicted'] += 1
+
+            if valid:
+                shard.stats['allowed'] += 1
+            else:
+                shard.stats['rejected'] += 1
+        finally:
+            shard.lock.release()
+
+        return valid
+
+    def sweep(self):
+        settings_group = getattr(settings, self.group_name)
+        limit_timeout = getattr(settings_group, self.limit_timeout_name)
+        cur_time = _get_time()
+
+        for shard in self.shards:
+            shard.lock.acquire()
+            try:
+                for peer, (start, _, _) in shard.peers.items():
+                    if cur_time - start >= limit_timeout * 2:
+                        shard.peers.pop(peer, None)
+            finally:
+                shard.lock.release()
+
+    def get_stats(self):
+        stats = collections.Counter()
+        peers = 0
+        for shard in self.shards:
+            shard.lock.acquire()
+            try:
+                stats.update(shard.stats)
+                peers += len(shard.peers)
+            finally:
+                shard.lock.release()
+
+        return {
+            'peers': peers,
+            'allowed': stats['allowed'],
+            'rejected': stats['rejected'],
+            'evicted': stats['evicted'],
+        }
+
+def get_stats():
+    stats = {}
+    for limtr in limiters:
+        stats[limtr.group_name] = limtr.get_stats()
+    return stats
 
 _wsgi_limiter = Limiter('app', 'peer_limit', 'peer_limit_timeout')
 
@@ -1,9 +1,28 @@
+from pritunl.constants import *
 from pritunl.helpers import *
 from pritunl import mongo
 from pritunl import utils
+from pritunl import logger
 
 import pymongo
 import time
+import threading
+import collections
+import Queue
+
+_hub_lock = threading.Lock()
+_hub_thread = None
+_hub_cursor_id = None
+_subscribers = set()
+_publish_lock = threading.Lock()
+_publish_buffer = collections.OrderedDict()
+_publish_stats = {
+    'buffered': 0,
+    'coalesced': 0,
+    'flushed': 0,
+    'inserts': 0,
+    'failed': 0,
+}
 
 def publish(channels, message, extra=None, transaction=None):
     collection = mongo.get_collection('messages')
@@ -55,6 +74,90 @@ def publish(channels, message, extra=None, transaction=None):
                 docs.append(doc_copy)
             collection.insert(docs, manipulate=False)
 
+def publish_buffered(channels, message, extra=None):
+    # Message is held until the next buffer flush, identical messages
+    # published on the same channel within the window are sent once.
+    # Message must be hashable.
+    timestamp = utils.now()
+
+    if isinstance(channels, str):
+        channels = (channels,)
+
+    _publish_lock.acquire()
+    try:
+        for channel in channels:
+            _publish_stats['buffered'] += 1
+            key = (channel, message)
+
+            # Coalesced message is moved to the end to keep publish order
+            doc = _publish_buffer.pop(key, None)
+            if doc:
+                _publish_stats['coalesced'] += 1
+                _publish_buffer[key] = doc
+                doc['timestamp'] = timestamp
+                if extra:
+                    doc.update(extra)
+                continue
+
+            doc = {
+                'message': message,
+                'timestamp': timestamp,
+                'channel': channel,
+            }
+            if extra:
+                doc.update(extra)
+            _publish_buffer[key] = doc
+    finally:
+        _publish_lock.release()
+
+def flush_buffered():
+    global _publish_buffer
+
+    _publish_lock.acquire()
+    try:
+        if not _publish_buffer:
+            return 0
+        buffer = _publish_buffer
+        docs = buffer.values()
+        _publish_buffer = collections.OrderedDict()
+    finally:
+        _publish_lock.release()
+
+    collection = mongo.get_collection('messages')
+    try:
+        collection.insert(docs, manipulate=False)
+    except:
+        # Merge the batch back in front of messages buffered since the
+        # swap, newer messages with the same key are kept
+        _publish_lock.acquire()
+        try:
+            _publish_stats['failed'] += 1
+            for key, doc in _publish_buffer.items():
+                buffer.pop(key, None)
+                buffer[key] = doc
+            _publish_buffer = buffer
+        finally:
+            _publish_lock.release()
+        raise
+
+    _publish_lock.acquire()
+    try:
+        _publish_stats['flushed'] += len(docs)
+        _publish_stats['inserts'] += 1
+    finally:
+        _publish_lock.release()
+
+    return len(docs)
+
+def get_publish_stats():
+    _publish_lock.acquire()
+    try:
+        stats = _publish_stats.copy()
+        stats['pending'] = len(_publish_buffer)
+    finally:
+        _publish_lock.release()
+    return stats
+
 def get_cursor_id(channels):
     collection = mongo.get_collection('messages')
     spec = {}
@@ -74,58 +177,176 @@ def get_cursor_id(channels):
             else:
                 publish(channels, None)
 
-@interrupter_generator
-def subscribe(channels, cursor_id=None, timeout=None, yield_delay=None,
-        yield_app_server=False):
-    collection = mongo.get_collection('messages')
-    start_time = time.time()
-    cursor_id = cursor_id or get_cursor_id(channels)
-    while True:
+class _Subscriber(object):
+    def __init__(self, channels):
+        if isinstance(channels, str):
+            self.channels = {channels}
+        else:
+            self.channels = set(channels)
+        self.queue = utils.NoneQueue(MESSENGER_QUEUE_SIZE)
+        self.overflow = False
+
+    def put(self, doc):
+        if self.overflow:
+            return
         try:
-            spec = {}
+            self.queue.put(doc, False)
+        except Queue.Full:
+            # Subscriber fell behind, drop queued docs and let the
+            # subscriber catch up from mongodb using its last cursor id
+            self.overflow = True
+            self.queue = utils.NoneQueue(MESSENGER_QUEUE_SIZE)
 
-            if isinstance(channels, str):
-                spec['channel'] = channels
-            else:
-                spec['channel'] = {'$in': channels}
+def _get_last_id(collection):
+    try:
+        return collection.find().sort(
+            '$natural', pymongo.DESCENDING).limit(1)[0]['_id']
+    except IndexError:
+        return None
 
-            if cursor_id:
-                spec['_id'] = {'$gt': cursor_id}
+def _dispatch(doc):
+    global _hub_cursor_id
 
-            yield
+    _hub_lock.acquire()
+    try:
+        _hub_cursor_id = doc['_id']
+        channel = doc.get('channel')
+        for subscriber in _subscribers:
+            if channel in subscriber.channels:
+                subscriber.put(doc)
+    finally:
+        _hub_lock.release()
+
+def _hub_runner():
+    collection = mongo.get_collection('messages')
+
+    while True:
+        try:
+            spec = {}
+            if _hub_cursor_id:
+                spec['_id'] = {'$gt': _hub_cursor_id}
 
             cursor = collection.find(
                 spec,
                 cursor_type=pymongo.cursor.CursorType.TAILABLE_AWAIT,
             ).sort('$natural', pymongo.ASCENDING)
 
-            yield
-
+            received = False
             while cursor.alive:
                 for doc in cursor:
-                    cursor_id = doc['_id']
+                    received = True
+                    _dispatch(doc)
 
-                    yield
+                if check_global_interrupt():
+                    return
 
-                    if doc.get('message') is not None:
-                        doc.pop('nonce', None)
-                        yield doc
+            if not received:
+                time.sleep(0.1)
+        except pymongo.errors.AutoReconnect:
+            time.sleep(0.2)
+        except:
+            logger.exception('Error in messenger hub thread', 'messenger')
+            time.sleep(0.5)
+
+        if check_global_interrupt():
+            return
 
-                    if yield_delay:
-                        time.sleep(yield_delay)
+def _start_hub():
+    global _hub_thread
+    global _hub_cursor_id
 
-                        spec = spec.copy()
-                        spec['_id'] = {'$gt': cursor_id}
-                        cursor = collection.find(spec).sort(
-                            '$natural', pymongo.ASCENDING)
+    if _hub_thread and _hub_thread.is_alive():
+        return
 
-                        for doc in cursor:
-                            if doc.get('message') is not None:
-                                doc.pop('nonce', None)
-                                yield doc
+    collection = mongo.get_collection('messages')
+
+    _hub_lock.acquire()
+    try:
+        if _hub_thread and _hub_thread.is_alive():
+            return
+        if not _hub_cursor_id:
+            _hub_cursor_id = _get_last_id(collection)
+
+        _hub_thread = threading.Thread(target=_hub_runner)
+        _hub_thread.daemon = True
+        _hub_thread.start()
+    finally:
+        _hub_lock.release()
+
+def _register(channels, cursor_id):
+    subscriber = _Subscriber(channels)
+
+    _hub_lock.acquire()
+    try:
+        _subscribers.add(subscriber)
+        hub_cursor_id = _hub_cursor_id
+    finally:
+        _hub_lock.release()
+
+    backfill = cursor_id and hub_cursor_id and cursor_id < hub_cursor_id
+
+    return subscriber, backfill
+
+def _unregister(subscriber):
+    _hub_lock.acquire()
+    try:
+        _subscribers.discard(subscriber)
+    finally:
+        _hub_lock.release()
+
+def _find_since(channels, cursor_id):
+    collection = mongo.get_collection('messages')
+    spec = {
+        '_id': {'$gt': cursor_id},
+    }
 
-                        return
+    if isinstance(channels, str):
+        spec['channel'] = channels
+    else:
+        spec['channel'] = {'$in': channels}
+
+    return collection.find(spec).sort('$natural', pymongo.ASCENDING)
+
+def get_messages(channels, cursor_id):
+    # Messages newer than the cursor id read directly from mongodb
+    for doc in _find_since(channels, cursor_id):
+        if doc.get('message') is not None:
+            doc.pop('nonce', None)
+            yield doc
+
+@interrupter_generator
+def subscribe(channels, cursor_id=None, timeout=None, yield_delay=None,
+        yield_app_server=False):
+    # Messages are read by a single tailing cursor per process and fanned
+    # out to subscribers through bounded queues. Mongodb is only queried
+    # directly when a subscriber needs docs older than the hub cursor.
+    start_time = time.time()
+    _start_hub()
 
+    subscriber, backfill = _register(channels, cursor_id)
+    try:
+        pending = collections.deque()
+        while True:
+            if backfill or subscriber.overflow:
+                subscriber.overflow = False
+                backfill = False
+
+                if cursor_id:
+                    try:
+                        pending = collections.deque(
+                            _find_since(channels, cursor_id))
+                    except pymongo.errors.AutoReconnect:
+                        backfill = True
+                        time.sleep(0.2)
+                        yield
+                        continue
+
+            if pending:
+                doc = pending.popleft()
+            else:
+                doc = subscriber.queue.get(timeout=0.5)
+
+            if doc is None:
                 if yield_app_server and check_app_server_interrupt():
                     return
 
@@ -133,6 +354,43 @@ def subscribe(channels, cursor_id=None, timeout=None, yield_delay=None,
                     return
 
                 yield
+                continue
 
-        except pymongo.errors.AutoReconnect:
-            time.sleep(0.2)
+            if cursor_id and doc['_id'] <= cursor_id:
+                continue
+            cursor_id = doc['_id']
+
+            yield
+
+            if doc.get('message') is not None:
+                doc = doc.copy()
+                doc.pop('nonce', None)
+                yield doc
+
+            if yield_delay:
+                time.sleep(yield_delay)
+
+                for doc in pending:
+                    if doc['_id'] <= cursor_id:
+                        continue
+                    cursor_id = doc['_id']
+                    if doc.get('message') is not None:
+                        doc = doc.copy()
+                        doc.pop('nonce', None)
+                        yield doc
+
+                while True:
+                    doc = subscriber.queue.get(False)
+                    if doc is None:
+                        break
+                    if doc['_id'] <= cursor_id:
+                        continue
+                    cursor_id = doc['_id']
+                    if doc.get('message') is not None:
+                        doc = doc.copy()
+                        doc.pop('nonce', None)
+                        yield doc
+
+                return
+    finally:
+        _unregister(subscriber)
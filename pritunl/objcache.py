@@ -1,4 +1,6 @@
-import threading
+from pritunl.cache import timer_wheel
+
+import time
 
 class ObjCache(object):
     def __init__(self, ttl=60):
@@ -7,6 +9,9 @@ class ObjCache(object):
         self._timers = {}
 
     def remove(self, key):
+        cur_timer = self._timers.pop(key, None)
+        if cur_timer:
+            cur_timer.cancel()
         self._data.pop(key, None)
 
     def set(self, key, val):
@@ -14,12 +19,18 @@ class ObjCache(object):
         if cur_timer:
             cur_timer.cancel()
 
-        timer = threading.Timer(self._ttl, self.remove, (key,))
-        timer.daemon = True
-        self._timers[key] = timer
-        timer.start()
-
-        self._data[key] = val
+        self._timers[key] = timer_wheel.schedule(self._ttl, self.remove, key)
+        self._data[key] = (time.time() + self._ttl, val)
 
     def get(self, key):
-        return self._data.get(key)
+        data = self._data.get(key)
+        if data:
+            if data[0] <= time.time():
+                self.remove(key)
+                return None
+            return data[1]
+
+    def stats(self):
+        stats = timer_wheel.stats()
+        stats['keys'] = len(self._data)
+        return stats
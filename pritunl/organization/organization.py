@@ -77,7 +77,11 @@ class Organization(mongo.MongoObject):
 
     @property
     def page_total(self):
-        return int(math.floor(max(0, float(self.user_count - 1)) /
+        count = utils.get_count(('users', self.id), user.User.collection, {
+            'type': CERT_CLIENT,
+            'org_id': self.id,
+        })
+        return int(math.floor(max(0, float(count - 1)) /
             settings.user.page_count))
 
     @cached_static_property
@@ -169,12 +173,11 @@ class Organization(mongo.MongoObject):
         }).count()
 
     def iter_users(self, page=None, search=None, search_limit=None,
-            fields=None, include_pool=False):
+            fields=None, include_pool=False, keyset=None):
         spec = {
             'org_id': self.id,
             'type': CERT_CLIENT,
         }
-        searched = False
         type_search = False
         limit = None
         skip = None
@@ -184,26 +187,24 @@ class Organization(mongo.MongoObject):
             fields = {key: True for key in fields}
 
         if search is not None:
-            searched = True
+            user_type = CERT_CLIENT
+            email = None
+            status = None
 
             n = search.find('type:')
             if n != -1:
-                user_type = search[n + 5:].split(None, 1)
-                user_type = user_type[0] if user_type else ''
-                if user_type:
+                search_type = search[n + 5:].split(None, 1)
+                search_type = search_type[0] if search_type else ''
+                if search_type:
                     type_search = True
-                    spec['type'] = user_type
-                search = search[:n] + search[n + 5 + len(user_type):].strip()
+                    user_type = search_type
+                search = search[:n] + search[
+                    n + 5 + len(search_type):].strip()
 
             n = search.find('email:')
             if n != -1:
                 email = search[n + 6:].split(None, 1)
                 email = email[0] if email else ''
-                if email:
-                    spec['email'] = {
-                        '$regex': '.*%s.*/i' % email,
-                        '$options': 'i',
-                    }
                 search = search[:n] + search[n + 6 + len(email):].strip()
 
             n = search.find('status:')
@@ -215,47 +216,80 @@ class Organization(mongo.MongoObject):
                 if status not in (ONLINE, OFFLINE):
                     return
 
-                user_ids = self.clients_collection.find(None, {
+            # Matches and total count come from the org search index, only
+            # the users on the page are loaded
+            online_ids = None
+            if status:
+                online_ids = set(self.clients_collection.find(None, {
                     '_id': True,
                     'user_id': True,
-                }).distinct('user_id')
+                }).distinct('user_id'))
 
+            def get_matches(match_type):
+                matches = user.search_users(self.id, search.strip(), email,
+                    match_type)
                 if status == ONLINE:
-                    spec['_id'] = {'$in': user_ids}
-                else:
-                    spec['_id'] = {'$nin': user_ids}
-
-            spec['name'] = {
-                '$regex': '.*%s.*' % search.strip(),
-                '$options': 'i',
-            }
-
+                    matches = [x for x in matches if x[1] in online_ids]
+                elif status == OFFLINE:
+                    matches = [x for x in matches if x[1] not in online_ids]
+                return matches
+
+            def load_users(user_ids):
+                docs = {}
+                if user_ids:
+                    for doc in user.User.collection.find({
+                                '_id': {'$in': user_ids},
+                            }, fields):
+                        docs[doc['_id']] = doc
+
+                for user_id in user_ids:
+                    doc = docs.get(user_id)
+                    if doc:
+                        yield user.User(self, doc=doc, fields=fields)
+
+            matches = get_matches(user_type)
+            self.last_search_count = len(matches)
             limit = search_limit or page_count
-        elif page is not None:
-            limit = page_count
-            skip = page * page_count if page else 0
-
-        cursor = user.User.collection.find(spec, fields).sort(
-            'name', pymongo.ASCENDING)
 
-        if skip is not None:
-            cursor = cursor.skip(page * page_count if page else 0)
-        if limit is not None:
-            cursor = cursor.limit(limit + 1)
+            for usr in load_users([x[1] for x in matches[:limit]]):
+                yield usr
 
-        if searched:
-            self.last_search_count = cursor.count()
+            if len(matches) > limit or type_search:
+                return
 
-        if limit is None:
-            for doc in cursor:
+            # Server users are searched with the same filters
+            for usr in load_users([x[1] for x in get_matches(CERT_SERVER)]):
+                yield usr
+            return
+        elif keyset:
+            for doc in keyset.find(user.User.collection, spec, fields):
                 yield user.User(self, doc=doc, fields=fields)
+
+            if keyset.next_cursor:
+                return
         else:
-            count = 0
-            for doc in cursor:
-                count += 1
-                if count > limit:
-                    return
-                yield user.User(self, doc=doc, fields=fields)
+            if page is not None:
+                limit = page_count
+                skip = page * page_count if page else 0
+
+            cursor = user.User.collection.find(spec, fields).sort(
+                'name', pymongo.ASCENDING)
+
+            if skip is not None:
+                cursor = cursor.skip(skip)
+            if limit is not None:
+                cursor = cursor.limit(limit + 1)
+
+            if limit is None:
+                for doc in cursor:
+                    yield user.User(self, doc=doc, fields=fields)
+            else:
+                count = 0
+                for doc in cursor:
+                    count += 1
+                    if count > limit:
+                        return
+                    yield user.User(self, doc=doc, fields=fields)
 
         if type_search:
             return
@@ -391,5 +425,6 @@ class Organization(mongo.MongoObject):
         user_collection.remove({
             'org_id': self.id,
         })
+        user.search.clear_org(self.id)
 
         return server_ids
@@ -5,6 +5,7 @@ from pritunl import mongo
 from pritunl import utils
 from pritunl import organization
 from pritunl import logger
+from pritunl import user
 
 @pooler.add_pooler('user')
 def fill_user():
@@ -66,7 +67,27 @@ def fill_user():
         orgs_count[pool['_id']['org_id'], pool['_id']['type']] += pool[
             'count']
 
-    new_users = []
+    pools = queue_collection.aggregate([
+        {'$match': {
+            'type': 'init_users_pooled',
+        }},
+        {'$project': {
+            'user_docs.org_id': True,
+            'user_docs.type': True,
+        }},
+        {'$unwind': '$user_docs'},
+        {'$group': {
+            '_id': {
+                'org_id': '$user_docs.org_id',
+                'type': '$user_docs.type',
+            },
+            'count': {'$sum': 1},
+        }},
+    ])
+
+    for pool in pools:
+        orgs_count[pool['_id']['org_id'], pool['_id']['type']] += pool[
+            'count']
 
     for org_id_user_type, count in orgs_count.least_common():
         org_id, user_type = org_id_user_type
@@ -82,17 +103,11 @@ def fill_user():
                 user_type=user_type,
             )
             continue
-        new_users.append([(org, user_type)] * (pool_size - count))
-
-    for org, user_type in utils.roundrobin(*new_users):
-        org.new_user(type=user_type, block=False)
+        user.new_pooled_users(org, user_type, pool_size - count)
 
 @pooler.add_pooler('new_user')
 def fill_new_user(org):
-    user_types = utils.roundrobin(
-        [CERT_CLIENT_POOL] * settings.app.user_pool_size,
-        [CERT_SERVER_POOL] * settings.app.server_user_pool_size,
-    )
-
-    for user_type in user_types:
-        org.new_user(type=user_type, block=False)
+    user.new_pooled_users(org, CERT_CLIENT_POOL,
+        settings.app.user_pool_size)
+    user.new_pooled_users(org, CERT_SERVER_POOL,
+        settings.app.server_user_pool_size)
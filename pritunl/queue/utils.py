@@ -3,8 +3,79 @@ from pritunl.queue.queue import Queue
 from pritunl.constants import *
 from pritunl import messenger
 
+import threading
+
 queue_types = {}
 reserve_types = {}
+_stats_lock = threading.Lock()
+_stats = {}
+
+def _get_stat(queue_type):
+    stat = _stats.get(queue_type)
+    if not stat:
+        stat = {
+            'queued': 0,
+            'running': 0,
+            'count': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0,
+            'run_total': 0.0,
+            'run_max': 0.0,
+        }
+        _stats[queue_type] = stat
+    return stat
+
+def stat_queued(queue_type):
+    _stats_lock.acquire()
+    try:
+        _get_stat(queue_type)['queued'] += 1
+    finally:
+        _stats_lock.release()
+
+def stat_started(queue_type, wait_time):
+    _stats_lock.acquire()
+    try:
+        stat = _get_stat(queue_type)
+        stat['queued'] -= 1
+        stat['running'] += 1
+        stat['wait_total'] += wait_time
+        stat['wait_max'] = max(stat['wait_max'], wait_time)
+    finally:
+        _stats_lock.release()
+
+def stat_finished(queue_type, run_time):
+    _stats_lock.acquire()
+    try:
+        stat = _get_stat(queue_type)
+        stat['running'] -= 1
+        stat['count'] += 1
+        stat['run_total'] += run_time
+        stat['run_max'] = max(stat['run_max'], run_time)
+    finally:
+        _stats_lock.release()
+
+def get_stats():
+    stats = {}
+
+    _stats_lock.acquire()
+    try:
+        for queue_type, stat in _stats.items():
+            started = stat['count'] + stat['running']
+            stats[queue_type] = {
+                'queued': stat['queued'],
+                'running': stat['running'],
+                'count': stat['count'],
+                'wait_avg': round(stat['wait_total'] / started, 4) \
+                    if started else 0,
+                'wait_max': round(stat['wait_max'], 4),
+                'run_avg': round(stat['run_total'] / stat['count'], 4) \
+                    if stat['count'] else 0,
+                'run_max': round(stat['run_max'], 4),
+            }
+    finally:
+        _stats_lock.release()
+
+    return stats
 
 def get(doc):
     return queue_types[doc['type']](doc=doc)
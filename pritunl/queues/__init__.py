@@ -4,4 +4,5 @@ from pritunl.queues.dh_params import QueueDhParams
 from pritunl.queues.init_org_pooled import QueueInitOrgPooled
 from pritunl.queues.init_user import QueueInitUser
 from pritunl.queues.init_user_pooled import QueueInitUserPooled
+from pritunl.queues.init_users_pooled import QueueInitUsersPooled
 from pritunl.queues.unassign_ip_addr import QueueUnassignIpAddr
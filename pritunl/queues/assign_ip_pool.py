@@ -6,6 +6,7 @@ from pritunl import mongo
 from pritunl import event
 from pritunl import server
 from pritunl import queue
+from pritunl.server import ip_bitmap
 
 @queue.add_queue
 class QueueAssignIpPool(queue.Queue):
@@ -91,10 +92,12 @@ class QueueAssignIpPool(queue.Queue):
 
     def post_task(self):
         try:
-            self.server_ip_pool_collection.remove({
+            spec = {
                 'network': self.old_network_hash,
                 'server_id': self.server_id,
-            })
+            }
+            self.server_ip_pool_collection.remove(spec)
+            ip_bitmap.remove_bitmaps(spec)
         finally:
             self.server_collection.update({
                 '_id': self.server_id,
@@ -105,10 +108,12 @@ class QueueAssignIpPool(queue.Queue):
 
     def rollback_task(self):
         try:
-            self.server_ip_pool_collection.remove({
+            spec = {
                 'network': self.network_hash,
                 'server_id': self.server_id,
-            })
+            }
+            self.server_ip_pool_collection.remove(spec)
+            ip_bitmap.remove_bitmaps(spec)
 
             doc = {
                 'network': self.old_network,
@@ -0,0 +1,54 @@
+from pritunl.constants import *
+from pritunl.helpers import *
+from pritunl import event
+from pritunl import organization
+from pritunl import user
+from pritunl import queue
+
+@queue.add_queue
+class QueueInitUsersPooled(queue.Queue):
+    fields = {
+        'org_doc',
+        'user_docs',
+    } | queue.Queue.fields
+    cpu_type = NORMAL_CPU
+    type = 'init_users_pooled'
+
+    def __init__(self, org_doc=None, user_docs=None, **kwargs):
+        queue.Queue.__init__(self, **kwargs)
+
+        if org_doc is not None:
+            self.org_doc = org_doc
+        if user_docs is not None:
+            self.user_docs = user_docs
+
+    @cached_property
+    def org(self):
+        return organization.Organization(doc=self.org_doc)
+
+    @cached_property
+    def users(self):
+        users = []
+        for user_doc in self.user_docs:
+            usr = user.User(org=self.org, doc=user_doc)
+            usr.exists = False
+            users.append(usr)
+        return users
+
+    def task(self):
+        user.initialize_users(self.org, self.users)
+        for usr in self.users:
+            usr.commit()
+
+    def repeat_task(self):
+        event.Event(type=ORGS_UPDATED)
+        event.Event(type=USERS_UPDATED, resource_id=self.org.id)
+        event.Event(type=SERVERS_UPDATED)
+
+    def pause_task(self):
+        # Batches are never reserved and can always be paused
+        self.org.queue_com.running.clear()
+        return True
+
+    def resume_task(self):
+        self.org.queue_com.running.set()
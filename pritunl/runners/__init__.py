@@ -13,6 +13,13 @@ from pritunl.runners.instance import start_instance
 from pritunl.runners.time_sync import start_time_sync
 from pritunl.runners.limiter import start_limiter
 from pritunl.runners.listener import start_listener
+from pritunl.runners.messenger import start_messenger
+from pritunl.runners.output import start_output
+from pritunl.runners.bandwidth import start_bandwidth
+from pritunl.runners.status import start_status
+from pritunl.runners.auth import start_auth
+from pritunl.runners.audit import start_audit
+from pritunl.runners.otp import start_otp
 
 def start_all():
     start_settings()
@@ -22,6 +29,13 @@ def start_all():
     start_task()
     start_queue()
     start_event()
+    start_messenger()
+    start_output()
+    start_bandwidth()
+    start_status()
+    start_auth()
+    start_audit()
+    start_otp()
     start_host()
     start_subscription()
     start_server()
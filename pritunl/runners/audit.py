@@ -0,0 +1,26 @@
+from pritunl.constants import *
+from pritunl.helpers import *
+from pritunl import logger
+from pritunl import audit
+
+import time
+import threading
+
+@interrupter
+def _audit_runner_thread():
+    while True:
+        try:
+            audit.flush_audit()
+            yield interrupter_sleep(AUDIT_FLUSH_RATE)
+        except GeneratorExit:
+            try:
+                audit.flush_audit()
+            except:
+                logger.exception('Failed to flush audit events', 'runners')
+            raise
+        except:
+            logger.exception('Error in audit runner thread', 'runners')
+            time.sleep(0.5)
+
+def start_audit():
+    threading.Thread(target=_audit_runner_thread).start()
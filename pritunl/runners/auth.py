@@ -0,0 +1,29 @@
+from pritunl.constants import *
+from pritunl.helpers import *
+from pritunl import logger
+from pritunl import settings
+from pritunl import listener
+from pritunl import auth
+
+import time
+import threading
+
+@interrupter
+def _auth_runner_thread():
+    while True:
+        try:
+            auth.flush_nonces()
+            yield interrupter_sleep(settings.app.auth_nonce_sync_rate)
+        except GeneratorExit:
+            try:
+                auth.flush_nonces()
+            except:
+                logger.exception('Failed to flush auth nonces', 'runners')
+            raise
+        except:
+            logger.exception('Error in auth runner thread', 'runners')
+            time.sleep(0.5)
+
+def start_auth():
+    listener.add_listener('administrators', auth.on_admin_msg)
+    threading.Thread(target=_auth_runner_thread).start()
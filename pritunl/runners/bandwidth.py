@@ -0,0 +1,26 @@
+from pritunl.constants import *
+from pritunl.helpers import *
+from pritunl import logger
+from pritunl import server
+
+import time
+import threading
+
+@interrupter
+def _bandwidth_runner_thread():
+    while True:
+        try:
+            server.flush_bandwidth()
+            yield interrupter_sleep(BANDWIDTH_FLUSH_RATE)
+        except GeneratorExit:
+            try:
+                server.flush_bandwidth(True)
+            except:
+                logger.exception('Failed to flush bandwidth', 'runners')
+            raise
+        except:
+            logger.exception('Error in bandwidth runner thread', 'runners')
+            time.sleep(0.5)
+
+def start_bandwidth():
+    threading.Thread(target=_bandwidth_runner_thread).start()
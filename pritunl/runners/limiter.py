@@ -11,10 +11,7 @@ def _limiter_runner_thread():
     while True:
         try:
             for limtr in limiter.limiters:
-                cur_time = time.time()
-                for peer, (expire, count) in limtr.peers_expire_count.items():
-                    if cur_time > expire:
-                        limtr.peers_expire_count.pop(peer, None)
+                limtr.sweep()
 
             yield interrupter_sleep(settings.app.peer_limit_timeout * 2)
 
@@ -0,0 +1,22 @@
+from pritunl.helpers import *
+from pritunl import logger
+from pritunl import settings
+from pritunl import messenger
+
+import time
+import threading
+
+@interrupter
+def _messenger_runner_thread():
+    while True:
+        try:
+            messenger.flush_buffered()
+            yield interrupter_sleep(settings.app.publish_buffer_window)
+        except GeneratorExit:
+            raise
+        except:
+            logger.exception('Error in messenger runner thread', 'runners')
+            time.sleep(0.5)
+
+def start_messenger():
+    threading.Thread(target=_messenger_runner_thread).start()
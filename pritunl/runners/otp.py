@@ -0,0 +1,26 @@
+from pritunl.constants import *
+from pritunl.helpers import *
+from pritunl import logger
+from pritunl.user import otp
+
+import time
+import threading
+
+@interrupter
+def _otp_runner_thread():
+    while True:
+        try:
+            otp.flush_otp()
+            yield interrupter_sleep(OTP_FLUSH_RATE)
+        except GeneratorExit:
+            try:
+                otp.flush_otp()
+            except:
+                logger.exception('Failed to flush otp cache', 'runners')
+            raise
+        except:
+            logger.exception('Error in otp runner thread', 'runners')
+            time.sleep(0.5)
+
+def start_otp():
+    threading.Thread(target=_otp_runner_thread).start()
@@ -0,0 +1,22 @@
+from pritunl.constants import *
+from pritunl.helpers import *
+from pritunl import logger
+from pritunl import server
+
+import time
+import threading
+
+@interrupter
+def _output_runner_thread():
+    while True:
+        try:
+            server.flush_output()
+            yield interrupter_sleep(OUTPUT_FLUSH_RATE)
+        except GeneratorExit:
+            raise
+        except:
+            logger.exception('Error in output runner thread', 'runners')
+            time.sleep(0.5)
+
+def start_output():
+    threading.Thread(target=_output_runner_thread).start()
@@ -8,16 +8,210 @@ from pritunl import queue
 from pritunl import queues
 
 import threading
+import collections
+import heapq
 import time
 
 running_queues = {}
-runner_queues = [utils.PyPriorityQueue() for _ in xrange(3)]
-thread_limits = [threading.Semaphore(x) for x in (
-    settings.app.queue_low_thread_limit,
-    settings.app.queue_med_thread_limit,
-    settings.app.queue_high_thread_limit,
+_running_lock = threading.Lock()
+_running_heap = []
+
+class QueuePool(object):
+    # Fixed set of worker threads for a cpu type. Queued items are kept
+    # in a fifo per priority and the head of each fifo gains one priority
+    # level for every QUEUE_PRIORITY_AGE seconds it waits. Workers blocked
+    # in a paused item are replaced until the item is resumed.
+    def __init__(self, cpu_type, limit):
+        self.cpu_type = cpu_type
+        self.limit = limit
+        self.cond = threading.Condition(threading.Lock())
+        self.levels = [collections.deque() for _ in xrange(VERY_HIGH + 1)]
+        self.queued = 0
+        self.active = 0
+        self.paused = 0
+        self.workers = 0
+
+    def _start_worker(self):
+        self.workers += 1
+        thread = threading.Thread(target=self._worker_thread)
+        thread.daemon = True
+        thread.start()
+
+    def start(self):
+        self.cond.acquire()
+        try:
+            while self.workers < self.limit:
+                self._start_worker()
+        finally:
+            self.cond.release()
+
+    def put(self, queue_item, paused=False):
+        priority = min(max(queue_item.priority, VERY_LOW), VERY_HIGH)
+
+        self.cond.acquire()
+        try:
+            self.levels[priority].append((time.time(), paused, queue_item))
+            self.queued += 1
+            self.cond.notify_all()
+        finally:
+            self.cond.release()
+
+        if not paused:
+            queue.stat_queued(queue_item.type)
+
+    def pause(self, queue_item):
+        self.cond.acquire()
+        try:
+            self.active -= 1
+            self.paused += 1
+            if self.workers < self.limit + self.paused:
+                self._start_worker()
+        finally:
+            self.cond.release()
+
+        self.put(queue_item, True)
+
+    def _get(self):
+        cur_time = time.time()
+        level = None
+        level_score = None
+
+        for priority in xrange(len(self.levels) - 1, -1, -1):
+            items = self.levels[priority]
+            if not items:
+                continue
+
+            score = priority + (cur_time - items[0][0]) / QUEUE_PRIORITY_AGE
+            if level_score is None or score > level_score:
+                level = items
+                level_score = score
+
+        self.queued -= 1
+        return level.popleft()
+
+    def _run(self, queue_item, queue_time, paused):
+        release = True
+        try:
+            if paused:
+                # Run slot is passed back to the worker blocked in the item
+                release = False
+                if queue_item.queue_com.state == PAUSED:
+                    queue_item.resume()
+                    _add_running(queue_item)
+            elif queue_item.queue_com.state == None:
+                logger.debug('Run queue item', 'queue_runner',
+                    queue_id=queue_item.id,
+                    queue_type=queue_item.type,
+                )
+
+                run_time = time.time()
+                queue.stat_started(queue_item.type, run_time - queue_time)
+                _add_running(queue_item)
+                try:
+                    queue_item.run()
+                finally:
+                    queue.stat_finished(queue_item.type,
+                        time.time() - run_time)
+                    _remove_running(queue_item)
+            else:
+                queue.stat_started(queue_item.type, time.time() - queue_time)
+                queue.stat_finished(queue_item.type, 0)
+                _remove_running(queue_item)
+        finally:
+            self.cond.acquire()
+            try:
+                if release:
+                    self.active -= 1
+                else:
+                    self.paused -= 1
+                self.cond.notify_all()
+            finally:
+                self.cond.release()
+
+    def _worker_thread(self):
+        while True:
+            self.cond.acquire()
+            try:
+                while not self.queued or self.active >= self.limit:
+                    if self.workers > self.limit + self.paused:
+                        self.workers -= 1
+                        return
+                    self.cond.wait()
+
+                queue_time, paused, queue_item = self._get()
+                self.active += 1
+            finally:
+                self.cond.release()
+
+            try:
+                self._run(queue_item, queue_time, paused)
+            except:
+                logger.exception('Error in queue worker thread', 'runners',
+                    queue_id=queue_item.id,
+                    queue_type=queue_item.type,
+                )
+
+pools = [QueuePool(cpu_type, limit) for cpu_type, limit in (
+    (LOW_CPU, settings.app.queue_low_thread_limit),
+    (NORMAL_CPU, settings.app.queue_med_thread_limit),
+    (HIGH_CPU, settings.app.queue_high_thread_limit),
 )]
 
+def _add_running(queue_item):
+    _running_lock.acquire()
+    try:
+        heapq.heappush(_running_heap, (queue_item.priority, queue_item))
+
+        # Compact entries of finished items left in the heap
+        if len(_running_heap) > len(running_queues) * 2 + 16:
+            _running_heap[:] = [x for x in _running_heap
+                if running_queues.get(x[1].id) is x[1]]
+            heapq.heapify(_running_heap)
+    finally:
+        _running_lock.release()
+
+def _remove_running(queue_item):
+    if running_queues.get(queue_item.id) is queue_item:
+        running_queues.pop(queue_item.id, None)
+
+def _pause_running(priority):
+    # Running items are ordered by priority, only items with a lower
+    # priority than the new item are popped and paused
+    running = []
+
+    _running_lock.acquire()
+    try:
+        while _running_heap and _running_heap[0][0] < priority:
+            running.append(heapq.heappop(_running_heap))
+    finally:
+        _running_lock.release()
+
+    keep = []
+    for item in running:
+        running_queue = item[1]
+        if running_queues.get(running_queue.id) is not running_queue:
+            continue
+
+        if running_queue.pause():
+            logger.debug('Pause queue item', 'queue',
+                queue_id=running_queue.id,
+                queue_type=running_queue.type,
+                queue_priority=running_queue.priority,
+                queue_cpu_type=running_queue.cpu_type,
+            )
+
+            pools[running_queue.cpu_type].pause(running_queue)
+        elif running_queue.queue_com.state not in (COMPLETE, STOPPED):
+            keep.append(item)
+
+    if keep:
+        _running_lock.acquire()
+        try:
+            for item in keep:
+                heapq.heappush(_running_heap, item)
+        finally:
+            _running_lock.release()
+
 def add_queue_item(queue_item):
     if queue_item.id in running_queues:
         return
@@ -30,29 +224,10 @@ def add_queue_item(queue_item):
         queue_cpu_type=queue_item.cpu_type,
     )
 
-    runner_queues[queue_item.cpu_type].put((
-        abs(queue_item.priority - 4),
-        queue_item,
-    ))
+    pools[queue_item.cpu_type].put(queue_item)
 
     if queue_item.priority >= NORMAL:
-        for running_queue in running_queues.values():
-            if running_queue.priority >= queue_item.priority:
-                continue
-
-            if running_queue.pause():
-                logger.debug('Puase queue item', 'queue',
-                    queue_id=running_queue.id,
-                    queue_type=running_queue.type,
-                    queue_priority=running_queue.priority,
-                    queue_cpu_type=running_queue.cpu_type,
-                )
-
-                runner_queues[running_queue.cpu_type].put((
-                    abs(running_queue.priority - 4),
-                    running_queue,
-                ))
-                thread_limits[running_queue.cpu_type].release()
+        _pause_running(queue_item.priority)
 
 def _on_msg(msg):
     try:
@@ -80,10 +255,7 @@ def run_timeout_queues():
         }})
 
         if response['updatedExisting']:
-            runner_queues[queue_item.cpu_type].put((
-                abs(queue_item.priority - 4),
-                queue_item,
-            ))
+            pools[queue_item.cpu_type].put(queue_item)
 
 @interrupter
 def _check_thread():
@@ -97,46 +269,9 @@ def _check_thread():
 
         yield interrupter_sleep(settings.mongo.queue_ttl)
 
-def run_queue_item(queue_item, thread_limit):
-    release = True
-    try:
-        if queue_item.queue_com.state == None:
-            logger.debug('Run queue item', 'queue_runner',
-                queue_id=queue_item.id,
-                queue_type=queue_item.type,
-            )
-            queue_item.run()
-        elif queue_item.queue_com.state == PAUSED:
-            release = False
-            queue_item.resume()
-    finally:
-        running_queues.pop(queue_item.id, None)
-        if release:
-            thread_limit.release()
-
-def _runner_thread(cpu_priority, thread_limit, runner_queue):
-    while True:
-        try:
-            thread_limit.acquire()
-            priority, queue_item = runner_queue.get()
-
-            thread = threading.Thread(target=run_queue_item,
-                args=(queue_item, thread_limit))
-            thread.daemon = True
-            thread.start()
-        except:
-            logger.exception('Error in runner thread', 'runners')
-            time.sleep(0.5)
-
 def start_queue():
-    for cpu_priority in (LOW_CPU, NORMAL_CPU, HIGH_CPU):
-        thread = threading.Thread(target=_runner_thread, args=(
-            cpu_priority,
-            thread_limits[cpu_priority],
-            runner_queues[cpu_priority],
-        ))
-        thread.daemon = True
-        thread.start()
+    for pool in pools:
+        pool.start()
 
     threading.Thread(target=_check_thread).start()
 
@@ -0,0 +1,25 @@
+from pritunl.constants import *
+from pritunl.helpers import *
+from pritunl import logger
+from pritunl import listener
+from pritunl import statuscache
+
+import time
+import threading
+
+@interrupter
+def _status_runner_thread():
+    while True:
+        try:
+            statuscache.refresh()
+            yield interrupter_sleep(STATUS_UPDATE_RATE)
+        except GeneratorExit:
+            raise
+        except:
+            logger.exception('Error in status runner thread', 'runners')
+            time.sleep(0.5)
+
+def start_status():
+    listener.add_listener('status', statuscache.on_msg)
+    listener.add_listener('events', statuscache.on_event_msg)
+    threading.Thread(target=_status_runner_thread).start()
@@ -1,3 +1,4 @@
+from pritunl.constants import *
 from pritunl.helpers import *
 from pritunl import settings
 from pritunl import logger
@@ -7,6 +8,8 @@ from pritunl import utils
 import threading
 import time
 import random
+import heapq
+import datetime
 
 def random_sleep():
     time.sleep(random.randint(0, 50) / 1000.)
@@ -17,43 +20,77 @@ def run_task(tsk):
     thread.daemon = True
     thread.start()
 
+def _run_scheduled(task_cls, fire_time):
+    try:
+        if task_cls.lease:
+            if not task.claim_lease(task_cls.type, fire_time):
+                return
+        else:
+            random_sleep()
+        task_cls().run()
+    except:
+        logger.exception('Error running scheduled task', 'runners',
+            task_type=task_cls.type,
+        )
+
+def run_scheduled(task_cls, fire_time):
+    thread = threading.Thread(target=_run_scheduled,
+        args=(task_cls, fire_time))
+    thread.daemon = True
+    thread.start()
+
 def print_tasks():
-    for hour in task.tasks:
-        print 'hour:', hour
-        for minute in task.tasks[hour]:
-            print '    minute:', minute
-            for second in task.tasks[hour][minute]:
-                print '        second:', second
-                for tsk in task.tasks[hour][minute][second]:
-                    print '            task:', tsk
+    for task_cls, hours, minutes, seconds in task.schedules:
+        print 'task:', task_cls.type
+        print '    hours:', hours
+        print '    minutes:', minutes
+        print '    seconds:', seconds
+
+def _build_heap(cur_time):
+    heap = []
+    after = cur_time - datetime.timedelta(seconds=1)
+    for i, schedule in enumerate(task.schedules):
+        heap.append((task.next_fire(schedule, after), i))
+    heapq.heapify(heap)
+    return heap
 
 @interrupter
 def run_thread():
-    last_run = None
-
     try:
         for task_cls in task.tasks_on_start:
             run_task(task_cls())
     except:
         logger.exception('Error running on start tasks', 'runners')
 
+    # Next fire time of each schedule is kept in a heap, the thread
+    # sleeps until the earliest fire time
+    last_time = utils.now()
+    heap = _build_heap(last_time)
+
     while True:
         try:
             cur_time = utils.now()
-
-            if int(time.mktime(cur_time.timetuple())) != last_run:
-                last_run = int(time.mktime(cur_time.timetuple()))
-
-                for hour in ('all', cur_time.hour):
-                    for minute in ('all', cur_time.minute):
-                        for second in ('all', cur_time.second):
-                            for task_cls in task.tasks[hour][minute][second]:
-                                run_task(task_cls())
+            if cur_time < last_time - datetime.timedelta(seconds=1):
+                heap = _build_heap(cur_time)
+            last_time = cur_time
+
+            while heap and heap[0][0] <= cur_time:
+                fire_time, i = heapq.heappop(heap)
+                schedule = task.schedules[i]
+                run_scheduled(schedule[0], fire_time)
+                heapq.heappush(heap, (task.next_fire(
+                    schedule, max(fire_time, cur_time)), i))
+
+            if heap:
+                delay = (heap[0][0] - utils.now()).total_seconds()
+            else:
+                delay = TASK_SLEEP_MAX
+            delay = min(max(delay, 0.01), TASK_SLEEP_MAX)
         except:
             logger.exception('Error in tasks run thread', 'runners')
+            delay = 0.5
 
-        time.sleep(0.5)
-        yield
+        yield interrupter_sleep(delay)
 
 @interrupter
 def check_thread():
@@ -65,8 +102,6 @@ def check_thread():
             }
 
             for task_item in task.iter_tasks(spec):
-                random_sleep()
-
                 response = task.Task.collection.update({
                     '_id': task_item.id,
                     'ttl_timestamp': {'$lt': cur_timestamp},
@@ -1,5 +1,6 @@
 from pritunl.server.server import Server, dict_fields, operation_fields
-from pritunl.server.bandwidth import ServerBandwidth
+from pritunl.server.bandwidth import ServerBandwidth, flush_bandwidth
 from pritunl.server.listener import on_msg
 from pritunl.server.ip_pool import *
 from pritunl.server.utils import *
+from pritunl.server.output import flush_output
@@ -7,6 +7,114 @@ from pritunl import utils
 import os
 import json
 import random
+import threading
+import time
+
+PERIODS = ('1m', '5m', '30m', '2h', '1d')
+
+_bandwidth_lock = threading.Lock()
+_bandwidth_buffer = {}
+
+def _get_pending(server_id, period):
+    pending = []
+
+    _bandwidth_lock.acquire()
+    try:
+        for (buf_server_id, buf_period, timestamp), data in \
+                _bandwidth_buffer.items():
+            if buf_server_id == server_id and buf_period == period:
+                pending.append((timestamp, data[0], data[1]))
+    finally:
+        _bandwidth_lock.release()
+
+    return pending
+
+def flush_bandwidth(force=False):
+    # Buckets are written when their period closes or when they have been
+    # buffered for longer than the max flush interval
+    cur_time = time.time()
+    period_timestamps = {}
+    now = utils.now()
+    flush = {}
+
+    _bandwidth_lock.acquire()
+    try:
+        for key, data in _bandwidth_buffer.items():
+            server_id, period, timestamp = key
+
+            if not force and cur_time - data[2] < BANDWIDTH_FLUSH_MAX:
+                period_timestamp = period_timestamps.get(period)
+                if period_timestamp is None:
+                    period_timestamp = ServerBandwidth(
+                        None)._get_period_timestamp(period, now)
+                    period_timestamps[period] = period_timestamp
+
+                if timestamp >= period_timestamp:
+                    continue
+
+            flush[key] = _bandwidth_buffer.pop(key)
+    finally:
+        _bandwidth_lock.release()
+
+    if not flush:
+        return 0
+
+    collection = ServerBandwidth.collection
+    try:
+        if mongo.has_bulk:
+            bulk = collection.initialize_unordered_bulk_op()
+        else:
+            bulk = None
+
+        for (server_id, period, timestamp), data in flush.items():
+            spec = {
+                'server_id': server_id,
+                'period': period,
+                'timestamp': timestamp,
+            }
+            doc = {'$inc': {
+                'received': data[0],
+                'sent': data[1],
+            }}
+
+            if bulk:
+                bulk.find(spec).upsert().update(doc)
+            else:
+                collection.update(spec, doc, upsert=True)
+
+        if bulk:
+            bulk.execute()
+    except:
+        # Counters are additive, merge failed buckets back into the
+        # buffer to retry on the next flush
+        _bandwidth_lock.acquire()
+        try:
+            for key, data in flush.items():
+                cur_data = _bandwidth_buffer.get(key)
+                if cur_data:
+                    cur_data[0] += data[0]
+                    cur_data[1] += data[1]
+                    cur_data[2] = min(cur_data[2], data[2])
+                else:
+                    _bandwidth_buffer[key] = data
+        finally:
+            _bandwidth_lock.release()
+        raise
+
+    return len(flush)
+
+def clean_bandwidth():
+    collection = ServerBandwidth.collection
+    now = utils.now()
+
+    for period in PERIODS:
+        collection.remove({
+            'period': period,
+            'timestamp': {
+                '$lt': ServerBandwidth(None)._get_period_max_timestamp(
+                    period, now),
+            },
+        })
 
 class ServerBandwidth(object):
     def __init__(self, server_id):
@@ -57,38 +165,24 @@ class ServerBandwidth(object):
                 minutes=timestamp.minute) - datetime.timedelta(days=365)
 
     def add_data(self, timestamp, received, sent):
-        if mongo.has_bulk:
-            bulk = self.collection.initialize_unordered_bulk_op()
-        else:
-            bulk = None
-
-        for period in ('1m', '5m', '30m', '2h', '1d'):
-            spec = {
-                'server_id': self.server_id,
-                'period': period,
-                'timestamp': self._get_period_timestamp(period, timestamp),
-            }
-            doc = {'$inc': {
-                'received': received,
-                'sent': sent,
-            }}
-            rem_spec = {
-                'server_id': self.server_id,
-                'period': period,
-                'timestamp': {
-                    '$lt': self._get_period_max_timestamp(period, timestamp),
-                },
-            }
+        cur_time = time.time()
 
-            if bulk:
-                bulk.find(spec).upsert().update(doc)
-                bulk.find(rem_spec).remove()
-            else:
-                self.collection.update(spec, doc, upsert=True)
-                self.collection.remove(rem_spec)
-
-        if bulk:
-            bulk.execute()
+        _bandwidth_lock.acquire()
+        try:
+            for period in PERIODS:
+                key = (
+                    self.server_id,
+                    period,
+                    self._get_period_timestamp(period, timestamp),
+                )
+                data = _bandwidth_buffer.get(key)
+                if data:
+                    data[0] += received
+                    data[1] += sent
+                else:
+                    _bandwidth_buffer[key] = [received, sent, cur_time]
+        finally:
+            _bandwidth_lock.release()
 
     def get_period(self, period):
         date_end = self._get_period_timestamp(period, utils.now())
@@ -120,38 +214,37 @@ class ServerBandwidth(object):
         spec = {
             'server_id': self.server_id,
             'period': period,
+            'timestamp': {'$gte': date_start},
         }
         project = {
+            '_id': False,
             'timestamp': True,
             'received': True,
             'sent': True,
         }
 
-        for doc in self.collection.find(spec, project).sort('timestamp'):
-            if date_cur > doc['timestamp']:
-                continue
+        counts = {}
+        for doc in self.collection.find(spec, project):
+            counts[doc['timestamp']] = [doc['received'], doc['sent']]
 
-            while date_cur < doc['timestamp']:
-                timestamp = int(date_cur.strftime('%s'))
-                data['received'].append((timestamp, 0))
-                data['sent'].append((timestamp, 0))
-                date_cur += date_step
+        # Include buckets from this host that have not been flushed
+        for timestamp, received, sent in _get_pending(self.server_id, period):
+            count = counts.get(timestamp)
+            if count:
+                count[0] += received
+                count[1] += sent
+            else:
+                counts[timestamp] = [received, sent]
 
-            timestamp = int(doc['timestamp'].strftime('%s'))
-            received = doc['received']
-            sent = doc['sent']
+        while date_cur <= date_end:
+            timestamp = int(date_cur.strftime('%s'))
+            received, sent = counts.get(date_cur, (0, 0))
             data['received'].append((timestamp, received))
             data['sent'].append((timestamp, sent))
             data['received_total'] += received
             data['sent_total'] += sent
             date_cur += date_step
 
-        while date_cur <= date_end:
-            timestamp = int(date_cur.strftime('%s'))
-            data['received'].append((timestamp, 0))
-            data['sent'].append((timestamp, 0))
-            date_cur += date_step
-
         return data
 
     def get_period_random(self, period):
@@ -226,7 +319,7 @@ class ServerBandwidth(object):
 
     def write_periods_random(self):
         data = {}
-        for period in ('1m', '5m', '30m', '2h', '1d'):
+        for period in PERIODS:
             data[period] = self.get_period_random(period)
 
         path = os.path.join(settings.conf.temp_path, 'demo_bandwidth')
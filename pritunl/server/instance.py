@@ -13,6 +13,7 @@ from pritunl import event
 from pritunl import messenger
 from pritunl import organization
 from pritunl import ipaddress
+from pritunl import iptables
 
 import os
 import signal
@@ -39,6 +40,7 @@ class ServerInstance(object):
         self.primary_user = None
         self.process = None
         self.auth_log_process = None
+        self.instance_com = None
         self.iptables_rules = []
         self.ip6tables_rules = []
         self.iptables_lock = threading.Lock()
@@ -714,50 +716,6 @@ class ServerInstance(object):
 
         return rules, rules6
 
-    def exists_iptables_rule(self, rule):
-        process = subprocess.Popen(
-            ['iptables', '-C'] + rule,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-
-        if process.wait():
-            return False
-        return True
-
-    def exists_ip6tables_rule(self, rule):
-        process = subprocess.Popen(
-            ['ip6tables', '-C'] + rule,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-
-        if process.wait():
-            return False
-        return True
-
-    def remove_iptables_rule(self, rule):
-        process = subprocess.Popen(
-            ['iptables', '-D'] + rule,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            )
-
-        if process.wait():
-            return False
-        return True
-
-    def remove_ip6tables_rule(self, rule):
-        process = subprocess.Popen(
-            ['ip6tables', '-D'] + rule,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            )
-
-        if process.wait():
-            return False
-        return True
-
     def set_iptables_rule(self, rule):
         for i in xrange(3):
             try:
@@ -819,10 +777,8 @@ class ServerInstance(object):
         try:
             if self.iptables_rules is None:
                 return
-            for rule in rules:
-                if not self.exists_iptables_rule(rule):
-                    self.set_iptables_rule(rule)
-                self.iptables_rules.append(rule)
+            iptables.insert_rules(iptables.missing_rules(rules))
+            self.iptables_rules.extend(rules)
         finally:
             self.iptables_lock.release()
 
@@ -836,7 +792,7 @@ class ServerInstance(object):
                     self.iptables_rules.remove(rule)
                 except ValueError:
                     pass
-                self.remove_iptables_rule(rule)
+            iptables.delete_rules(rules)
         finally:
             self.iptables_lock.release()
 
@@ -845,10 +801,9 @@ class ServerInstance(object):
         try:
             if self.ip6tables_rules is None:
                 return
-            for rule in rules:
-                if not self.exists_ip6tables_rule(rule):
-                    self.set_ip6tables_rule(rule)
-                self.ip6tables_rules.append(rule)
+            iptables.insert_rules(iptables.missing_rules(rules, ipv6=True),
+                ipv6=True)
+            self.ip6tables_rules.extend(rules)
         finally:
             self.iptables_lock.release()
 
@@ -862,7 +817,7 @@ class ServerInstance(object):
                     self.ip6tables_rules.remove(rule)
                 except ValueError:
                     pass
-                self.remove_ip6tables_rule(rule)
+            iptables.delete_rules(rules, ipv6=True)
         finally:
             self.iptables_lock.release()
 
@@ -874,28 +829,29 @@ class ServerInstance(object):
         self.iptables_lock.acquire()
         try:
             if self.iptables_rules is not None:
-                for rule in self.iptables_rules:
-                    if not self.exists_iptables_rule(rule):
-                        if log and not self.interrupt:
-                            logger.error(
-                                'Unexpected loss of iptables rule, ' +
-                                    'adding again...',
-                                'instance',
-                                rule=rule,
-                            )
-                        self.set_iptables_rule(rule)
+                rules = iptables.missing_rules(self.iptables_rules)
+                if log and not self.interrupt:
+                    for rule in rules:
+                        logger.error(
+                            'Unexpected loss of iptables rule, ' +
+                                'adding again...',
+                            'instance',
+                            rule=rule,
+                        )
+                iptables.insert_rules(rules)
 
             if self.ip6tables_rules is not None:
-                for rule in self.ip6tables_rules:
-                    if not self.exists_ip6tables_rule(rule):
-                        if log and not self.interrupt:
-                            logger.error(
-                                'Unexpected loss of ip6tables rule, ' +
-                                    'adding again...',
-                                'instance',
-                                rule=rule,
-                            )
-                        self.set_ip6tables_rule(rule)
+                rules = iptables.missing_rules(self.ip6tables_rules,
+                    ipv6=True)
+                if log and not self.interrupt:
+                    for rule in rules:
+                        logger.error(
+                            'Unexpected loss of ip6tables rule, ' +
+                                'adding again...',
+                            'instance',
+                            rule=rule,
+                        )
+                iptables.insert_rules(rules, ipv6=True)
         except subprocess.CalledProcessError as error:
             logger.exception('Failed to apply iptables ' + \
                 'routing rule', 'server',
@@ -914,12 +870,10 @@ class ServerInstance(object):
         self.iptables_lock.acquire()
         try:
             if self.iptables_rules is not None:
-                for rule in self.iptables_rules:
-                    self.remove_iptables_rule(rule)
+                iptables.delete_rules(self.iptables_rules)
 
             if self.ip6tables_rules is not None:
-                for rule in self.ip6tables_rules:
-                    self.remove_ip6tables_rule(rule)
+                iptables.delete_rules(self.ip6tables_rules, ipv6=True)
         finally:
             self.iptables_rules = None
             self.ip6tables_rules = None
@@ -1009,6 +963,9 @@ class ServerInstance(object):
                         for _ in xrange(10):
                             self.process.send_signal(signal.SIGKILL)
                             time.sleep(0.01)
+                    elif message == 'routes_updated':
+                        if self.instance_com:
+                            self.instance_com.clients.clear_client_conf()
                 except OSError:
                     pass
         except:
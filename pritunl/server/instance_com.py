@@ -1,4 +1,5 @@
 from pritunl.server.listener import *
+from pritunl.server.management import ManagementSocket
 
 from pritunl.constants import *
 from pritunl.helpers import *
@@ -7,6 +8,8 @@ from pritunl import logger
 from pritunl import utils
 from pritunl import mongo
 from pritunl import clients
+from pritunl import callqueue
+from pritunl import authorizer
 from pritunl import ipaddress
 
 import os
@@ -23,7 +26,7 @@ class ServerInstanceCom(object):
         self.server = svr
         self.instance = instance
         self.sock = None
-        self.sock_lock = threading.Lock()
+        self.management = None
         self.socket_path = instance.management_socket_path
         self.bytes_lock = threading.Lock()
         self.bytes_recv = 0
@@ -33,17 +36,15 @@ class ServerInstanceCom(object):
         self.client_bytes = {}
         self.cur_timestamp = utils.now()
         self.bandwidth_rate = settings.vpn.bandwidth_update_rate
+        self.event_queue = callqueue.CallQueue(
+            self.instance.is_sock_interrupt)
 
     @cached_static_property
     def users_ip_collection(cls):
         return mongo.get_collection('users_ip')
 
     def sock_send(self, data):
-        self.sock_lock.acquire()
-        try:
-            self.sock.send(data)
-        finally:
-            self.sock_lock.release()
+        self.management.send(data)
 
     def client_kill(self, client_id):
         self.clients.disconnected(client_id)
@@ -73,18 +74,44 @@ class ServerInstanceCom(object):
         self.bytes_sent += bytes_sent - bytes_sent_prev
         self.bytes_lock.release()
 
+    def on_client_event(self, client):
+        cmd = client['cmd']
+        if cmd == 'connect':
+            self.clients.connect(client)
+        elif cmd == 'reauth':
+            self.clients.connect(client, reauth=True)
+        elif cmd == 'connected':
+            self.clients.connected(client.get('client_id'))
+        elif cmd == 'disconnected':
+            self.clients.disconnected(client.get('client_id'))
+
+    def queue_client_event(self, client):
+        # Client events are dispatched from the event queue so lines are
+        # never blocked by slow client events. Only new connects are
+        # denied when the event queue is over the limit.
+        if client['cmd'] == 'connect' and \
+                self.event_queue.qsize() >= MANAGEMENT_QUEUE_SIZE:
+            authorizer.add_rejected()
+            self.send_client_deny(client['client_id'], client['key_id'],
+                'Server is busy')
+            return
+        self.event_queue.put(self.on_client_event, client)
+
+    def on_line(self, line):
+        try:
+            self.parse_line(line)
+        except:
+            logger.exception('Failed to parse line from vpn com',
+                'server',
+                server_id=self.server.id,
+                instance_id=self.instance.id,
+                line=line,
+            )
+
     def parse_line(self, line):
         if self.client:
             if line == '>CLIENT:ENV,END':
-                cmd = self.client['cmd']
-                if cmd == 'connect':
-                    self.clients.connect(self.client)
-                elif cmd == 'reauth':
-                    self.clients.connect(self.client, reauth=True)
-                elif cmd == 'connected':
-                    self.clients.connected(self.client.get('client_id'))
-                elif cmd == 'disconnected':
-                    self.clients.disconnected(self.client.get('client_id'))
+                self.queue_client_event(self.client)
                 self.client = None
             elif line.startswith('>CLIENT:ENV'):
                 env_key, env_val = line[12:].split('=', 1)
@@ -240,32 +267,15 @@ class ServerInstanceCom(object):
 
             add_listener(self.instance.id, self.on_msg)
 
-            data = ''
-            while True:
-                data += self.sock.recv(SOCKET_BUFFER)
-                if not data or self.instance.sock_interrupt:
-                    if not self.instance.sock_interrupt and \
-                            not check_global_interrupt():
-                        self.instance.stop_process()
-                        self.push_output(
-                            'ERROR Management socket exited unexpectedly')
-                        logger.error('Management socket exited unexpectedly')
-                    return
-                lines = data.split('\n')
-                data = lines.pop()
-                for line in lines:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    try:
-                        self.parse_line(line)
-                    except:
-                        logger.exception('Failed to parse line from vpn com',
-                            'server',
-                            server_id=self.server.id,
-                            instance_id=self.instance.id,
-                            line=line,
-                        )
+            # Client events are handled on the event queue so slow client
+            # connects do not stall parsing, reads pause when it is full
+            if not self.management.run(self.instance.is_sock_interrupt):
+                if not self.instance.sock_interrupt and \
+                        not check_global_interrupt():
+                    self.instance.stop_process()
+                    self.push_output(
+                        'ERROR Management socket exited unexpectedly')
+                    logger.error('Management socket exited unexpectedly')
         except:
             if not self.instance.sock_interrupt:
                 self.push_output('ERROR Management socket exception')
@@ -278,6 +288,8 @@ class ServerInstanceCom(object):
             self.instance.stop_process()
         finally:
             remove_listener(self.instance.id)
+            if self.management:
+                self.management.close()
             self.clients.stop()
 
     def _stress_thread(self):
@@ -317,6 +329,7 @@ class ServerInstanceCom(object):
         self.wait_for_socket()
         self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         self.sock.connect(self.socket_path)
+        self.management = ManagementSocket(self.sock, self.on_line)
 
     def start(self):
         thread = threading.Thread(target=self._socket_thread)
@@ -331,6 +344,7 @@ class ServerInstanceCom(object):
         thread.daemon = True
         thread.start()
 
+        self.event_queue.start()
         self.clients.start()
 
         if settings.vpn.stress_test:
@@ -0,0 +1,149 @@
+from pritunl.constants import *
+from pritunl import mongo
+
+import threading
+import time
+import bson.int64
+import pymongo
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+class IpBitmap(object):
+    # Allocation bitmap for the address range of a server network, a set
+    # bit marks an address with an ip pool doc. Bits are only cleared by
+    # removing the bitmap with the ip pool docs.
+    def __init__(self, first, size, words=None):
+        self.first = first
+        self.size = size
+        self.lock = threading.Lock()
+        self.timestamp = time.time()
+        self._cursor = 0
+
+        if words:
+            self.words = words
+        else:
+            count = (size + IP_BITMAP_WORD - 1) // IP_BITMAP_WORD
+            self.words = [0] * count
+            padding = count * IP_BITMAP_WORD - size
+            if padding:
+                self.words[-1] = (IP_BITMAP_MASK << (
+                    IP_BITMAP_WORD - padding)) & IP_BITMAP_MASK
+
+    def get_index(self, addr):
+        index = int(addr) - self.first
+        if index < 0 or index >= self.size:
+            return None
+        return index
+
+    def get_addr(self, index):
+        return self.first + index
+
+    def set(self, index):
+        word_index = index // IP_BITMAP_WORD
+        self.words[word_index] |= 1 << (index % IP_BITMAP_WORD)
+
+    def take(self):
+        # Find and set the lowest free bit, words before the cursor are
+        # known to be full
+        words = self.words
+        count = len(words)
+        word_index = self._cursor
+
+        while word_index < count and words[word_index] == IP_BITMAP_MASK:
+            word_index += 1
+        self._cursor = word_index
+
+        if word_index >= count:
+            return None
+
+        word = words[word_index]
+        bit = (~word & (word + 1)).bit_length() - 1
+        words[word_index] = word | (1 << bit)
+
+        return word_index * IP_BITMAP_WORD + bit
+
+    def get_update(self, indexes):
+        masks = {}
+        for index in indexes:
+            word_index = index // IP_BITMAP_WORD
+            masks[word_index] = masks.get(word_index, 0) | (
+                1 << (index % IP_BITMAP_WORD))
+
+        return {'$bit': dict(
+            ('words.%d' % word_index, {'or': bson.int64.Int64(mask)})
+            for word_index, mask in masks.items()
+        )}
+
+def _load(server_id, network_hash, first, size):
+    collection = mongo.get_collection('servers_ip_bitmap')
+    spec = {
+        'server_id': server_id,
+        'network': network_hash,
+    }
+
+    doc = collection.find_one(spec)
+    if doc and doc.get('size') == size:
+        return IpBitmap(first, size, [int(x) for x in doc['words']])
+
+    # Build the bitmap from the existing ip pool docs
+    bitmap = IpBitmap(first, size)
+    cursor = mongo.get_collection('servers_ip_pool').find(spec, {
+        '_id': True,
+    })
+    for doc in cursor:
+        index = bitmap.get_index(doc['_id'])
+        if index is not None:
+            bitmap.set(index)
+
+    collection.update(spec, {'$set': {
+        'size': size,
+        'words': [bson.int64.Int64(x) for x in bitmap.words],
+    }}, upsert=True)
+
+    return bitmap
+
+def get_bitmap(server_id, network_hash, first, size):
+    key = (server_id, network_hash)
+
+    _cache_lock.acquire()
+    try:
+        bitmap = _cache.get(key)
+        if bitmap and bitmap.size == size and \
+                time.time() - bitmap.timestamp < IP_BITMAP_TTL:
+            return bitmap
+        bitmap = _load(server_id, network_hash, first, size)
+        _cache[key] = bitmap
+    finally:
+        _cache_lock.release()
+
+    return bitmap
+
+def reserve(server_id, network_hash, bitmap, indexes):
+    if not indexes:
+        return
+
+    try:
+        mongo.get_collection('servers_ip_bitmap').update({
+            'server_id': server_id,
+            'network': network_hash,
+        }, bitmap.get_update(indexes))
+    except pymongo.errors.OperationFailure:
+        clear_cache(server_id)
+        raise
+
+def clear_cache(server_id=None):
+    _cache_lock.acquire()
+    try:
+        if server_id is None:
+            _cache.clear()
+        else:
+            for key in _cache.keys():
+                if key[0] == server_id:
+                    _cache.pop(key, None)
+    finally:
+        _cache_lock.release()
+
+def remove_bitmaps(spec):
+    mongo.get_collection('servers_ip_bitmap').remove(spec)
+    clear_cache()
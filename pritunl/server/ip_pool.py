@@ -1,3 +1,5 @@
+from pritunl.server import ip_bitmap
+
 from pritunl.helpers import *
 from pritunl import mongo
 from pritunl import ipaddress
@@ -20,28 +22,36 @@ class ServerIpPool:
     def users_collection(cls):
         return mongo.get_collection('users')
 
-    def get_ip_pool(self, network, network_start):
-        ip_pool = network.iterhosts()
+    def get_ip_bitmap(self, network, network_start, network_end,
+            network_hash):
+        network = ipaddress.IPv4Network(network)
+        first = int(network.network) + 2
+        last = int(network.broadcast) - 1
 
         if network_start:
-            network_start = ipaddress.IPv4Address(network_start)
-            network_break = network_start - 1
+            first = int(ipaddress.IPv4Address(network_start))
+        if network_end:
+            last = min(last, int(ipaddress.IPv4Address(network_end)))
 
-            while True:
-                try:
-                    ip_addr = ip_pool.next()
-                except StopIteration:
-                    logger.error('Failed to find network start', 'server',
-                        server_id=self.server.id,
-                    )
-                    return
-
-                if ip_addr == network_break:
-                    break
-        else:
-            ip_pool.next()
+        if first <= int(network.network) or first > last:
+            logger.error('Failed to find network start', 'server',
+                server_id=self.server.id,
+            )
+            return network, None
 
-        return ip_pool
+        return network, ip_bitmap.get_bitmap(self.server.id, network_hash,
+            first, last - first + 1)
+
+    def take_ip_addr(self, bitmap):
+        bitmap.lock.acquire()
+        try:
+            index = bitmap.take()
+        finally:
+            bitmap.lock.release()
+
+        if index is None:
+            return None, None
+        return index, ipaddress.IPv4Address(bitmap.get_addr(index))
 
     def assign_ip_addr(self, org_id, user_id):
         network_hash = self.server.network_hash
@@ -58,52 +68,37 @@ class ServerIpPool:
         if response['updatedExisting']:
             return
 
-        network = ipaddress.IPv4Network(self.server.network)
-        if self.server.network_start:
-            network_start = ipaddress.IPv4Address(self.server.network_start)
-        else:
-            network_start = None
-        if self.server.network_end:
-            network_end = ipaddress.IPv4Address(self.server.network_end)
-        else:
-            network_end = None
-
-        ip_pool = self.get_ip_pool(network, network_start)
-        if not ip_pool:
+        network, bitmap = self.get_ip_bitmap(self.server.network,
+            self.server.network_start, self.server.network_end,
+            network_hash)
+        if not bitmap:
             return
 
+        # Addresses taken by another host since the bitmap was loaded are
+        # reserved with the assigned address
+        indexes = []
         try:
-            doc = self.collection.find({
-                'network': network_hash,
-                'server_id': server_id,
-            }).sort('_id', pymongo.DESCENDING)[0]
-            if doc:
-                last_addr = doc['_id']
-                for remote_ip_addr in ip_pool:
-                    if int(remote_ip_addr) == last_addr:
-                        break
-        except IndexError:
-            pass
-
-        for remote_ip_addr in ip_pool:
-            if network_end and remote_ip_addr > network_end:
-                break
-
-            try:
-                self.collection.insert({
-                    '_id': int(remote_ip_addr),
-                    'network': network_hash,
-                    'server_id': server_id,
-                    'org_id': org_id,
-                    'user_id': user_id,
-                    'address': '%s/%s' % (remote_ip_addr,
-                        network.prefixlen),
-                })
-                return True
-            except pymongo.errors.DuplicateKeyError:
-                pass
+            while True:
+                index, remote_ip_addr = self.take_ip_addr(bitmap)
+                if index is None:
+                    return False
+                indexes.append(index)
 
-        return False
+                try:
+                    self.collection.insert({
+                        '_id': int(remote_ip_addr),
+                        'network': network_hash,
+                        'server_id': server_id,
+                        'org_id': org_id,
+                        'user_id': user_id,
+                        'address': '%s/%s' % (remote_ip_addr,
+                            network.prefixlen),
+                    })
+                    return True
+                except pymongo.errors.DuplicateKeyError:
+                    pass
+        finally:
+            ip_bitmap.reserve(server_id, network_hash, bitmap, indexes)
 
     def unassign_ip_addr(self, org_id, user_id):
         self.collection.update({
@@ -123,34 +118,12 @@ class ServerIpPool:
         ip_pool_avial = True
         pool_end = False
 
-        network = ipaddress.IPv4Network(self.server.network)
-        network_start = self.server.network_start
-        network_end = self.server.network_end
-        if network_start:
-            network_start = ipaddress.IPv4Address(network_start)
-        if network_end:
-            network_end = ipaddress.IPv4Address(network_end)
-
-        ip_pool = self.get_ip_pool(network, network_start)
-        if not ip_pool:
+        network, bitmap = self.get_ip_bitmap(self.server.network,
+            self.server.network_start, self.server.network_end,
+            network_hash)
+        if not bitmap:
             return
 
-        try:
-            doc = self.collection.find({
-                'network': network_hash,
-                'server_id': server_id,
-            }).sort('_id', pymongo.DESCENDING)[0]
-            if doc:
-                last_addr = doc['_id']
-
-                for remote_ip_addr in ip_pool:
-                    if int(remote_ip_addr) == last_addr:
-                        break
-                    if network_end and remote_ip_addr > network_end:
-                        break
-        except IndexError:
-            pass
-
         if mongo.has_bulk:
             bulk = self.collection.initialize_unordered_bulk_op()
             bulk_empty = True
@@ -158,6 +131,7 @@ class ServerIpPool:
             bulk = None
             bulk_empty = None
 
+        indexes = []
         for user in org.iter_users(include_pool=True):
             if ip_pool_avial:
                 response = self.collection.update({
@@ -172,13 +146,11 @@ class ServerIpPool:
                     continue
                 ip_pool_avial = False
 
-            try:
-                remote_ip_addr = ip_pool.next()
-                if network_end and remote_ip_addr > network_end:
-                    raise StopIteration()
-            except StopIteration:
+            index, remote_ip_addr = self.take_ip_addr(bitmap)
+            if index is None:
                 pool_end = True
                 break
+            indexes.append(index)
             doc_id = int(remote_ip_addr)
 
             spec = {
@@ -201,6 +173,7 @@ class ServerIpPool:
 
         if bulk and not bulk_empty:
             bulk.execute()
+        ip_bitmap.reserve(server_id, network_hash, bitmap, indexes)
 
         if pool_end:
             logger.warning('Failed to assign ip addresses ' +
@@ -223,14 +196,9 @@ class ServerIpPool:
         server_id = self.server.id
         pool_end = False
 
-        network = ipaddress.IPv4Network(network)
-        if network_start:
-            network_start = ipaddress.IPv4Address(network_start)
-        if network_end:
-            network_end = ipaddress.IPv4Address(network_end)
-
-        ip_pool = self.get_ip_pool(network, network_start)
-        if not ip_pool:
+        network, bitmap = self.get_ip_bitmap(network, network_start,
+            network_end, network_hash)
+        if not bitmap:
             return
 
         if mongo.has_bulk:
@@ -240,17 +208,16 @@ class ServerIpPool:
             bulk = None
             bulk_empty = None
 
+        indexes = []
         for org in self.server.iter_orgs():
             org_id = org.id
 
             for user in org.iter_users(include_pool=True):
-                try:
-                    remote_ip_addr = ip_pool.next()
-                    if network_end and remote_ip_addr > network_end:
-                        raise StopIteration()
-                except StopIteration:
+                index, remote_ip_addr = self.take_ip_addr(bitmap)
+                if index is None:
                     pool_end = True
                     break
+                indexes.append(index)
                 doc_id = int(remote_ip_addr)
 
                 spec = {
@@ -281,6 +248,7 @@ class ServerIpPool:
 
         if bulk and not bulk_empty:
             bulk.execute()
+        ip_bitmap.reserve(server_id, network_hash, bitmap, indexes)
 
     def sync_ip_pool(self):
         server_id = self.server.id
@@ -298,6 +266,7 @@ class ServerIpPool:
             bulk.find(spec).remove()
         else:
             self.collection.remove(spec)
+        ip_bitmap.remove_bitmaps(spec)
 
         dup_user_ips = self.collection.aggregate([
             {'$match': {
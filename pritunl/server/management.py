@@ -0,0 +1,131 @@
+from pritunl.constants import *
+
+import os
+import errno
+import select
+import socket
+import threading
+
+class ManagementSocket(object):
+    # Non blocking management interface connection. Lines are parsed as
+    # data arrives and sends from other threads are queued and coalesced
+    # into one write when the socket is writable.
+    def __init__(self, sock, on_line):
+        self.sock = sock
+        self.sock.setblocking(0)
+        self.lines = 0
+        self.reads = 0
+        self.writes = 0
+        self._on_line = on_line
+        self._read_data = ''
+        self._send_data = ''
+        self._send_queue = []
+        self._send_lock = threading.Lock()
+        self._closed = False
+        self._wake_read, self._wake_write = os.pipe()
+
+    def send(self, data):
+        self._send_lock.acquire()
+        try:
+            if self._closed:
+                raise socket.error(errno.EPIPE, 'Management socket closed')
+            wake = not self._send_queue
+            self._send_queue.append(data)
+        finally:
+            self._send_lock.release()
+
+        if wake:
+            try:
+                os.write(self._wake_write, '\0')
+            except OSError:
+                pass
+
+    def feed(self, data):
+        lines = (self._read_data + data).split('\n')
+        self._read_data = lines.pop()
+
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            self.lines += 1
+            self._on_line(line)
+
+    def _take_sends(self):
+        self._send_lock.acquire()
+        try:
+            if self._send_queue:
+                self._send_data += ''.join(self._send_queue)
+                self._send_queue = []
+        finally:
+            self._send_lock.release()
+
+    def _write(self):
+        try:
+            sent = self.sock.send(self._send_data)
+        except socket.error, error:
+            if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        self.writes += 1
+        self._send_data = self._send_data[sent:]
+
+    def _read(self):
+        try:
+            data = self.sock.recv(MANAGEMENT_BUFFER)
+        except socket.error, error:
+            if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return True
+            raise
+        if not data:
+            return False
+        self.reads += 1
+        self.feed(data)
+        return True
+
+    def run(self, check_interrupt):
+        # Returns false if the socket was closed by the vpn process
+        while not check_interrupt():
+            self._take_sends()
+
+            read_list = [self._wake_read, self.sock]
+            write_list = [self.sock] if self._send_data else []
+
+            try:
+                readable, writable, _ = select.select(
+                    read_list, write_list, [], 1)
+            except select.error, error:
+                if error.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            if self._wake_read in readable:
+                os.read(self._wake_read, SOCKET_BUFFER)
+
+            if writable:
+                self._write()
+
+            if self.sock in readable and not self._read():
+                return False
+
+        return True
+
+    def close(self):
+        self._send_lock.acquire()
+        try:
+            if self._closed:
+                return
+            self._closed = True
+        finally:
+            self._send_lock.release()
+
+        for fd in (self._wake_read, self._wake_write):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+        try:
+            self.sock.close()
+        except socket.error:
+            pass
@@ -4,10 +4,144 @@ from pritunl import settings
 from pritunl import mongo
 from pritunl import event
 from pritunl import utils
+from pritunl import logger
 
 import pymongo
+import collections
+import threading
+import time
+
+_output_lock = threading.Lock()
+_output_buffers = {}
+
+class _OutputBuffer(object):
+    def __init__(self):
+        self.docs = collections.deque(maxlen=settings.vpn.log_lines)
+        self.event_ids = set()
+        self.prune_time = 0
+
+def _match_server_id(doc, server_id):
+    doc_server_id = doc['server_id']
+    if isinstance(doc_server_id, list):
+        return server_id in doc_server_id
+    return doc_server_id == server_id
+
+def _get_pending(output_cls, server_id):
+    docs = []
+
+    _output_lock.acquire()
+    try:
+        for (buffer_cls, _), output_buffer in _output_buffers.items():
+            if buffer_cls is not output_cls:
+                continue
+            for doc in output_buffer.docs:
+                if _match_server_id(doc, server_id):
+                    docs.append(doc)
+    finally:
+        _output_lock.release()
+
+    return docs
+
+def _clear_pending(output_cls, server_id):
+    _output_lock.acquire()
+    try:
+        for (buffer_cls, _), output_buffer in _output_buffers.items():
+            if buffer_cls is not output_cls:
+                continue
+            docs = [x for x in output_buffer.docs
+                if not _match_server_id(x, server_id)]
+            output_buffer.docs.clear()
+            output_buffer.docs.extend(docs)
+    finally:
+        _output_lock.release()
+
+def _restore_output(flush, failed):
+    # Put lines from failed inserts back in front of lines pushed since
+    # the flush, the newest lines are kept if the buffer is full
+    _output_lock.acquire()
+    try:
+        for key, docs, event_ids, _ in flush:
+            if key[0] not in failed:
+                continue
+
+            output_buffer = _output_buffers.get(key)
+            if not output_buffer:
+                output_buffer = _OutputBuffer()
+                _output_buffers[key] = output_buffer
+
+            cur_docs = list(output_buffer.docs)
+            output_buffer.docs.clear()
+            output_buffer.docs.extend(docs + cur_docs)
+            output_buffer.event_ids |= event_ids
+    finally:
+        _output_lock.release()
+
+def flush_output():
+    # Lines pushed since the last flush are written with one insert per
+    # collection, each server is then pruned at most once per prune rate
+    flush = []
+    cur_time = time.time()
+
+    _output_lock.acquire()
+    try:
+        for key, output_buffer in _output_buffers.items():
+            if not output_buffer.docs:
+                _output_buffers.pop(key)
+                continue
+
+            prune = cur_time - output_buffer.prune_time >= OUTPUT_PRUNE_RATE
+            if prune:
+                output_buffer.prune_time = cur_time
+
+            flush.append((key, list(output_buffer.docs),
+                output_buffer.event_ids, prune))
+            output_buffer.docs.clear()
+            output_buffer.event_ids = set()
+    finally:
+        _output_lock.release()
+
+    if not flush:
+        return 0
+
+    cls_docs = collections.defaultdict(list)
+    for (output_cls, _), docs, _, _ in flush:
+        cls_docs[output_cls].extend(docs)
+
+    failed = set()
+    for output_cls, docs in cls_docs.items():
+        docs.sort(key=lambda x: x['timestamp'])
+        try:
+            output_cls.collection.insert(docs, manipulate=False)
+        except:
+            failed.add(output_cls)
+            logger.exception('Failed to write server output', 'server')
+
+    if failed:
+        _restore_output(flush, failed)
+
+    count = 0
+    for (output_cls, server_id), docs, event_ids, prune in flush:
+        if output_cls in failed:
+            continue
+        count += len(docs)
+
+        if prune:
+            try:
+                output_cls(server_id).prune_output()
+            except:
+                logger.exception('Failed to prune server output', 'server',
+                    server_id=server_id,
+                )
+
+        for event_id in event_ids:
+            event.Event(type=output_cls.event_type, resource_id=event_id,
+                delay=OUTPUT_DELAY)
+
+    return count
 
 class ServerOutput(object):
+    event_type = SERVER_OUTPUT_UPDATED
+
     def __init__(self, server_id):
         self.server_id = server_id
 
@@ -20,55 +154,54 @@ class ServerOutput(object):
             delay=OUTPUT_DELAY)
 
     def clear_output(self):
+        _clear_pending(type(self), self.server_id)
         self.collection.remove({
             'server_id': self.server_id,
         })
         self.send_event()
 
     def prune_output(self):
-        response = self.collection.aggregate([
-            {'$match': {
-                'server_id': self.server_id,
-            }},
-            {'$project': {
-                '_id': True,
-                'timestamp': True,
-            }},
-            {'$sort': {
-                'timestamp': pymongo.DESCENDING,
-            }},
-            {'$skip': settings.vpn.log_lines},
-            {'$group': {
-                '_id': None,
-                'doc_ids': {'$push': '$_id'},
-            }},
-        ])
-
-        val = None
-        for val in response:
-            break
-
-        if val:
-            doc_ids = val['doc_ids']
+        # Find the timestamp of the oldest line to keep from the server
+        # timestamp index and remove everything before it
+        response = self.collection.find({
+            'server_id': self.server_id,
+        }, {
+            '_id': False,
+            'timestamp': True,
+        }).sort('timestamp', pymongo.DESCENDING).skip(
+            settings.vpn.log_lines).limit(1)
 
+        for doc in response:
             self.collection.remove({
-                '_id': {'$in': doc_ids},
+                'server_id': self.server_id,
+                'timestamp': {'$lte': doc['timestamp']},
             })
 
+    def buffer_output(self, doc, event_ids):
+        key = (type(self), self.server_id)
+
+        _output_lock.acquire()
+        try:
+            output_buffer = _output_buffers.get(key)
+            if not output_buffer:
+                output_buffer = _OutputBuffer()
+                _output_buffers[key] = output_buffer
+            output_buffer.docs.append(doc)
+            output_buffer.event_ids.update(event_ids)
+        finally:
+            _output_lock.release()
+
     def push_output(self, output, label=None):
         if '--keepalive' in output:
             return
 
         label = label or settings.local.host.name
 
-        self.collection.insert({
+        self.buffer_output({
             'server_id': self.server_id,
             'timestamp': utils.now(),
             'output': '[%s] %s' % (label, output.rstrip('\n')),
-        })
-
-        self.prune_output()
-        self.send_event()
+        }, (self.server_id,))
 
     def push_message(self, message, *args, **kwargs):
         timestamp = datetime.datetime.now().strftime(
@@ -80,31 +213,25 @@ class ServerOutput(object):
         if settings.app.demo_mode:
             return DEMO_OUTPUT
 
-        response = self.collection.aggregate([
-            {'$match': {
-                'server_id': self.server_id,
-            }},
-            {'$project': {
-                '_id': False,
-                'timestamp': True,
-                'output': True,
-            }},
-            {'$sort': {
-                'timestamp': pymongo.ASCENDING,
-            }},
-            {'$group': {
-                '_id': None,
-                'output': {'$push': '$output'},
-            }},
-        ])
-
-        val = None
-        for val in response:
-            break
-
-        if val:
-            output = val['output']
-        else:
-            output = []
-
-        return output
+        log_lines = settings.vpn.log_lines
+
+        response = self.collection.find({
+            'server_id': self.server_id,
+        }, {
+            '_id': False,
+            'timestamp': True,
+            'output': True,
+        }).sort('timestamp', pymongo.DESCENDING).limit(log_lines)
+
+        docs = list(response)
+        docs.reverse()
+
+        # Lines from this host that have not been flushed yet are served
+        # from the local buffer
+        pending = _get_pending(type(self), self.server_id)
+        if pending:
+            docs += pending
+            docs.sort(key=lambda x: x['timestamp'])
+            docs = docs[-log_lines:]
+
+        return [x['output'] for x in docs]
@@ -1,4 +1,4 @@
-from pritunl.server.output import ServerOutput
+from pritunl.server.output import ServerOutput, _clear_pending
 
 from pritunl.constants import *
 from pritunl.helpers import *
@@ -7,6 +7,8 @@ from pritunl import event
 from pritunl import utils
 
 class ServerOutputLink(ServerOutput):
+    event_type = SERVER_LINK_OUTPUT_UPDATED
+
     @cached_static_property
     def collection(cls):
         return mongo.get_collection('servers_output_link')
@@ -20,6 +22,7 @@ class ServerOutputLink(ServerOutput):
                     resource_id=link_server_id, delay=OUTPUT_DELAY)
 
     def clear_output(self, link_server_ids):
+        _clear_pending(type(self), self.server_id)
         self.collection.remove({
             'server_id': self.server_id,
         })
@@ -31,11 +34,8 @@ class ServerOutputLink(ServerOutput):
         else:
             server_ids = [self.server_id]
 
-        self.collection.insert({
+        self.buffer_output({
             'server_id': server_ids,
             'timestamp': utils.now(),
             'output': '[%s] %s' % (label, output.rstrip('\n')),
-        })
-
-        self.prune_output()
-        self.send_event((link_server_id,))
+        }, server_ids)
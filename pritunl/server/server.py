@@ -825,6 +825,10 @@ class Server(mongo.MongoObject):
             server_id=self.id,
         )
 
+        from pritunl.user import search
+        search.remove_users({
+            'resource_id': self.id,
+        })
         self.user_collection.remove({
             'resource_id': self.id,
         })
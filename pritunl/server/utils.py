@@ -9,6 +9,8 @@ from pritunl import transaction
 from pritunl import mongo
 from pritunl import ipaddress
 from pritunl import settings
+from pritunl import messenger
+from pritunl import utils
 
 import math
 
@@ -70,7 +72,7 @@ def get_used_resources(ignore_server_id):
         'ports': set(used_resources['ports']),
     }
 
-def iter_servers(spec=None, fields=None, page=None):
+def iter_servers(spec=None, fields=None, page=None, keyset=None):
     limit = None
     skip = None
     page_count = settings.app.server_page_count
@@ -81,6 +83,11 @@ def iter_servers(spec=None, fields=None, page=None):
     if fields:
         fields = {key: True for key in fields}
 
+    if keyset:
+        for doc in keyset.find(Server.collection, spec, fields):
+            yield Server(doc=doc, fields=fields)
+        return
+
     if page is not None:
         limit = page_count
         skip = page * page_count if page else 0
@@ -95,18 +102,14 @@ def iter_servers(spec=None, fields=None, page=None):
     for doc in cursor:
         yield Server(doc=doc, fields=fields)
 
-def iter_servers_dict(page=None):
+def iter_servers_dict(page=None, keyset=None):
     fields = {key: True for key in dict_fields}
 
-    for svr in iter_servers(fields=fields, page=page):
+    for svr in iter_servers(fields=fields, page=page, keyset=keyset):
         yield svr.dict()
 
 def get_server_page_total():
-    org_collection = mongo.get_collection('servers')
-
-    count = org_collection.find({}, {
-        '_id': True,
-    }).count()
+    count = utils.get_count('servers', Server.collection, {})
 
     return int(math.floor(max(0, float(count - 1)) /
         settings.app.server_page_count))
@@ -128,6 +131,14 @@ def output_link_clear(server_id):
 def bandwidth_get(server_id, period):
     return ServerBandwidth(server_id).get_period(period)
 
+def routes_updated(server_ids):
+    # Running instances cache pushed routes of the server and linked
+    # servers, notify instances to rebuild the client confs
+    for server_id in server_ids:
+        messenger.publish('servers', 'routes_updated', extra={
+            'server_id': server_id,
+        })
+
 def link_servers(server_id, link_server_id, use_local_address=False):
     if server_id == link_server_id:
         raise TypeError('Server id must be different then link server id')
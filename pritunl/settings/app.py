@@ -28,6 +28,7 @@ class SettingsApp(SettingsGroupMongo):
         'log_db_delay': 1,
         'log_web_errors': False,
         'rate_limit_sleep': 0.5,
+        'publish_buffer_window': 0.25,
         'short_url_length': 8,
         'license': None,
         'license_plan': None,
@@ -35,12 +36,15 @@ class SettingsApp(SettingsGroupMongo):
         'request_queue_size': 128,
         'static_cache_time': 43200,
         'auth_time_window': 300,
+        'auth_nonce_async': False,
+        'auth_nonce_sync_rate': 1,
         'auth_limiter_ttl': 60,
         'auth_limiter_count_max': 30,
         'org_pool_size': 1,
         'user_pool_size': 6,
         'server_pool_size': 4,
         'server_user_pool_size': 2,
+        'user_pool_batch': 16,
         'dh_param_bits_pool': [1536],
         'cookie_secret': None,
         'email_server': None,
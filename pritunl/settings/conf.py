@@ -18,6 +18,7 @@ class SettingsConf(SettingsGroupFile):
         'var_run_path': '/var/run',
         'uuid_path': '/var/lib/pritunl/pritunl.uuid',
         'setup_key_path': '/var/lib/pritunl/setup_key',
+        'audit_spill_path': '/var/lib/pritunl/audit_spill',
         'bind_addr': '0.0.0.0',
         'mongodb_uri': 'mongodb://localhost:27017/pritunl',
         'mongodb_collection_prefix': None,
@@ -4,6 +4,10 @@ class SettingsVpn(SettingsGroupMongo):
     group = 'vpn'
     fields = {
         'client_ttl': 300,
+        'client_ping_batch': 30,
+        'auth_workers': 10,
+        'auth_push_workers': 32,
+        'auth_queue_size': 512,
         'peer_limit': 300,
         'peer_limit_timeout': 10,
         'default_dh_param_bits': 1536,
@@ -72,6 +72,7 @@ def setup_mongo():
         'transaction': getattr(database, prefix + 'transaction'),
         'queue': getattr(database, prefix + 'queue'),
         'task': getattr(database, prefix + 'task'),
+        'task_lease': getattr(database, prefix + 'task_lease'),
         'settings': getattr(database, prefix + 'settings'),
         'messages': getattr(database, prefix + 'messages'),
         'administrators': getattr(database, prefix + 'administrators'),
@@ -89,6 +90,8 @@ def setup_mongo():
             prefix + 'servers_output_link'),
         'servers_bandwidth': getattr(database, prefix + 'servers_bandwidth'),
         'servers_ip_pool': getattr(database, prefix + 'servers_ip_pool'),
+        'servers_ip_bitmap': getattr(database,
+            prefix + 'servers_ip_bitmap'),
         'routes_reserve': getattr(database, prefix + 'routes_reserve'),
         'dh_params': getattr(database, prefix + 'dh_params'),
         'auth_sessions': getattr(database, prefix + 'auth_sessions'),
@@ -159,6 +162,12 @@ def setup_mongo():
         ('org_id', pymongo.ASCENDING),
         ('name', pymongo.ASCENDING),
     ], background=True)
+    upsert_index(mongo.collections['users'], [
+        ('org_id', pymongo.ASCENDING),
+        ('type', pymongo.ASCENDING),
+        ('name', pymongo.ASCENDING),
+        ('_id', pymongo.ASCENDING),
+    ], background=True)
     upsert_index(mongo.collections['users_audit'], [
         ('org_id', pymongo.ASCENDING),
         ('user_id', pymongo.ASCENDING),
@@ -189,11 +198,19 @@ def setup_mongo():
     upsert_index(mongo.collections['organizations'],
         'auth_token', background=True)
     upsert_index(mongo.collections['hosts'], 'name', background=True)
+    upsert_index(mongo.collections['hosts'], [
+        ('name', pymongo.ASCENDING),
+        ('_id', pymongo.ASCENDING),
+    ], background=True)
     upsert_index(mongo.collections['hosts_usage'], [
         ('host_id', pymongo.ASCENDING),
         ('timestamp', pymongo.ASCENDING),
     ], background=True)
     upsert_index(mongo.collections['servers'], 'name', background=True)
+    upsert_index(mongo.collections['servers'], [
+        ('name', pymongo.ASCENDING),
+        ('_id', pymongo.ASCENDING),
+    ], background=True)
     upsert_index(mongo.collections['servers'], 'ping_timestamp',
         background=True)
     upsert_index(mongo.collections['servers_output'], [
@@ -209,12 +226,20 @@ def setup_mongo():
         ('period', pymongo.ASCENDING),
         ('timestamp', pymongo.ASCENDING),
     ], background=True)
+    upsert_index(mongo.collections['servers_bandwidth'], [
+        ('period', pymongo.ASCENDING),
+        ('timestamp', pymongo.ASCENDING),
+    ], background=True)
     upsert_index(mongo.collections['servers_ip_pool'], [
         ('server_id', pymongo.ASCENDING),
         ('user_id', pymongo.ASCENDING),
     ], background=True)
     upsert_index(mongo.collections['servers_ip_pool'], 'user_id',
         background=True)
+    upsert_index(mongo.collections['servers_ip_bitmap'], [
+        ('server_id', pymongo.ASCENDING),
+        ('network', pymongo.ASCENDING),
+    ], background=True, unique=True)
     upsert_index(mongo.collections['routes_reserve'], 'timestamp',
         background=True)
     upsert_index(mongo.collections['dh_params'], 'dh_param_bits',
@@ -240,6 +265,8 @@ def setup_mongo():
         expireAfterSeconds=settings.user.otp_cache_ttl)
     upsert_index(mongo.collections['sso_tokens'], 'timestamp', background=True,
         expireAfterSeconds=600)
+    upsert_index(mongo.collections['task_lease'], 'timestamp',
+        background=True, expireAfterSeconds=TASK_LEASE_TTL)
 
     if not auth.Administrator.collection.find_one():
         auth.Administrator(
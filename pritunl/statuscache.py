@@ -0,0 +1,235 @@
+from pritunl.constants import *
+from pritunl import mongo
+from pritunl import messenger
+
+import threading
+import time
+import collections
+
+# Cluster status served by the status handler. Online users are tracked
+# from client connect and disconnect messages, server and host counts are
+# refreshed after update events and everything is reconciled with the
+# database every reconcile rate.
+_lock = threading.Lock()
+_snapshot = None
+_online_clients = {}
+_online_users = collections.Counter()
+_reconcile_time = 0
+_update_time = None
+_dirty = False
+
+def _get_servers():
+    response = mongo.get_collection('servers').aggregate([
+        {'$project': {
+            '_id': True,
+            'status': True,
+        }},
+        {'$group': {
+            '_id': None,
+            'server_count': {'$sum': 1},
+            'servers_online': {'$sum': {'$cond': {
+                'if': {'$eq': ['$status', ONLINE]},
+                'then': 1,
+                'else': 0,
+            }}},
+        }},
+    ])
+
+    val = None
+    for val in response:
+        break
+
+    if val:
+        return {
+            'server_count': val['server_count'],
+            'servers_online': val['servers_online'],
+        }
+    return {
+        'server_count': 0,
+        'servers_online': 0,
+    }
+
+def _get_hosts():
+    response = mongo.get_collection('hosts').aggregate([
+        {'$project': {
+            '_id': True,
+            'status': True,
+            'local_networks': True,
+        }},
+        {'$group': {
+            '_id': None,
+            'host_count': {'$sum': 1},
+            'hosts_online': {'$sum': {'$cond': {
+                'if': {'$eq': ['$status', ONLINE]},
+                'then': 1,
+                'else': 0,
+            }}},
+            'local_networks': {'$push': '$local_networks'},
+        }},
+    ])
+
+    val = None
+    for val in response:
+        break
+
+    local_networks = set()
+    if val:
+        for hst_networks in val['local_networks']:
+            for network in hst_networks or []:
+                local_networks.add(network)
+
+        return {
+            'host_count': val['host_count'],
+            'hosts_online': val['hosts_online'],
+            'local_networks': list(local_networks),
+        }
+    return {
+        'host_count': 0,
+        'hosts_online': 0,
+        'local_networks': [],
+    }
+
+def _get_counts():
+    return {
+        'org_count': mongo.get_collection('organizations').find({
+            'type': ORG_DEFAULT,
+        }, {
+            '_id': True,
+        }).count(),
+        'user_count': mongo.get_collection('users').find({
+            'type': CERT_CLIENT,
+        }, {
+            '_id': True,
+        }).count(),
+    }
+
+def reconcile():
+    global _snapshot
+    global _reconcile_time
+    global _update_time
+    global _dirty
+    global _online_clients
+    global _online_users
+
+    online_clients = {}
+    online_users = collections.Counter()
+    for doc in mongo.get_collection('clients').find({
+                'type': CERT_CLIENT,
+            }, {
+                '_id': True,
+                'user_id': True,
+            }):
+        online_clients[doc['_id']] = doc['user_id']
+        online_users[doc['user_id']] += 1
+
+    snapshot = {}
+    snapshot.update(_get_servers())
+    snapshot.update(_get_hosts())
+    snapshot.update(_get_counts())
+
+    _lock.acquire()
+    try:
+        _online_clients = online_clients
+        _online_users = online_users
+        _snapshot = snapshot
+        _reconcile_time = time.time()
+        _update_time = _reconcile_time
+        _dirty = False
+    finally:
+        _lock.release()
+
+def refresh():
+    global _update_time
+    global _dirty
+
+    if time.time() - _reconcile_time >= STATUS_RECONCILE_RATE:
+        reconcile()
+        return
+
+    if not _dirty:
+        return
+    _dirty = False
+
+    snapshot = {}
+    snapshot.update(_get_servers())
+    snapshot.update(_get_hosts())
+
+    _lock.acquire()
+    try:
+        _snapshot.update(snapshot)
+        _update_time = time.time()
+    finally:
+        _lock.release()
+
+def _add_client(doc_id, user_id):
+    global _update_time
+
+    _lock.acquire()
+    try:
+        if doc_id in _online_clients:
+            return
+        _online_clients[doc_id] = user_id
+        _online_users[user_id] += 1
+        _update_time = time.time()
+    finally:
+        _lock.release()
+
+def _remove_client(doc_id):
+    global _update_time
+
+    _lock.acquire()
+    try:
+        user_id = _online_clients.pop(doc_id, None)
+        if user_id is None:
+            return
+        _online_users[user_id] -= 1
+        if _online_users[user_id] <= 0:
+            _online_users.pop(user_id, None)
+        _update_time = time.time()
+    finally:
+        _lock.release()
+
+def client_connected(doc_id, user_id, user_type):
+    if user_type != CERT_CLIENT:
+        return
+    _add_client(doc_id, user_id)
+    messenger.publish_buffered('status', ('connected', doc_id), extra={
+        'user_id': user_id,
+    })
+
+def client_disconnected(doc_id):
+    _remove_client(doc_id)
+    messenger.publish_buffered('status', ('disconnected', doc_id))
+
+def on_msg(msg):
+    action, doc_id = msg['message']
+    if action == 'connected':
+        _add_client(doc_id, msg['user_id'])
+    elif action == 'disconnected':
+        _remove_client(doc_id)
+
+def on_event_msg(msg):
+    global _dirty
+
+    try:
+        event_type = msg['message'][0]
+    except (TypeError, IndexError):
+        return
+
+    if event_type in (SERVERS_UPDATED, HOSTS_UPDATED):
+        _dirty = True
+
+def get_snapshot():
+    if _snapshot is None:
+        reconcile()
+
+    _lock.acquire()
+    try:
+        snapshot = _snapshot.copy()
+        snapshot['users_online'] = len(_online_users)
+        snapshot['status_timestamp'] = int(_update_time)
+        snapshot['status_reconcile_timestamp'] = int(_reconcile_time)
+    finally:
+        _lock.release()
+
+    return snapshot
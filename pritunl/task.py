@@ -6,11 +6,9 @@ from pritunl import utils
 
 import pymongo
 import datetime
-import collections
 
 _task_types = {}
-tasks = collections.defaultdict(
-    lambda: collections.defaultdict(lambda: collections.defaultdict(list)))
+schedules = []
 tasks_on_start = []
 
 class Task(mongo.MongoObject):
@@ -25,6 +23,7 @@ class Task(mongo.MongoObject):
         'ttl': settings.mongo.task_ttl,
     }
     type = None
+    lease = False
 
     def __init__(self, **kwargs):
         mongo.MongoObject.__init__(self, **kwargs)
@@ -35,6 +34,10 @@ class Task(mongo.MongoObject):
     def collection(cls):
         return mongo.get_collection('task')
 
+    @cached_static_property
+    def lease_collection(cls):
+        return mongo.get_collection('task_lease')
+
     def claim_commit(self, fields=None):
         doc = self.get_commit_doc(fields=fields)
 
@@ -85,21 +88,48 @@ def iter_tasks(spec=None):
     for doc in Task.collection.find(spec or {}):
         yield _task_types[doc['type']](doc=doc)
 
+def claim_lease(task_type, fire_time):
+    # Every host computes the same fire time for a scheduled run, the
+    # first host to insert the lease runs it
+    try:
+        Task.lease_collection.insert({
+            '_id': '%s-%s' % (task_type, fire_time.strftime('%Y%m%d%H%M%S')),
+            'host_id': settings.local.host_id,
+            'timestamp': utils.now(),
+        })
+    except pymongo.errors.DuplicateKeyError:
+        return False
+    return True
+
+def next_fire(schedule, after):
+    _, hours, minutes, seconds = schedule
+    after = after.replace(microsecond=0)
+    day = after.replace(hour=0, minute=0, second=0)
+
+    for days in (0, 1):
+        for hour in hours:
+            if not days and hour < after.hour:
+                continue
+            for minute in minutes:
+                if not days and hour == after.hour and minute < after.minute:
+                    continue
+                for second in seconds:
+                    fire_time = day + datetime.timedelta(days=days,
+                        hours=hour, minutes=minute, seconds=second)
+                    if fire_time > after:
+                        return fire_time
+
 def add_task(task_cls, hours=None, minutes=None, seconds=None,
         run_on_start=False):
     if run_on_start:
         tasks_on_start.append(task_cls)
 
     if hours is not None or minutes is not None or seconds is not None:
-        if hours is None:
-            hours = ('all',)
-        elif isinstance(hours, int):
-            hours = (hours,)
-
-        if hours != ('all',) and minutes is None:
-            minutes = (0,)
-        elif minutes is None:
-            minutes = ('all',)
+        if minutes is None:
+            if hours is None:
+                minutes = xrange(60)
+            else:
+                minutes = (0,)
         elif isinstance(minutes, int):
             minutes = (minutes,)
 
@@ -108,9 +138,16 @@ def add_task(task_cls, hours=None, minutes=None, seconds=None,
         elif isinstance(seconds, int):
             seconds = (seconds,)
 
-        for hour in hours:
-            for minute in minutes:
-                for second in seconds:
-                    tasks[hour][minute][second].append(task_cls)
+        if hours is None:
+            hours = xrange(24)
+        elif isinstance(hours, int):
+            hours = (hours,)
+
+        schedules.append((
+            task_cls,
+            sorted(set(hours)),
+            sorted(set(minutes)),
+            sorted(set(seconds)),
+        ))
 
     _task_types[task_cls.type] = task_cls
@@ -7,3 +7,4 @@ import pritunl.tasks.route
 import pritunl.tasks.sync_ip_pool
 import pritunl.tasks.server
 import pritunl.tasks.clean_servers
+import pritunl.tasks.clean_bandwidth
@@ -0,0 +1,12 @@
+from pritunl.helpers import *
+from pritunl import task
+from pritunl.server import bandwidth
+
+class TaskCleanBandwidth(task.Task):
+    type = 'clean_bandwidth'
+    lease = True
+
+    def task(self):
+        bandwidth.clean_bandwidth()
+
+task.add_task(TaskCleanBandwidth, minutes=41)
@@ -1,9 +1,11 @@
 from pritunl.helpers import *
 from pritunl import mongo
 from pritunl import task
+from pritunl.server import ip_bitmap
 
 class TaskCleanIpPool(task.Task):
     type = 'clean_ip_pool'
+    lease = True
 
     @cached_static_property
     def pool_collection(cls):
@@ -21,5 +23,8 @@ class TaskCleanIpPool(task.Task):
         self.pool_collection.remove({
             'server_id': {'$nin': org_ids},
         })
+        ip_bitmap.remove_bitmaps({
+            'server_id': {'$nin': org_ids},
+        })
 
 task.add_task(TaskCleanIpPool, hours=5, minutes=23)
@@ -4,6 +4,7 @@ from pritunl import task
 
 class TaskCleanNetworkLinks(task.Task):
     type = 'clean_network_links'
+    lease = True
 
     @cached_static_property
     def user_collection(cls):
@@ -4,6 +4,7 @@ from pritunl import task
 
 class TaskCleanServers(task.Task):
     type = 'clean_server'
+    lease = True
 
     @cached_static_property
     def user_collection(cls):
@@ -1,11 +1,13 @@
 from pritunl.helpers import *
 from pritunl import mongo
 from pritunl import task
+from pritunl.user import search
 
 import time
 
 class TaskCleanUsers(task.Task):
     type = 'clean_users'
+    lease = True
     ttl = 300
 
     @cached_static_property
@@ -35,9 +37,13 @@ class TaskCleanUsers(task.Task):
         user_org_ids &= self._get_user_org_ids()
 
         org_ids = self._get_org_ids()
+        remove_org_ids = list(user_org_ids - org_ids)
 
         self.user_collection.remove({
-            'org_id': {'$in': list(user_org_ids - org_ids)},
+            'org_id': {'$in': remove_org_ids},
         })
 
+        for org_id in remove_org_ids:
+            search.clear_org(org_id)
+
 task.add_task(TaskCleanUsers, hours=5, minutes=17)
@@ -3,6 +3,7 @@ from pritunl import task
 
 class TaskPooler(task.Task):
     type = 'pooler'
+    lease = True
 
     def task(self):
         pooler.fill('org')
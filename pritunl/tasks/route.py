@@ -11,6 +11,7 @@ import datetime
 
 class TaskRoute(task.Task):
     type = 'route'
+    lease = True
 
     @cached_static_property
     def routes_collection(cls):
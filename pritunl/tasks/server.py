@@ -12,6 +12,7 @@ import datetime
 
 class TaskServer(task.Task):
     type = 'server'
+    lease = True
 
     @cached_static_property
     def server_collection(cls):
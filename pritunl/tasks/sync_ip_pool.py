@@ -4,6 +4,7 @@ from pritunl import server
 
 class TaskSyncIpPool(task.Task):
     type = 'sync_ip_pool'
+    lease = True
 
     def task(self):
         for svr in server.iter_servers():
@@ -1,2 +1,3 @@
 from pritunl.user.user import User
 from pritunl.user.utils import *
+from pritunl.user.search import search_users
@@ -0,0 +1,107 @@
+from pritunl.constants import *
+from pritunl import settings
+from pritunl import utils
+
+from OpenSSL import crypto
+import threading
+
+_ca_cache = {}
+_ca_lock = threading.Lock()
+_extensions = {
+    CERT_CA: (
+        ('keyUsage', True, 'keyCertSign,cRLSign'),
+        ('basicConstraints', True, 'CA:true'),
+    ),
+    CERT_SERVER: (
+        ('keyUsage', True, 'digitalSignature,keyEncipherment'),
+        ('basicConstraints', False, 'CA:false'),
+        ('extendedKeyUsage', False, 'serverAuth,clientAuth'),
+    ),
+    CERT_CLIENT: (
+        ('keyUsage', True, 'digitalSignature,keyEncipherment'),
+        ('basicConstraints', False, 'CA:false'),
+        ('extendedKeyUsage', False, 'clientAuth'),
+    ),
+}
+
+def get_ca(org):
+    # Parsed org ca is cached until the org ca certificate changes
+    _ca_lock.acquire()
+    try:
+        cached = _ca_cache.get(org.id)
+        if cached and cached[0] == org.ca_certificate:
+            return cached[1], cached[2]
+    finally:
+        _ca_lock.release()
+
+    ca_cert = crypto.load_certificate(crypto.FILETYPE_PEM,
+        org.ca_certificate)
+    ca_key = crypto.load_privatekey(crypto.FILETYPE_PEM,
+        org.ca_private_key)
+
+    _ca_lock.acquire()
+    try:
+        _ca_cache[org.id] = (org.ca_certificate, ca_cert, ca_key)
+    finally:
+        _ca_lock.release()
+
+    return ca_cert, ca_key
+
+def create_cert(org_id, user_id, cert_type, ca_cert, ca_key, key_bits,
+        digest):
+    cert_type = cert_type.replace('_pool', '')
+
+    private_key = crypto.PKey()
+    private_key.generate_key(crypto.TYPE_RSA, key_bits)
+
+    cert = crypto.X509()
+    cert.set_version(2)
+    cert.set_serial_number(utils.fnv64a(str(user_id)))
+    subject = cert.get_subject()
+    subject.O = str(org_id)
+    subject.CN = str(user_id)
+    cert.gmtime_adj_notBefore(0)
+    cert.gmtime_adj_notAfter(CERT_DAYS * 86400)
+    cert.set_pubkey(private_key)
+
+    if cert_type == CERT_CA:
+        ca_cert = cert
+        ca_key = private_key
+    cert.set_issuer(ca_cert.get_subject())
+
+    extensions = [crypto.X509Extension(name, critical, value)
+        for name, critical, value in _extensions[cert_type]]
+    extensions.append(crypto.X509Extension(
+        'subjectKeyIdentifier', False, 'hash', subject=cert))
+    cert.add_extensions(extensions)
+    cert.add_extensions([crypto.X509Extension(
+        'authorityKeyIdentifier', False, 'keyid:always', issuer=ca_cert)])
+
+    cert.sign(ca_key, str(digest))
+
+    return (
+        crypto.dump_privatekey(crypto.FILETYPE_PEM, private_key).rstrip('\n'),
+        crypto.dump_certificate(crypto.FILETYPE_PEM, cert).rstrip('\n'),
+    )
+
+def issue_cert(org, user_id, cert_type):
+    return issue_certs(org, [(user_id, cert_type)])[0]
+
+def issue_certs(org, users):
+    # Sign a batch of (user_id, cert_type) with one parsed org ca, returns
+    # a (private_key, certificate) pair for each user
+    ca_cert = None
+    ca_key = None
+    certs = []
+
+    for user_id, cert_type in users:
+        org.queue_com.wait_status()
+
+        if cert_type != CERT_CA and not ca_cert:
+            ca_cert, ca_key = get_ca(org)
+
+        certs.append(create_cert(org.id, user_id, cert_type, ca_cert,
+            ca_key, settings.user.cert_key_bits,
+            settings.user.cert_message_digest))
+
+    return certs
@@ -0,0 +1,199 @@
+from pritunl.constants import *
+from pritunl import settings
+from pritunl import mongo
+from pritunl import utils
+
+import threading
+import time
+import base64
+import hashlib
+import hmac
+import struct
+
+# Per host otp state. Valid codes are computed once per secret and epoch,
+# used codes are rejected locally before the shared otp collection is
+# checked and cached otp hashes are served from memory with writes to the
+# otp cache collection batched by the otp runner.
+_lock = threading.Lock()
+_codes = {}
+_codes_epoch = None
+_used = {}
+_cache = {}
+_cache_updates = {}
+
+def _generate_codes(otp_secret, epoch):
+    padding = 8 - len(otp_secret) % 8
+    if padding != 8:
+        otp_secret = otp_secret.ljust(len(otp_secret) + padding, '=')
+    otp_secret = base64.b32decode(otp_secret.upper())
+
+    codes = {}
+    for epoch_offset in range(-1, 2):
+        value = struct.pack('>q', epoch + epoch_offset)
+        hmac_hash = hmac.new(otp_secret, value, hashlib.sha1).digest()
+        offset = ord(hmac_hash[-1]) & 0x0F
+        truncated_hash = hmac_hash[offset:offset + 4]
+        truncated_hash = struct.unpack('>L', truncated_hash)[0]
+        truncated_hash &= 0x7FFFFFFF
+        truncated_hash %= 1000000
+        codes.setdefault('%06d' % truncated_hash, epoch + epoch_offset)
+
+    return codes
+
+def get_codes(otp_secret):
+    # Returns valid codes for the current epoch mapped to the code epoch
+    global _codes
+    global _codes_epoch
+
+    epoch = int(utils.time_now() / 30)
+
+    _lock.acquire()
+    try:
+        if epoch != _codes_epoch:
+            _codes = {}
+            _codes_epoch = epoch
+        codes = _codes.get(otp_secret)
+    finally:
+        _lock.release()
+
+    if codes is None:
+        codes = _generate_codes(otp_secret, epoch)
+
+        _lock.acquire()
+        try:
+            if epoch == _codes_epoch:
+                _codes[otp_secret] = codes
+        finally:
+            _lock.release()
+
+    return codes
+
+def mark_used(user_id, code, epoch):
+    key = (user_id, code, epoch)
+    cur_time = time.time()
+
+    _lock.acquire()
+    try:
+        expire = _used.get(key)
+        if expire and cur_time < expire:
+            return False
+        _used[key] = cur_time + OTP_REPLAY_TTL
+    finally:
+        _lock.release()
+
+    return True
+
+def get_cache(user_id):
+    _lock.acquire()
+    try:
+        cached = _cache.get(user_id)
+        if cached and time.time() < cached[1]:
+            return cached[0]
+    finally:
+        _lock.release()
+
+    doc = mongo.get_collection('otp_cache').find_one({
+        '_id': user_id,
+    })
+    if not doc:
+        return
+
+    _lock.acquire()
+    try:
+        if user_id not in _cache_updates:
+            _cache[user_id] = (doc['otp_hash'],
+                time.time() + OTP_CACHE_LOCAL_TTL)
+    finally:
+        _lock.release()
+
+    return doc['otp_hash']
+
+def touch_cache(user_id):
+    _lock.acquire()
+    try:
+        if user_id not in _cache_updates:
+            _cache_updates[user_id] = None
+    finally:
+        _lock.release()
+
+def set_cache(user_id, otp_hash):
+    _lock.acquire()
+    try:
+        _cache[user_id] = (otp_hash, time.time() + OTP_CACHE_LOCAL_TTL)
+        _cache_updates[user_id] = otp_hash
+    finally:
+        _lock.release()
+
+def _prune():
+    cur_time = time.time()
+
+    _lock.acquire()
+    try:
+        for key, expire in _used.items():
+            if cur_time >= expire:
+                _used.pop(key, None)
+        for user_id, (_, expire) in _cache.items():
+            if cur_time >= expire:
+                _cache.pop(user_id, None)
+    finally:
+        _lock.release()
+
+def flush_otp():
+    global _cache_updates
+
+    _prune()
+
+    _lock.acquire()
+    try:
+        updates = _cache_updates
+        _cache_updates = {}
+    finally:
+        _lock.release()
+
+    if not updates:
+        return
+
+    collection = mongo.get_collection('otp_cache')
+    timestamp = utils.now()
+    try:
+        if mongo.has_bulk:
+            bulk = collection.initialize_unordered_bulk_op()
+        else:
+            bulk = None
+
+        for user_id, otp_hash in updates.items():
+            spec = {
+                '_id': user_id,
+            }
+            if otp_hash:
+                doc = {'$set': {
+                    'otp_hash': otp_hash,
+                    'timestamp': timestamp,
+                }}
+                upsert = True
+            else:
+                doc = {'$set': {
+                    'timestamp': timestamp,
+                }}
+                upsert = False
+
+            if bulk:
+                if upsert:
+                    bulk.find(spec).upsert().update(doc)
+                else:
+                    bulk.find(spec).update(doc)
+            else:
+                collection.update(spec, doc, upsert=upsert)
+
+        if bulk:
+            bulk.execute()
+    except:
+        # Requeue updates that have not been replaced by newer updates
+        _lock.acquire()
+        try:
+            for user_id, otp_hash in updates.items():
+                if user_id not in _cache_updates:
+                    _cache_updates[user_id] = otp_hash
+        finally:
+            _lock.release()
+        raise
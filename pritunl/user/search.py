@@ -0,0 +1,231 @@
+from pritunl.constants import *
+from pritunl import mongo
+from pritunl import messenger
+from pritunl import cache
+
+import threading
+import time
+
+# Per org name and email tries used for user search, built from the users
+# collection on the first search and kept updated from user commits on all
+# hosts. Indexes are rebuilt after the ttl to correct any missed updates.
+# Builds run outside the lock, updates received during a build are queued
+# in _pending and replayed before the new index is swapped in.
+_lock = threading.Lock()
+_indexes = {}
+_pending = {}
+_build_seq = 0
+
+def _get_tries(org_id, build_id):
+    return (
+        cache.CacheTrie('user_search_name_%s_%s' % (org_id, build_id)),
+        cache.CacheTrie('user_search_email_%s_%s' % (org_id, build_id)),
+    )
+
+def _add(index, user_id, name, email, user_type):
+    _remove(index, user_id)
+
+    _, users, name_trie, email_trie = index
+    users[user_id] = (name, email, user_type)
+    if name:
+        name_trie.add_key_terms(name, user_id)
+    if email:
+        email_trie.add_key_terms(email, user_id)
+
+def _remove(index, user_id):
+    _, users, name_trie, email_trie = index
+    user = users.pop(user_id, None)
+    if not user:
+        return
+
+    name, email, _ = user
+    if name:
+        name_trie.remove_key_terms(name, user_id)
+    if email:
+        email_trie.remove_key_terms(email, user_id)
+
+def _discard(index):
+    index[2].clear_cache()
+    index[3].clear_cache()
+
+def _clear(org_id):
+    index = _indexes.pop(org_id, None)
+    if index:
+        _discard(index)
+
+    pending = _pending.get(org_id)
+    if pending is not None:
+        pending.append(('cleared', None, None))
+
+def _build(org_id, build_id):
+    index = (time.time(), {}) + _get_tries(org_id, build_id)
+
+    for doc in mongo.get_collection('users').find({
+                'org_id': org_id,
+                'type': {'$nin': [CERT_CLIENT_POOL, CERT_SERVER_POOL]},
+            }, {
+                '_id': True,
+                'name': True,
+                'email': True,
+                'type': True,
+            }):
+        _add(index, doc['_id'], doc.get('name'), doc.get('email'),
+            doc.get('type'))
+
+    return index
+
+def _get_index(org_id):
+    global _build_seq
+
+    _lock.acquire()
+    try:
+        cur_time = time.time()
+        for index_org_id, index in _indexes.items():
+            if cur_time - index[0] > USER_SEARCH_TTL:
+                _clear(index_org_id)
+
+        index = _indexes.get(org_id)
+        if index:
+            return index
+
+        _build_seq += 1
+        build_id = _build_seq
+        _pending.setdefault(org_id, [])
+    finally:
+        _lock.release()
+
+    try:
+        index = _build(org_id, build_id)
+    except:
+        _lock.acquire()
+        try:
+            if org_id not in _indexes:
+                _pending.pop(org_id, None)
+        finally:
+            _lock.release()
+        raise
+
+    _lock.acquire()
+    try:
+        cur_index = _indexes.get(org_id)
+        if cur_index:
+            _discard(index)
+            return cur_index
+
+        for action, user_id, user in _pending.pop(org_id, None) or []:
+            if action == 'updated':
+                _add(index, user_id, *user)
+            elif action == 'removed':
+                _remove(index, user_id)
+            elif action == 'cleared':
+                _discard(index)
+                return None
+
+        _indexes[org_id] = index
+    finally:
+        _lock.release()
+
+    return index
+
+def _update_user(org_id, user_id, name, email, user_type):
+    _lock.acquire()
+    try:
+        index = _indexes.get(org_id)
+        if index:
+            _add(index, user_id, name, email, user_type)
+
+        pending = _pending.get(org_id)
+        if pending is not None:
+            pending.append(('updated', user_id, (name, email, user_type)))
+    finally:
+        _lock.release()
+
+def _remove_user(org_id, user_id):
+    _lock.acquire()
+    try:
+        index = _indexes.get(org_id)
+        if index:
+            _remove(index, user_id)
+
+        pending = _pending.get(org_id)
+        if pending is not None:
+            pending.append(('removed', user_id, None))
+    finally:
+        _lock.release()
+
+def update_user(org_id, user_id, name, email, user_type):
+    # Pool users have no name or email and are never searched
+    if user_type in (CERT_CLIENT_POOL, CERT_SERVER_POOL):
+        return
+
+    _update_user(org_id, user_id, name, email, user_type)
+    messenger.publish_buffered('user_search', ('updated', user_id), extra={
+        'org_id': org_id,
+        'name': name,
+        'email': email,
+        'user_type': user_type,
+    })
+
+def remove_user(org_id, user_id):
+    _remove_user(org_id, user_id)
+    messenger.publish_buffered('user_search', ('removed', user_id), extra={
+        'org_id': org_id,
+    })
+
+def remove_users(spec):
+    # Must be called before users are removed directly from the collection
+    for doc in mongo.get_collection('users').find(spec, {
+                '_id': True,
+                'org_id': True,
+            }):
+        remove_user(doc['org_id'], doc['_id'])
+
+def _clear_org(org_id):
+    _lock.acquire()
+    try:
+        _clear(org_id)
+    finally:
+        _lock.release()
+
+def clear_org(org_id):
+    _clear_org(org_id)
+    messenger.publish_buffered('user_search', ('cleared', org_id))
+
+def on_msg(msg):
+    action, doc_id = msg['message']
+    if action == 'updated':
+        _update_user(msg['org_id'], doc_id, msg['name'], msg['email'],
+            msg['user_type'])
+    elif action == 'removed':
+        _remove_user(msg['org_id'], doc_id)
+    elif action == 'cleared':
+        _clear_org(doc_id)
+
+def search_users(org_id, name, email=None, user_type=None):
+    # Returns (name, user_id) for each match sorted by name
+    while True:
+        index = _get_index(org_id)
+
+        _lock.acquire()
+        try:
+            # Retry if the index was expired or cleared after the build
+            if not index or _indexes.get(org_id) is not index:
+                continue
+
+            _, users, name_trie, email_trie = index
+
+            user_ids = name_trie.get_prefix(name)
+            if email:
+                user_ids &= email_trie.get_prefix(email)
+
+            matches = []
+            for user_id in user_ids:
+                user = users.get(user_id)
+                if not user or (user_type and user[2] != user_type):
+                    continue
+                matches.append((user[0] or '', user_id))
+        finally:
+            _lock.release()
+
+        matches.sort()
+        return matches
@@ -7,9 +7,14 @@ from pritunl import utils
 from pritunl import queue
 from pritunl import logger
 from pritunl import messenger
+from pritunl import audit
 from pritunl import ipaddress
 from pritunl import sso
 from pritunl import auth
+from pritunl import confcache
+from pritunl.user import cert
+from pritunl.user import search
+from pritunl.user import otp
 
 import tarfile
 import zipfile
@@ -17,12 +22,13 @@ import os
 import subprocess
 import hashlib
 import base64
-import struct
-import hmac
 import json
 import uuid
 import pymongo
 import urllib
+import io
+import time
+from OpenSSL import crypto
 
 class User(mongo.MongoObject):
     fields = {
@@ -120,102 +126,25 @@ class User(mongo.MongoObject):
             'port_forwarding': self.port_forwarding,
         }
 
-    def initialize(self):
-        temp_path = utils.get_temp_path()
-        index_path = os.path.join(temp_path, INDEX_NAME)
-        index_attr_path = os.path.join(temp_path, INDEX_ATTR_NAME)
-        serial_path = os.path.join(temp_path, SERIAL_NAME)
-        ssl_conf_path = os.path.join(temp_path, OPENSSL_NAME)
-        reqs_path = os.path.join(temp_path, '%s.csr' % self.id)
-        key_path = os.path.join(temp_path, '%s.key' % self.id)
-        cert_path = os.path.join(temp_path, '%s.crt' % self.id)
-        ca_name = self.id if self.type == CERT_CA else 'ca'
-        ca_cert_path = os.path.join(temp_path, '%s.crt' % ca_name)
-        ca_key_path = os.path.join(temp_path, '%s.key' % ca_name)
-
+    def initialize(self, private_key=None, certificate=None):
         self.org.queue_com.wait_status()
 
-        try:
-            os.makedirs(temp_path)
-
-            with open(index_path, 'a'):
-                os.utime(index_path, None)
-
-            with open(index_attr_path, 'a'):
-                os.utime(index_attr_path, None)
-
-            with open(serial_path, 'w') as serial_file:
-                serial_hex = ('%x' % utils.fnv64a(str(self.id))).upper()
-
-                if len(serial_hex) % 2:
-                    serial_hex = '0' + serial_hex
-
-                serial_file.write('%s\n' % serial_hex)
-
-            with open(ssl_conf_path, 'w') as conf_file:
-                conf_file.write(CERT_CONF % (
-                    settings.user.cert_key_bits,
-                    settings.user.cert_message_digest,
-                    self.org.id,
-                    self.id,
-                    index_path,
-                    serial_path,
-                    temp_path,
-                    ca_cert_path,
-                    ca_key_path,
-                    settings.user.cert_message_digest,
-                ))
-
-            self.org.queue_com.wait_status()
-
-            if self.type != CERT_CA:
-                self.org.write_file('ca_certificate', ca_cert_path, chmod=0600)
-                self.org.write_file('ca_private_key', ca_key_path, chmod=0600)
-                self.generate_otp_secret()
-
-            try:
-                args = [
-                    'openssl', 'req', '-new', '-batch',
-                    '-config', ssl_conf_path,
-                    '-out', reqs_path,
-                    '-keyout', key_path,
-                    '-reqexts', '%s_req_ext' % self.type.replace('_pool', ''),
-                ]
-                self.org.queue_com.popen(args)
-            except (OSError, ValueError):
-                logger.exception('Failed to create user cert requests', 'user',
-                    org_id=self.org.id,
-                    user_id=self.id,
-                )
-                raise
-            self.read_file('private_key', key_path)
+        if self.type != CERT_CA:
+            self.generate_otp_secret()
 
+        if not certificate:
             try:
-                args = ['openssl', 'ca', '-batch']
-
-                if self.type == CERT_CA:
-                    args += ['-selfsign']
-
-                args += [
-                    '-config', ssl_conf_path,
-                    '-in', reqs_path,
-                    '-out', cert_path,
-                    '-extensions', '%s_ext' % self.type.replace('_pool', ''),
-                ]
-
-                self.org.queue_com.popen(args)
-            except (OSError, ValueError):
+                private_key, certificate = cert.issue_cert(
+                    self.org, self.id, self.type)
+            except crypto.Error:
                 logger.exception('Failed to create user cert', 'user',
                     org_id=self.org.id,
                     user_id=self.id,
                 )
                 raise
-            self.read_file('certificate', cert_path)
-        finally:
-            try:
-                utils.rmtree(temp_path)
-            except subprocess.CalledProcessError:
-                pass
+
+        self.private_key = private_key
+        self.certificate = certificate
 
         self.org.queue_com.wait_status()
 
@@ -244,7 +173,19 @@ class User(mongo.MongoObject):
         if block:
             self.load()
 
+    def commit(self, fields=None, *args, **kwargs):
+        response = mongo.MongoObject.commit(self, fields, *args, **kwargs)
+
+        if isinstance(fields, basestring):
+            fields = (fields,)
+        if fields is None or set(fields) & {'name', 'email', 'type'}:
+            search.update_user(self.org_id, self.id, self.name, self.email,
+                self.type)
+
+        return response
+
     def remove(self):
+        search.remove_user(self.org_id, self.id)
         self.audit_collection.remove({
             'user_id': self.id,
             'org_id': self.org_id,
@@ -345,12 +286,10 @@ class User(mongo.MongoObject):
 
     def verify_otp_code(self, code, remote_ip=None):
         if remote_ip and settings.vpn.cache_otp_codes:
-            doc = self.otp_cache_collection.find_one({
-                '_id': self.id,
-            })
+            cache_otp_hash = otp.get_cache(self.id)
 
-            if doc:
-                _, hash_salt, cur_otp_hash = doc['otp_hash'].split('$')
+            if cache_otp_hash:
+                _, hash_salt, cur_otp_hash = cache_otp_hash.split('$')
                 hash_salt = base64.b64decode(hash_salt)
             else:
                 hash_salt = os.urandom(8)
@@ -362,11 +301,7 @@ class User(mongo.MongoObject):
             otp_hash = base64.b64encode(otp_hash.digest())
 
             if otp_hash == cur_otp_hash:
-                self.otp_cache_collection.update({
-                    '_id': self.id,
-                }, {'$set': {
-                    'timestamp': utils.now(),
-                }})
+                otp.touch_cache(self.id)
                 return True
 
             otp_hash = '$'.join((
@@ -375,24 +310,11 @@ class User(mongo.MongoObject):
                 otp_hash,
             ))
 
-        otp_secret = self.otp_secret
-        padding = 8 - len(otp_secret) % 8
-        if padding != 8:
-            otp_secret = otp_secret.ljust(len(otp_secret) + padding, '=')
-        otp_secret = base64.b32decode(otp_secret.upper())
-        valid_codes = []
-        epoch = int(utils.time_now() / 30)
-        for epoch_offset in range(-1, 2):
-            value = struct.pack('>q', epoch + epoch_offset)
-            hmac_hash = hmac.new(otp_secret, value, hashlib.sha1).digest()
-            offset = ord(hmac_hash[-1]) & 0x0F
-            truncated_hash = hmac_hash[offset:offset + 4]
-            truncated_hash = struct.unpack('>L', truncated_hash)[0]
-            truncated_hash &= 0x7FFFFFFF
-            truncated_hash %= 1000000
-            valid_codes.append('%06d' % truncated_hash)
-
-        if code not in valid_codes:
+        code_epoch = otp.get_codes(self.otp_secret).get(code)
+        if code_epoch is None:
+            return False
+
+        if not otp.mark_used(self.id, code, code_epoch):
             return False
 
         response = self.otp_collection.update({
@@ -408,12 +330,7 @@ class User(mongo.MongoObject):
             return False
 
         if remote_ip and settings.vpn.cache_otp_codes:
-            self.otp_cache_collection.update({
-                '_id': self.id,
-            }, {'$set': {
-                'otp_hash': otp_hash,
-                'timestamp': utils.now(),
-            }}, upsert=True)
+            otp.set_cache(self.id, otp_hash)
 
         return True
 
@@ -455,16 +372,61 @@ class User(mongo.MongoObject):
             'password_mode': self._get_password_mode(svr),
         }, indent=1).replace('\n', '\n#')
 
+    def _get_conf_cache_hash(self, svr):
+        cache_hash = hashlib.md5()
+        for value in (
+                    self.name,
+                    self.org.name,
+                    self.certificate,
+                    self.private_key,
+                    self.sync_token,
+                    self.sync_secret,
+                    self._get_password_mode(svr),
+                    svr.name,
+                    svr.protocol,
+                    svr.port,
+                    svr.ipv6,
+                    sorted(svr.hosts),
+                    svr.cipher,
+                    svr.hash,
+                    svr.ping_interval,
+                    svr.ping_timeout,
+                    svr.lzo_compression,
+                    svr.jumbo_frames,
+                    svr.adapter_type,
+                    svr.ca_certificate,
+                    svr.tls_auth,
+                    svr.tls_auth_key,
+                ):
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            cache_hash.update('%r\x00' % (value,))
+        return cache_hash.hexdigest()
+
     def _generate_conf(self, svr, include_user_cert=True):
         if not self.sync_token or not self.sync_secret:
             self.sync_token = utils.generate_secret()
             self.sync_secret = utils.generate_secret()
             self.commit(('sync_token', 'sync_secret'))
 
-        file_name = '%s_%s_%s.ovpn' % (
-            self.org.name, self.name, svr.name)
         if not svr.ca_certificate:
             svr.generate_ca_cert()
+
+        cache_hash = self._get_conf_cache_hash(svr)
+        cached = confcache.get_conf(self.id, svr.id, cache_hash,
+            include_user_cert)
+        if cached:
+            file_name, client_conf, conf_hash, uv_id, uv_name = cached
+            client_conf = client_conf.replace(
+                'setenv UV_ID %s\nsetenv UV_NAME %s\n' % (uv_id, uv_name),
+                'setenv UV_ID %s\nsetenv UV_NAME %s\n' % (
+                    uuid.uuid4().hex, utils.random_name()),
+                1,
+            )
+            return file_name, client_conf, conf_hash
+
+        file_name = '%s_%s_%s.ovpn' % (
+            self.org.name, self.name, svr.name)
         key_remotes = svr.get_key_remotes()
         ca_certificate = svr.ca_certificate
         certificate = utils.get_cert_block(self.certificate)
@@ -484,13 +446,15 @@ class User(mongo.MongoObject):
         conf_hash.update(ca_certificate)
         conf_hash = conf_hash.hexdigest()
 
+        uv_id = uuid.uuid4().hex
+        uv_name = utils.random_name()
         client_conf = OVPN_INLINE_CLIENT_CONF % (
             self._get_key_info_str(svr, conf_hash),
-            uuid.uuid4().hex,
-            utils.random_name(),
+            uv_id,
+            uv_name,
             svr.adapter_type,
             svr.adapter_type,
-            svr.get_key_remotes(),
+            key_remotes,
             CIPHERS[svr.cipher],
             HASHES[svr.hash],
             svr.ping_interval,
@@ -516,6 +480,9 @@ class User(mongo.MongoObject):
             client_conf += '<cert>\n%s\n</cert>\n' % certificate
             client_conf += '<key>\n%s\n</key>\n' % private_key
 
+        confcache.set_conf(self.id, svr.id, cache_hash, include_user_cert,
+            (file_name, client_conf, conf_hash, uv_id, uv_name))
+
         return file_name, client_conf, conf_hash
 
     def _generate_onc(self, svr):
@@ -593,120 +560,73 @@ class User(mongo.MongoObject):
 
         return file_name, onc_conf
 
+    def _add_tar_file(self, tar_file, name, data):
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        tar_info = tarfile.TarInfo(name)
+        tar_info.size = len(data)
+        tar_info.mode = 0600
+        tar_info.mtime = time.time()
+        tar_file.addfile(tar_info, io.BytesIO(data))
+
+    def _add_zip_file(self, zip_file, name, data):
+        zip_info = zipfile.ZipInfo(name, time.localtime()[:6])
+        zip_info.external_attr = 0600 << 16
+        zip_file.writestr(zip_info, data)
+
     def build_key_tar_archive(self):
-        temp_path = utils.get_temp_path()
-        key_archive_path = os.path.join(temp_path, '%s.tar' % self.id)
+        key_archive = io.BytesIO()
 
+        tar_file = tarfile.open(fileobj=key_archive, mode='w')
         try:
-            os.makedirs(temp_path)
-            tar_file = tarfile.open(key_archive_path, 'w')
-            try:
-                for svr in self.org.iter_servers():
-                    server_conf_path = os.path.join(temp_path,
-                        '%s_%s.ovpn' % (self.id, svr.id))
-                    conf_name, client_conf, conf_hash = self._generate_conf(
-                        svr)
-
-                    with open(server_conf_path, 'w') as ovpn_conf:
-                        os.chmod(server_conf_path, 0600)
-                        ovpn_conf.write(client_conf)
-                    tar_file.add(server_conf_path, arcname=conf_name)
-                    os.remove(server_conf_path)
-            finally:
-                tar_file.close()
-
-            with open(key_archive_path, 'r') as archive_file:
-                key_archive = archive_file.read()
+            for svr in self.org.iter_servers():
+                conf_name, client_conf, conf_hash = self._generate_conf(svr)
+                self._add_tar_file(tar_file, conf_name,
+                    client_conf.encode('utf-8'))
         finally:
-            utils.rmtree(temp_path)
+            tar_file.close()
 
-        return key_archive
+        return key_archive.getvalue()
 
     def build_key_zip_archive(self):
-        temp_path = utils.get_temp_path()
-        key_archive_path = os.path.join(temp_path, '%s.zip' % self.id)
+        key_archive = io.BytesIO()
 
+        zip_file = zipfile.ZipFile(key_archive, 'w')
         try:
-            os.makedirs(temp_path)
-            zip_file = zipfile.ZipFile(key_archive_path, 'w')
-            try:
-                for svr in self.org.iter_servers():
-                    server_conf_path = os.path.join(temp_path,
-                        '%s_%s.ovpn' % (self.id, svr.id))
-                    conf_name, client_conf, conf_hash = self._generate_conf(
-                        svr)
-
-                    with open(server_conf_path, 'w') as ovpn_conf:
-                        os.chmod(server_conf_path, 0600)
-                        ovpn_conf.write(client_conf)
-                    zip_file.write(server_conf_path, arcname=conf_name)
-                    os.remove(server_conf_path)
-            finally:
-                zip_file.close()
-
-            with open(key_archive_path, 'r') as archive_file:
-                key_archive = archive_file.read()
+            for svr in self.org.iter_servers():
+                conf_name, client_conf, conf_hash = self._generate_conf(svr)
+                self._add_zip_file(zip_file, conf_name,
+                    client_conf.encode('utf-8'))
         finally:
-            utils.rmtree(temp_path)
+            zip_file.close()
 
-        return key_archive
+        return key_archive.getvalue()
 
     def build_onc_archive(self):
-        temp_path = utils.get_temp_path()
-        key_archive_path = os.path.join(temp_path, '%s.zip' % self.id)
+        key_archive = io.BytesIO()
 
+        zip_file = zipfile.ZipFile(key_archive, 'w')
         try:
-            os.makedirs(temp_path)
-            zip_file = zipfile.ZipFile(key_archive_path, 'w')
-            try:
-                user_cert_path = os.path.join(temp_path, '%s.crt' % self.id)
-                user_key_path = os.path.join(temp_path, '%s.key' % self.id)
-                user_p12_path = os.path.join(temp_path, '%s.p12' % self.id)
-
-                with open(user_cert_path, 'w') as user_cert:
-                    user_cert.write(self.certificate)
-
-                with open(user_key_path, 'w') as user_key:
-                    os.chmod(user_key_path, 0600)
-                    user_key.write(self.private_key)
-
-                utils.check_output_logged([
-                    'openssl',
-                    'pkcs12',
-                    '-export',
-                    '-nodes',
-                    '-password', 'pass:',
-                    '-inkey', user_key_path,
-                    '-in', user_cert_path,
-                    '-out', user_p12_path
-                ])
-
-                zip_file.write(user_p12_path, arcname='%s.p12' % self.name)
-
-                os.remove(user_cert_path)
-                os.remove(user_key_path)
-                os.remove(user_p12_path)
-
-                for svr in self.org.iter_servers():
-                    server_conf_path = os.path.join(temp_path,
-                        '%s_%s.onc' % (self.id, svr.id))
-                    conf_name, client_conf = self._generate_onc(svr)
-                    if not client_conf:
-                        continue
-
-                    with open(server_conf_path, 'w') as ovpn_conf:
-                        ovpn_conf.write(client_conf)
-                    zip_file.write(server_conf_path, arcname=conf_name)
-                    os.remove(server_conf_path)
-            finally:
-                zip_file.close()
-
-            with open(key_archive_path, 'r') as archive_file:
-                key_archive = archive_file.read()
+            user_p12 = crypto.PKCS12()
+            user_p12.set_certificate(crypto.load_certificate(
+                crypto.FILETYPE_PEM, self.certificate))
+            user_p12.set_privatekey(crypto.load_privatekey(
+                crypto.FILETYPE_PEM, self.private_key))
+
+            self._add_zip_file(zip_file, '%s.p12' % self.name,
+                user_p12.export(passphrase=''))
+
+            for svr in self.org.iter_servers():
+                conf_name, client_conf = self._generate_onc(svr)
+                if not client_conf:
+                    continue
+
+                self._add_zip_file(zip_file, conf_name,
+                    client_conf.encode('utf-8'))
         finally:
-            utils.rmtree(temp_path)
+            zip_file.close()
 
-        return key_archive
+        return key_archive.getvalue()
 
     def build_key_conf(self, server_id, include_user_cert=True):
         svr = self.org.get_by_id(server_id)
@@ -825,7 +745,7 @@ class User(mongo.MongoObject):
         if settings.app.auditing != ALL:
             return
 
-        self.audit_collection.insert_one({
+        audit.add_event({
             'user_id': self.id,
             'org_id': self.org_id,
             'timestamp': utils.now(),
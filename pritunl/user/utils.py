@@ -1,9 +1,37 @@
 from pritunl.user.user import User
+from pritunl.user import cert
+from pritunl.user import search
 
 from pritunl.constants import *
+from pritunl import settings
+from pritunl import queue
 
 import threading
 
+def initialize_users(org, users):
+    certs = cert.issue_certs(org, [(x.id, x.type) for x in users])
+    for usr, (private_key, certificate) in zip(users, certs):
+        usr.initialize(private_key, certificate)
+
+def new_pooled_users(org, type, count, priority=LOW):
+    # Queue pooled users in batches of user_pool_batch per queue item.
+    # Batched users cannot be reserved by new users before the batch has
+    # run so part of the pool is queued as single reservable items.
+    single_count = min(count, USER_POOL_RESERVE_COUNT)
+    count -= single_count
+    for _ in xrange(single_count):
+        User(org=org, type=type).queue_initialize(block=False,
+            priority=priority)
+
+    while count > 0:
+        batch_count = min(count, settings.app.user_pool_batch)
+        count -= batch_count
+
+        user_docs = [User(org=org, type=type).export()
+            for _ in xrange(batch_count)]
+        queue.start('init_users_pooled', block=False,
+            org_doc=org.export(), user_docs=user_docs, priority=priority)
+
 def new_pooled_user(org, type):
     type = {
         CERT_SERVER: CERT_SERVER_POOL,
@@ -57,6 +85,8 @@ def reserve_pooled_user(org, name=None, email=None, pin=None, type=CERT_CLIENT,
     }, new=True)
 
     if doc:
+        search.update_user(org.id, doc['_id'], doc.get('name'),
+            doc.get('email'), doc['type'])
         return User(org=org, doc=doc)
 
 def get_user(org, id, fields=None):
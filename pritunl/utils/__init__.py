@@ -3,6 +3,7 @@ from pritunl.utils.json_helpers import *
 from pritunl.utils.least_common_counter import *
 from pritunl.utils.mail import *
 from pritunl.utils.misc import *
+from pritunl.utils.keyset import *
 from pritunl.utils.network import *
 from pritunl.utils.aws import *
 from pritunl.utils.none_queue import NoneQueue
@@ -0,0 +1,126 @@
+from pritunl.constants import *
+
+import threading
+import base64
+import json
+import time
+import bson
+import pymongo
+
+_counts_lock = threading.Lock()
+_counts = {}
+
+def encode_cursor(direction, name, doc_id):
+    return base64.urlsafe_b64encode(json.dumps([
+        direction,
+        name,
+        str(doc_id),
+        isinstance(doc_id, bson.ObjectId),
+    ])).rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        cursor = str(cursor)
+        direction, name, doc_id, object_id = json.loads(
+            base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if direction not in (NEXT, PREVIOUS):
+            return
+        if object_id:
+            doc_id = bson.ObjectId(doc_id)
+        return direction, name, doc_id
+    except (TypeError, ValueError, bson.errors.InvalidId):
+        return
+
+def get_count(key, collection, spec):
+    # Totals for paged listings are cached for the page count ttl
+    cur_time = time.time()
+
+    _counts_lock.acquire()
+    try:
+        count = _counts.get(key)
+        if count and cur_time - count[0] < PAGE_COUNT_TTL:
+            return count[1]
+    finally:
+        _counts_lock.release()
+
+    count = collection.find(spec, {
+        '_id': True,
+    }).count()
+
+    _counts_lock.acquire()
+    try:
+        _counts[key] = (cur_time, count)
+    finally:
+        _counts_lock.release()
+
+    return count
+
+class KeysetPage(object):
+    # Page of docs ordered by name and id starting after the position in
+    # an opaque cursor from a previous page
+    def __init__(self, cursor, page_count):
+        self.page_count = page_count
+        self.direction = NEXT
+        self.name = None
+        self.doc_id = None
+        self.next_cursor = None
+        self.prev_cursor = None
+
+        if cursor:
+            position = decode_cursor(cursor)
+            if position:
+                self.direction, self.name, self.doc_id = position
+
+    def find(self, collection, spec, fields=None):
+        if self.direction == NEXT:
+            operator = '$gt'
+            order = pymongo.ASCENDING
+        else:
+            operator = '$lt'
+            order = pymongo.DESCENDING
+
+        if self.doc_id is not None:
+            # Null names sort before all strings and are not matched by
+            # comparisons with strings
+            if self.name is None:
+                position = [{'name': None, '_id': {operator: self.doc_id}}]
+                if self.direction == NEXT:
+                    position.append({'name': {'$type': 2}})
+            else:
+                position = [
+                    {'name': {operator: self.name}},
+                    {'name': self.name, '_id': {operator: self.doc_id}},
+                ]
+                if self.direction == PREVIOUS:
+                    position.append({'name': None})
+            spec = {'$and': [spec, {'$or': position}]}
+
+        if fields:
+            fields = fields.copy()
+            fields['name'] = True
+
+        docs = list(collection.find(spec, fields).sort([
+            ('name', order),
+            ('_id', order),
+        ]).limit(self.page_count + 1))
+
+        more = len(docs) > self.page_count
+        docs = docs[:self.page_count]
+
+        if self.direction == NEXT:
+            has_next = more
+            has_prev = self.doc_id is not None
+        else:
+            docs.reverse()
+            has_next = True
+            has_prev = more
+
+        if docs:
+            if has_next:
+                self.next_cursor = encode_cursor(NEXT,
+                    docs[-1].get('name'), docs[-1]['_id'])
+            if has_prev:
+                self.prev_cursor = encode_cursor(PREVIOUS,
+                    docs[0].get('name'), docs[0]['_id'])
+
+        return docs
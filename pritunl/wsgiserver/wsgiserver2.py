@@ -584,6 +584,12 @@ class HTTPRequest(object):
 
     This value is set automatically inside send_headers."""
 
+    parked = False
+    """If True, the connection is left open after the response iterable is
+    exhausted and the worker thread returns without closing it.
+
+    This value is set by park()."""
+
     def __init__(self, server, conn):
         self.server = server
         self.conn = conn
@@ -872,9 +878,26 @@ class HTTPRequest(object):
         if (self.ready and not self.sent_headers):
             self.sent_headers = True
             self.send_headers()
+        if self.parked:
+            return
         if self.chunked_write:
             self.conn.wfile.sendall("0\r\n\r\n")
 
+    def park(self, timeout=None):
+        """Detach the connection from the worker thread.
+
+        Once the response iterable is exhausted the worker thread returns
+        without ending the response or closing the socket. The caller then
+        owns the connection, continues the response with write() and must
+        close it with conn.close().
+        """
+        self.parked = True
+        self.close_connection = True
+        self.conn.parked = True
+        if timeout is not None:
+            self.conn.socket.settimeout(timeout)
+        return self
+
     def simple_response(self, status, msg=""):
         """Write a simple response back to the client."""
         status = str(status)
@@ -1322,6 +1345,7 @@ class HTTPConnection(object):
     rbufsize = DEFAULT_BUFFER_SIZE
     wbufsize = DEFAULT_BUFFER_SIZE
     RequestHandlerClass = HTTPRequest
+    parked = False
 
     def __init__(self, server, sock, makefile=CP_fileobject, peer=None):
         self.server = server
@@ -1530,7 +1554,8 @@ class WorkerThread(threading.Thread):
                 try:
                     conn.communicate()
                 finally:
-                    conn.close()
+                    if not conn.parked:
+                        conn.close()
                     if self.server.stats['Enabled']:
                         self.requests_seen += self.conn.requests_seen
                         self.bytes_read += self.conn.rfile.bytes_read
@@ -2396,6 +2421,7 @@ class WSGIGateway_10(WSGIGateway):
             'wsgi.run_once': False,
             'wsgi.url_scheme': req.scheme,
             'wsgi.version': (1, 0),
+            'wsgiserver.park': req.park,
         }
 
         if isinstance(req.server.bind_addr, basestring):
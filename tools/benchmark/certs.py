@@ -0,0 +1,186 @@
+# Compare user certificate creation with openssl subprocesses against the
+# in process pyOpenSSL signer. Run from the repository root with python 2.7
+# and pyOpenSSL installed.
+USERS = 50
+KEY_BITS = 2048
+DIGEST = 'sha256'
+
+# Openssl config used by the previous User.initialize
+CERT_CONF = """\
+[ default ]
+[ req ]
+default_bits = %s
+default_md = %s
+encrypt_key = no
+utf8 = yes
+string_mask = utf8only
+prompt = no
+distinguished_name = req_dn
+
+[ req_dn ]
+organizationName = %s
+commonName = %s
+
+[ ca_req_ext ]
+keyUsage = critical,keyCertSign,cRLSign
+basicConstraints = critical,CA:true
+subjectKeyIdentifier = hash
+
+[ server_req_ext ]
+keyUsage = critical,digitalSignature,keyEncipherment
+extendedKeyUsage = serverAuth,clientAuth
+subjectKeyIdentifier = hash
+
+[ client_req_ext ]
+keyUsage = critical,digitalSignature,keyEncipherment
+extendedKeyUsage = clientAuth
+subjectKeyIdentifier = hash
+
+[ ca ]
+default_ca = root_ca
+
+[ root_ca ]
+database = %s
+serial = %s
+new_certs_dir = %s
+certificate = %s
+private_key = %s
+default_days = 3652
+default_crl_days = 365
+default_md = %s
+policy = ca_policy
+crl_extensions = crl_ext
+
+[ ca_policy ]
+organizationName = match
+commonName = supplied
+
+[ ca_ext ]
+keyUsage = critical,keyCertSign,cRLSign
+basicConstraints = critical,CA:true
+subjectKeyIdentifier = hash
+authorityKeyIdentifier = keyid:always
+
+[ crl_ext ]
+authorityKeyIdentifier = keyid:always
+
+[ server_ext ]
+keyUsage = critical,digitalSignature,keyEncipherment
+basicConstraints = CA:false
+extendedKeyUsage = serverAuth,clientAuth
+subjectKeyIdentifier = hash
+authorityKeyIdentifier = keyid:always
+
+[ client_ext ]
+keyUsage = critical,digitalSignature,keyEncipherment
+basicConstraints = CA:false
+extendedKeyUsage = clientAuth
+subjectKeyIdentifier = hash
+authorityKeyIdentifier = keyid:always
+"""
+
+import os
+import sys
+import imp
+import time
+import shutil
+import subprocess
+import tempfile
+import warnings
+import bson
+
+warnings.simplefilter('ignore')
+
+ROOT_PATH = os.path.join(os.path.dirname(__file__), '..', '..')
+sys.path.insert(0, ROOT_PATH)
+
+from pritunl.constants import *
+from OpenSSL import crypto
+
+# Load the module directly to avoid importing the user package
+cert = imp.load_source('cert', os.path.join(
+    ROOT_PATH, 'pritunl', 'user', 'cert.py'))
+
+def openssl_cert(org_id, user_id, ca_cert, ca_key):
+    # Same steps as the previous User.initialize
+    temp_path = tempfile.mkdtemp()
+    index_path = os.path.join(temp_path, 'index')
+    index_attr_path = os.path.join(temp_path, 'index.attr')
+    serial_path = os.path.join(temp_path, 'serial')
+    ssl_conf_path = os.path.join(temp_path, 'openssl.conf')
+    reqs_path = os.path.join(temp_path, '%s.csr' % user_id)
+    key_path = os.path.join(temp_path, '%s.key' % user_id)
+    cert_path = os.path.join(temp_path, '%s.crt' % user_id)
+    ca_cert_path = os.path.join(temp_path, 'ca.crt')
+    ca_key_path = os.path.join(temp_path, 'ca.key')
+
+    try:
+        open(index_path, 'a').close()
+        open(index_attr_path, 'a').close()
+        with open(serial_path, 'w') as serial_file:
+            serial_file.write('01\n')
+        with open(ssl_conf_path, 'w') as conf_file:
+            conf_file.write(CERT_CONF % (
+                KEY_BITS,
+                DIGEST,
+                org_id,
+                user_id,
+                index_path,
+                serial_path,
+                temp_path,
+                ca_cert_path,
+                ca_key_path,
+                DIGEST,
+            ))
+        with open(ca_cert_path, 'w') as ca_cert_file:
+            ca_cert_file.write(ca_cert)
+        with open(ca_key_path, 'w') as ca_key_file:
+            ca_key_file.write(ca_key)
+
+        subprocess.check_call([
+            'openssl', 'req', '-new', '-batch',
+            '-config', ssl_conf_path,
+            '-out', reqs_path,
+            '-keyout', key_path,
+            '-reqexts', 'client_req_ext',
+        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        subprocess.check_call([
+            'openssl', 'ca', '-batch',
+            '-config', ssl_conf_path,
+            '-in', reqs_path,
+            '-out', cert_path,
+            '-extensions', 'client_ext',
+        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        with open(key_path) as key_file:
+            private_key = key_file.read()
+        with open(cert_path) as cert_file:
+            certificate = cert_file.read()
+        return private_key, certificate
+    finally:
+        shutil.rmtree(temp_path)
+
+def main():
+    org_id = bson.ObjectId()
+    ca_key, ca_cert = cert.create_cert(org_id, bson.ObjectId(), CERT_CA,
+        None, None, KEY_BITS, DIGEST)
+    ca_cert_obj = crypto.load_certificate(crypto.FILETYPE_PEM, ca_cert)
+    ca_key_obj = crypto.load_privatekey(crypto.FILETYPE_PEM, ca_key)
+
+    start = time.time()
+    for _ in xrange(USERS):
+        openssl_cert(org_id, bson.ObjectId(), ca_cert, ca_key)
+    elapsed = time.time() - start
+    print 'openssl:   %d users  %.2fs  %.1f users/s' % (
+        USERS, elapsed, USERS / elapsed)
+
+    start = time.time()
+    for _ in xrange(USERS):
+        cert.create_cert(org_id, bson.ObjectId(), CERT_CLIENT, ca_cert_obj,
+            ca_key_obj, KEY_BITS, DIGEST)
+    elapsed = time.time() - start
+    print 'pyopenssl: %d users  %.2fs  %.1f users/s' % (
+        USERS, elapsed, USERS / elapsed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Compare DocDb deep copy reads against frozen reads. Run from the
+# repository root with python 2.7 and bson installed.
+COUNT = 10000
+RULES = 12
+ROUNDS = 3
+
+import os
+import sys
+import time
+import bson
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from pritunl import docdb
+
+def fill(db):
+    client_ids = []
+    for i in xrange(COUNT):
+        client_id = bson.ObjectId()
+        client_ids.append(client_id)
+        rules = [['FORWARD', '-d', '10.0.%d.%d' % (i // 250, i % 250),
+            '-p', 'tcp', '--dport', str(port), '-j', 'ACCEPT']
+            for port in xrange(RULES)]
+        db.insert({
+            'id': client_id,
+            'user_id': bson.ObjectId(),
+            'mac_addr': '%012x' % i,
+            'virt_address': '10.0.%d.%d/16' % (i // 250, i % 250),
+            'timestamp': time.time(),
+            'iptables_rules': rules,
+            'ip6tables_rules': rules,
+        })
+    return client_ids
+
+def run(name, db):
+    client_ids = fill(db)
+    docs = db.find_all()
+
+    start = time.time()
+    for _ in xrange(ROUNDS):
+        for client_id in client_ids:
+            db.find_id(client_id)
+    find_id_time = time.time() - start
+
+    start = time.time()
+    for _ in xrange(ROUNDS):
+        for doc in docs:
+            db.find({
+                'user_id': doc['user_id'],
+                'mac_addr': doc['mac_addr'],
+            })
+    find_time = time.time() - start
+
+    start = time.time()
+    for _ in xrange(ROUNDS):
+        db.find_all()
+    find_all_time = time.time() - start
+
+    start = time.time()
+    for _ in xrange(ROUNDS):
+        for client_id in client_ids:
+            db.update_id(client_id, {
+                'timestamp': time.time(),
+            })
+    update_time = time.time() - start
+
+    total = COUNT * ROUNDS
+    print '%s:' % name
+    print '  find_id  %8.0f ops/s' % (total / find_id_time)
+    print '  find     %8.0f ops/s' % (total / find_time)
+    print '  find_all %8.3f s/call' % (find_all_time / ROUNDS)
+    print '  update   %8.0f ops/s' % (total / update_time)
+
+run('deepcopy', docdb.DocDb(
+    'user_id',
+    'mac_addr',
+    'virt_address',
+))
+run('frozen', docdb.DocDb(
+    'user_id',
+    'mac_addr',
+    'virt_address',
+    ('user_id', 'mac_addr'),
+    frozen=True,
+))
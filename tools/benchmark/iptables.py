@@ -0,0 +1,165 @@
+# Compare per rule iptables calls against the iptables-save and
+# iptables-restore rule set path using a fake iptables binary. Run from the
+# repository root with python 2.7 and the pritunl dependencies installed.
+RULES = 300
+ROUNDS = 3
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+FAKE_IPTABLES = r'''#!%(python)s
+import os
+import sys
+import shlex
+
+state_path = os.environ['FAKE_IPTABLES_STATE']
+name = os.path.basename(sys.argv[0])
+with open(state_path + '.calls', 'a') as calls_file:
+    calls_file.write(name + '\n')
+
+def load():
+    if not os.path.exists(state_path):
+        return []
+    with open(state_path) as state_file:
+        return [tuple(x.split('\t')) for x in state_file.read().splitlines()]
+
+def save(rules):
+    with open(state_path, 'w') as state_file:
+        state_file.write('\n'.join('\t'.join(x) for x in rules))
+
+def parse(args):
+    table = 'filter'
+    spec = []
+    args = iter(args)
+    for arg in args:
+        if arg == '-t':
+            table = next(args)
+        elif arg != '--wait':
+            spec.append(arg)
+    return table, ' '.join(spec)
+
+def apply(rules, action, args):
+    rule = parse(args)
+    if action == '-C':
+        return 0 if rule in rules else 1
+    elif action == '-I':
+        rules.insert(0, rule)
+    elif action == '-D':
+        if rule not in rules:
+            return 1
+        rules.remove(rule)
+    return 0
+
+rules = load()
+if name.endswith('-save'):
+    tables = {}
+    for table, spec in rules:
+        tables.setdefault(table, []).append(spec)
+    for table, specs in tables.items():
+        print '*' + table
+        for spec in specs:
+            print '-A ' + spec
+        print 'COMMIT'
+    sys.exit(0)
+elif name.endswith('-restore'):
+    table = None
+    for line in sys.stdin.read().splitlines():
+        if line.startswith('*'):
+            table = line[1:]
+        elif line.startswith('-'):
+            args = shlex.split(line)
+            if apply(rules, args[0], ['-t', table] + args[1:]):
+                sys.exit(1)
+    save(rules)
+    sys.exit(0)
+
+code = apply(rules, sys.argv[1], sys.argv[2:])
+save(rules)
+sys.exit(code)
+'''
+
+def setup_fake():
+    bin_path = tempfile.mkdtemp()
+    state_path = os.path.join(bin_path, 'state')
+    for name in ('iptables', 'iptables-save', 'iptables-restore'):
+        path = os.path.join(bin_path, name)
+        with open(path, 'w') as fake_file:
+            fake_file.write(FAKE_IPTABLES % {'python': sys.executable})
+        os.chmod(path, 0755)
+    os.environ['PATH'] = bin_path + os.pathsep + os.environ['PATH']
+    os.environ['FAKE_IPTABLES_STATE'] = state_path
+    return bin_path, state_path
+
+def reset(state_path):
+    for path in (state_path, state_path + '.calls'):
+        if os.path.exists(path):
+            os.remove(path)
+
+def calls(state_path):
+    with open(state_path + '.calls') as calls_file:
+        return len(calls_file.read().splitlines())
+
+def gen_rules():
+    rules = []
+    for i in xrange(RULES):
+        rules.append([
+            'FORWARD',
+            '-d', '10.0.%d.%d' % (i // 250, i % 250 + 1),
+            '!', '-i', 'tun0',
+            '-o', 'tun0',
+            '-j', 'ACCEPT',
+            '-p', 'tcp',
+            '-m', 'tcp',
+            '--dport', str(8000 + i),
+            '-m', 'comment',
+            '--comment', 'pritunl_benchmark',
+        ])
+    return rules
+
+def per_rule(rules):
+    from pritunl import iptables
+
+    for rule in rules:
+        if not iptables.exists_rule(rule):
+            iptables.utils.check_output_logged(['iptables', '-I'] + rule)
+
+def rule_set(rules):
+    from pritunl import iptables
+
+    iptables.insert_rules(iptables.missing_rules(rules))
+
+def run(name, func, state_path, rules):
+    reset(state_path)
+    start = time.time()
+    func(rules)
+    apply_time = time.time() - start
+    apply_calls = calls(state_path)
+
+    start = time.time()
+    for _ in xrange(ROUNDS):
+        func(rules)
+    check_time = (time.time() - start) / ROUNDS
+    check_calls = (calls(state_path) - apply_calls) / ROUNDS
+
+    print '%s:' % name
+    print '  apply %d rules  %6.2fs  %4d processes' % (
+        len(rules), apply_time, apply_calls)
+    print '  check cycle     %6.2fs  %4d processes' % (
+        check_time, check_calls)
+
+def main():
+    bin_path, state_path = setup_fake()
+    try:
+        rules = gen_rules()
+        run('per rule', per_rule, state_path, rules)
+        run('rule set', rule_set, state_path, rules)
+    finally:
+        shutil.rmtree(bin_path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+# Replay a recorded management interface transcript through the blocking
+# line reader and the non blocking ManagementSocket. Pass a transcript file
+# as the first argument or a synthetic one is generated. Each client env
+# block is answered with a client-auth reply to measure write coalescing.
+# Run from the repository root with python 2.7.
+CLIENTS = 2000
+BYTECOUNTS = 20
+
+import os
+import sys
+import imp
+import time
+import socket
+import threading
+
+ROOT_PATH = os.path.join(os.path.dirname(__file__), '..', '..')
+sys.path.insert(0, ROOT_PATH)
+
+from pritunl.constants import *
+
+# Load the module directly to avoid importing the server package
+ManagementSocket = imp.load_source('management', os.path.join(
+    ROOT_PATH, 'pritunl', 'server', 'management.py')).ManagementSocket
+
+def gen_transcript():
+    lines = []
+    for i in xrange(CLIENTS):
+        lines += [
+            '>CLIENT:CONNECT,%d,1' % i,
+            '>CLIENT:ENV,untrusted_ip=10.%d.%d.%d' % (
+                i // 65536, i // 256 % 256, i % 256),
+            '>CLIENT:ENV,tls_id_0=O=%024x, CN=%024x' % (i, i),
+            '>CLIENT:ENV,IV_HWADDR=00:00:00:00:%02x:%02x' % (
+                i // 256 % 256, i % 256),
+            '>CLIENT:ENV,IV_PLAT=linux',
+            '>CLIENT:ENV,END',
+        ]
+    for _ in xrange(BYTECOUNTS):
+        for i in xrange(CLIENTS):
+            lines.append('>BYTECOUNT_CLI:%d,%d,%d' % (i, 1024, 2048))
+    return '\n'.join(lines) + '\n'
+
+class Handler(object):
+    def __init__(self):
+        self.send = None
+        self.client_id = None
+        self.lines = 0
+        self.replies = 0
+
+    def on_line(self, line):
+        self.lines += 1
+        if line.startswith('>CLIENT:CONNECT'):
+            self.client_id = line.split(',')[1]
+        elif line == '>CLIENT:ENV,END':
+            self.replies += 1
+            self.send('client-auth %s 1\npush "ping 10"\nEND\n' %
+                self.client_id)
+
+def peer(sock, transcript, replies):
+    # Write the transcript in management sized chunks and read replies
+    def reader():
+        data = ''
+        while data.count('END\n') < replies:
+            chunk = sock.recv(SOCKET_BUFFER)
+            if not chunk:
+                break
+            data += chunk
+
+    thread = threading.Thread(target=reader)
+    thread.daemon = True
+    thread.start()
+
+    for i in xrange(0, len(transcript), 4096):
+        sock.sendall(transcript[i:i + 4096])
+    thread.join()
+    sock.close()
+
+def blocking(sock, handler):
+    lock = threading.Lock()
+    writes = [0]
+
+    def send(data):
+        lock.acquire()
+        try:
+            sock.sendall(data)
+            writes[0] += 1
+        finally:
+            lock.release()
+    handler.send = send
+
+    data = ''
+    while True:
+        chunk = sock.recv(SOCKET_BUFFER)
+        if not chunk:
+            break
+        lines = (data + chunk).split('\n')
+        data = lines.pop()
+        for line in lines:
+            line = line.strip()
+            if line:
+                handler.on_line(line)
+    return writes[0]
+
+def selector(sock, handler):
+    management = ManagementSocket(sock, handler.on_line)
+    handler.send = management.send
+    management.run(lambda: False)
+    writes = management.writes
+    management.close()
+    return writes
+
+def run(name, func, transcript, replies):
+    sock, peer_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    handler = Handler()
+
+    thread = threading.Thread(target=peer,
+        args=(peer_sock, transcript, replies))
+    thread.daemon = True
+
+    start = time.time()
+    thread.start()
+    writes = func(sock, handler)
+    elapsed = time.time() - start
+
+    print '%s: %d lines  %.2fs  %d lines/s  %d replies  %d writes' % (
+        name, handler.lines, elapsed, handler.lines / elapsed,
+        handler.replies, writes)
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as transcript_file:
+            transcript = transcript_file.read()
+    else:
+        transcript = gen_transcript()
+    replies = transcript.count('>CLIENT:ENV,END')
+
+    run('blocking', blocking, transcript, replies)
+    run('selector', selector, transcript, replies)
+
+if __name__ == '__main__':
+    main()